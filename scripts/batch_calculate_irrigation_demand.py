@@ -0,0 +1,403 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Batch runner for dynamic_calc_framework_for_estimating_irrigation_demand.py
+# - the runs (GCM, scenario, years, irrigated area file and output) are given in a manifest (json), e.g. jobs/manifest_aqueduct_2021.json
+# - the static inputs (cell area, paddy/nonpaddy fractions, irrigation efficiency and the kc climatologies) are read only once and shared with all runs (shared memory)
+#   (the kc climatologies need about 13.6 GB of shared memory per file at 5 arcmin; "shared_climatology": false in the manifest lets every run read them itself)
+# - the runs are scheduled over a process pool within a total core budget
+#
+# - a single run can also be split in chunks of years or in tiles (bands of rows) that are calculated in parallel and merged (see run_year_chunks and run_tiles, 
+#   and the --parallel_years and --tiles options of dynamic_calc_framework_for_estimating_irrigation_demand.py)
+#
+# usage: python batch_calculate_irrigation_demand.py <manifest.json> [--gcm gfdl-esm4] [--total_cores 96] [--cores_per_run 24] [--resume | --append] [--set key=value ...]
+
+import os
+import sys
+import json
+import shutil
+import datetime
+import argparse
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+import netCDF4 as nc
+
+import pcraster as pcr
+
+from currTimeStep import ModelTime
+import virtualOS as vos
+import dynamic_calc_framework_for_estimating_irrigation_demand as irrigation_demand
+
+import logging
+logger = logging.getLogger(__name__)
+
+# shared memory blocks created/attached by this process (they must be kept open as long as their arrays are used)
+shared_blocks = []
+# descriptors (name of the shared memory block, shape and dtype) of the arrays created by this process, keyed by their data address
+shared_descriptors = {}
+
+# folder of the shared memory blocks (linux)
+shared_memory_folder = "/dev/shm"
+
+def check_shared_memory(size):
+    # fail with a clear message if the shared memory folder (e.g. a small /dev/shm in a container) cannot hold a block of size bytes
+    if not os.path.isdir(shared_memory_folder): return
+    stat = os.statvfs(shared_memory_folder)
+    available = stat.f_bavail * stat.f_frsize
+    if size > available:
+        raise Exception("Not enough shared memory in " + shared_memory_folder + ": " + str(size) + " bytes are needed, but only " + str(available) + " bytes are available. " + \
+                        "Enlarge " + shared_memory_folder + " (e.g. docker --shm-size) or set \"shared_climatology\": false in the manifest (the runs then read the kc climatologies themselves).")
+
+def create_shared_array(shape, dtype):
+    size = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+    check_shared_memory(size)
+    block = shared_memory.SharedMemory(create = True, size = size)
+    shared_blocks.append(block)
+    array = np.ndarray(shape, dtype = dtype, buffer = block.buf)
+    shared_descriptors[array.__array_interface__['data'][0]] = (block.name, tuple(shape), np.dtype(dtype).str)
+    return array
+
+def get_shared_descriptor(array):
+    return shared_descriptors[array.__array_interface__['data'][0]]
+
+def copy_to_shared_array(array):
+    shared_array = create_shared_array(array.shape, array.dtype)
+    shared_array[...] = array
+    return shared_array
+
+def attach_shared_array(descriptor):
+    name, shape, dtype = descriptor
+    try:
+        block = shared_memory.SharedMemory(name = name, track = False)
+    except TypeError:
+        # python < 3.13 (the workers share the resource tracker of the batch process, which unlinks the blocks at the end)
+        block = shared_memory.SharedMemory(name = name)
+    shared_blocks.append(block)
+    return np.ndarray(shape, dtype = np.dtype(dtype), buffer = block.buf)
+
+def get_runs(manifest):
+    # every run is the combination of the manifest settings, the run_template and the run entry
+    # - only the strings of the run_template (that are not given by the entry) are formatted with the values of the run (e.g. "{gcm}/{scenario}"); the other values are used as they are
+    # - the templates are formatted twice, both times from their original strings: the second pass uses the results of the first pass, so that a template may refer to another one
+    settings = dict((key, value) for key, value in manifest.items() if key not in ["runs", "run_template"])
+    template = manifest.get("run_template", {})
+    runs = []
+    for entry in manifest["runs"]:
+        run = dict(settings)
+        run.update(template)
+        run.update(entry)
+        keys = sorted(key for key, value in template.items() if isinstance(value, str) and key not in entry)
+        values = run
+        for i in range(2):
+            values = dict(run, **dict((key, template[key].format(**values)) for key in keys))
+        run = values
+        run["name"] = run.get("name", "%s_%s" % (run.get("gcm", ""), run.get("scenario", "")))
+        runs.append(run)
+    return runs
+
+def get_files(run):
+    input_files  = irrigation_demand.get_input_files(run["pcrglobwb_input_folder"], run["irrigated_area_file"], run["monthly_output_folder"], run["daily_output_folder"])
+    output_files = irrigation_demand.get_output_files(run["output_folder"], run["output_file"], run.get("output_variables", None), bool(run.get("separate_files", False)))
+    return input_files, output_files
+
+def read_shared_static_inputs(run, batch_folder, backend, sparse, climatology = True):
+    # read the static inputs once (exactly as done in a single run) and put them in shared memory
+    # - climatology: also the entire kc climatologies (not for the tiles, which read the kc of their rows only)
+    input_files, output_files = get_files(run)
+    output_files = irrigation_demand.get_output_files(batch_folder, "none.nc")
+    irrigation_demand.set_decoded_field_cache()
+
+    # - the calculation object is only used for reading the static inputs
+    modelTime = ModelTime()
+    modelTime.getStartEndTimeSteps("%s-01-01" % (run["start_year"]), "%s-12-31" % (run["start_year"]))
+    model = irrigation_demand.CalcFramework(input_files["clone_map"], modelTime, input_files, output_files, backend = backend, sparse = sparse)
+
+    shared = {"static_inputs": {}, "climatology": []}
+    for name, field in model.get_static_inputs().items():
+        shared["static_inputs"][name] = get_shared_descriptor(copy_to_shared_array(np.asarray(field)))
+
+    # - the kc climatologies (the entire stacks, covered and clamped as in CalcFramework.dynamic)
+    for kc_file in [input_files["kc_nonpaddy_daily"], input_files["kc_paddy_daily"]] if climatology else []:
+        key, stack = vos.readClimatologyStack(ncFile           = kc_file,\
+                                              varName          = "automatic",\
+                                              cloneMapFileName = input_files["clone_map"],\
+                                              coverValue       = 0.0,\
+                                              minimumValue     = irrigation_demand.minimum_kc,\
+                                              allocate         = create_shared_array)
+        shared["climatology"].append((key, get_shared_descriptor(stack)))
+
+    # - the netcdf files are not needed anymore in this process
+    for ncFile in vos.filecache.keys(): vos.filecache.evict(ncFile)
+
+    return shared
+
+def run_member(run, shared, cores_per_run, backend, sparse):
+
+    # number of threads used by this run
+    os.environ["PCRASTER_NR_WORKER_THREADS"] = str(cores_per_run)
+    os.environ["OMP_NUM_THREADS"] = str(cores_per_run)
+    if hasattr(pcr, "setnrcpus"): pcr.setnrcpus(cores_per_run)
+
+    input_files, output_files = get_files(run)
+    irrigation_demand.prepare_output_folder(output_files, resume = bool(run.get("resume", False)) or bool(run.get("append", False)))
+    logger.info("Batch run " + str(run["name"]) + " with " + str(cores_per_run) + " cores.")
+
+    # static inputs and kc climatologies from the shared memory
+    static_inputs = dict((name, attach_shared_array(descriptor)) for name, descriptor in shared["static_inputs"].items())
+    for key, descriptor in shared["climatology"]:
+        vos.setClimatologyStack(key, attach_shared_array(descriptor))
+
+    irrigation_demand.run(run["start_year"], run["end_year"], input_files, output_files, backend = backend, sparse = sparse, static_inputs = static_inputs, \
+                          async_writer = bool(run.get("async_writer", False)), sync_interval = int(run.get("sync_interval", 12)), \
+                          netcdf_options = run.get("netcdf_options", None), \
+                          resume = bool(run.get("resume", False)), checkpoint_interval = int(run.get("checkpoint_interval", 3)), \
+                          append = bool(run.get("append", False)), fingerprint_mode = run.get("fingerprint", "mtime"), \
+                          engine = run.get("engine", "daily"), tile = run.get("tile", None), prefetch = bool(run.get("prefetch", True)))
+
+    return run["name"]
+
+def release_shared_blocks():
+    # close and unlink the shared memory blocks of this process (the blocks attached by this process are in shared_blocks too; every block is unlinked once)
+    unlinked = set()
+    for block in shared_blocks:
+        block.close()
+        if block.name not in unlinked: block.unlink()
+        unlinked.add(block.name)
+    del shared_blocks[:]
+
+def write_run_output_manifest(run, input_files, output_files):
+    # the output manifest of a run that is calculated entirely (see the --append option of dynamic_calc_framework_for_estimating_irrigation_demand.py)
+    output_start_date = datetime.date(int(run["start_year"]), 1, 1)
+    fingerprints = irrigation_demand.get_input_fingerprints(input_files, range(int(run["start_year"]), int(run["end_year"]) + 1), run.get("fingerprint", "mtime"), run.get("engine", "daily"))
+    manifest = {"output_start_date": str(output_start_date), "months": {}}
+    for month in irrigation_demand.get_months(output_start_date, datetime.date(int(run["end_year"]), 12, 31)): manifest["months"][month] = fingerprints[int(month[0:4])]
+    irrigation_demand.write_output_manifest(output_files, manifest)
+
+def get_year_chunks(start_year, end_year, years_per_chunk):
+    # the chunks (first and last year) of the period
+    start_year, end_year, years_per_chunk = int(start_year), int(end_year), max(1, int(years_per_chunk))
+    return [(year, min(year + years_per_chunk - 1, end_year)) for year in range(start_year, end_year + 1, years_per_chunk)]
+
+def merge_year_chunk(model, chunk_output_files, output_start_date):
+    # copy the months of the output files of a chunk to their time positions in the output files of the run (model: the CalcFramework of the run, used for writing only)
+    for ncFileName, varNames in model.get_output_file_variables().items():
+        with vos.netcdf_lock:
+            with nc.Dataset(chunk_output_files[varNames[0]]) as f:
+                dates  = nc.num2date(f.variables["time"][:], f.variables["time"].units, getattr(f.variables["time"], "calendar", "standard"))
+                fields = dict((varName, np.ma.filled(f.variables[varName][:], vos.MV)) for varName in varNames)
+        for i, date in enumerate(dates):
+            timeStamp = datetime.datetime(date.year, date.month, date.day, 0)
+            posCnt = (date.year - output_start_date.year) * 12 + date.month - output_start_date.month
+            model.netcdf_report.dataList2NetCDF(ncFileName, varNames, dict((varName, fields[varName][i]) for varName in varNames), timeStamp, posCnt = posCnt)
+
+def run_year_chunks(run, processes, years_per_chunk = 1, backend = "pcraster", sparse = False):
+    # a single run (see get_runs) split in chunks of years that are calculated in parallel: every chunk is a run (run_member) in its own process and output folder (<output_folder>/chunks/)
+    # - the runs are independent, as the state is read again at the start of every year (see CalcFramework.dynamic)
+    # - the chunks are merged, in order (while the next ones are calculated), in the output files of the run; the values are the same as in a serial run
+    # - the static inputs and the kc climatologies are read once and shared (see read_shared_static_inputs)
+    input_files, output_files = get_files(run)
+    chunk_folder = output_files["folder"] + "/chunks/"
+    chunks = get_year_chunks(run["start_year"], run["end_year"], years_per_chunk)
+    processes = max(1, min(int(processes), len(chunks)))
+    cores_per_run = max(1, multiprocessing.cpu_count() // processes)
+    logger.info("Year chunks: " + str(chunks) + " ; parallel runs: " + str(processes) + " ; cores per run: " + str(cores_per_run))
+
+    # - the workers use the same folder for caching static fields
+    if vos.static_field_cache_dir != None: os.environ.setdefault("STATIC_FIELD_CACHE_DIR", vos.static_field_cache_dir)
+    shared = read_shared_static_inputs(run, chunk_folder + "/static/", backend, sparse, climatology = bool(run.get("shared_climatology", True)))
+
+    try:
+        # the runs of the chunks (not resumed, without checkpoints and with the default netcdf layout)
+        context = multiprocessing.get_context("spawn")
+        pool = context.Pool(processes = processes, maxtasksperchild = 1)
+        results = []
+        for start_year, end_year in chunks:
+            chunk = dict(run)
+            chunk.update({"name": "%s_%i_%i" % (run.get("name", "run"), start_year, end_year), "start_year": start_year, "end_year": end_year, \
+                          "output_folder": chunk_folder + "/%i_%i/" % (start_year, end_year), "resume": False, "append": False, "checkpoint_interval": 0, \
+                          "async_writer": False, "netcdf_options": None})
+            results.append((chunk, pool.apply_async(run_member, (chunk, shared, cores_per_run, backend, sparse))))
+        pool.close()
+
+        # the output files of the run, written by a CalcFramework of the entire period (with the shared static inputs)
+        output_start_date = datetime.date(int(run["start_year"]), 1, 1)
+        modelTime = ModelTime()
+        modelTime.getStartEndTimeSteps(str(output_start_date), "%s-12-31" % (run["end_year"]))
+        static_inputs = dict((name, attach_shared_array(descriptor)) for name, descriptor in shared["static_inputs"].items())
+        model = irrigation_demand.CalcFramework(input_files["clone_map"], modelTime, input_files, output_files, backend = backend, sparse = sparse, static_inputs = static_inputs, \
+                                                async_writer = bool(run.get("async_writer", False)), sync_interval = int(run.get("sync_interval", 12)), \
+                                                netcdf_options = run.get("netcdf_options", None), checkpoint_interval = 0)
+        del static_inputs
+        model.initial()
+        for chunk, result in results:
+            try:
+                result.get()
+            except Exception as error:
+                pool.terminate()
+                raise Exception("The chunk " + str(chunk["name"]) + " failed: " + str(error))
+            chunk_output_files = get_files(chunk)[1]
+            merge_year_chunk(model, chunk_output_files, output_start_date)
+            logger.info("The chunk " + str(chunk["name"]) + " is merged.")
+        pool.join()
+        model.netcdf_report.close()
+    finally:
+        release_shared_blocks()
+
+    write_run_output_manifest(run, input_files, output_files)
+
+    shutil.rmtree(chunk_folder, ignore_errors = True)
+
+# the rows of the tiles are multiples of this number, so that the tiles are aligned with the cells of coarser inputs (e.g. 6 for 30 arcmin and 12 for 1 degree inputs on the 5 arcmin clone)
+tile_alignment = 12
+
+def get_tiles(rows, nr_of_tiles, tile_rows = None):
+    # the tiles (first row and last row excluded) of a clone map with the given number of rows: bands of tile_rows rows (default: rows / nr_of_tiles)
+    if tile_rows == None: tile_rows = -(-int(rows) // max(1, int(nr_of_tiles)))
+    tile_rows = tile_alignment * max(1, -(-int(tile_rows) // tile_alignment))
+    return [(row, min(row + tile_rows, int(rows))) for row in range(0, int(rows), tile_rows)]
+
+def merge_tiles(model, tile_output_files):
+    # put the tiles (in order) in the output files of the run, month by month (model: the CalcFramework of the run, used for writing only)
+    for ncFileName, varNames in model.get_output_file_variables().items():
+        with vos.netcdf_lock:
+            tile_files = [nc.Dataset(output_files[varNames[0]]) for output_files in tile_output_files]
+        try:
+            time = tile_files[0].variables["time"]
+            dates = nc.num2date(time[:], time.units, getattr(time, "calendar", "standard"))
+            for i, date in enumerate(dates):
+                with vos.netcdf_lock:
+                    varFields = dict((varName, np.concatenate([np.ma.filled(f.variables[varName][i], vos.MV) for f in tile_files])) for varName in varNames)
+                timeStamp = datetime.datetime(date.year, date.month, date.day, 0)
+                model.netcdf_report.dataList2NetCDF(ncFileName, varNames, varFields, timeStamp, posCnt = i)
+        finally:
+            with vos.netcdf_lock:
+                for f in tile_files: f.close()
+
+def run_tiles(run, processes, tile_rows = None, backend = "numpy", sparse = False):
+    # a single run (see get_runs) split in tiles (bands of rows of the clone map) that are calculated in parallel: every tile is a run (run_member) in its own process and output folder (<output_folder>/tiles/)
+    # - the tiles read the hyperslabs of their rows only from the netcdf inputs (see CalcFramework), so that the memory of a process is bounded by the tile size
+    # - the static inputs, including the gap filling of the efficiency with window averages, are calculated once on the full clone map (no halo is needed for the tiles) and shared 
+    # - the tiles are put in the output files of the run when all tiles are finished; the values are the same as in a run without tiles
+    if backend != "numpy": raise Exception("The tiled mode requires the numpy backend.")
+    input_files, output_files = get_files(run)
+    tile_folder = output_files["folder"] + "/tiles/"
+    tiles = get_tiles(vos.getCloneGeometry(input_files["clone_map"]).rows, processes, tile_rows)
+    processes = max(1, min(int(processes), len(tiles)))
+    cores_per_run = max(1, multiprocessing.cpu_count() // processes)
+    logger.info("Tiles (rows): " + str(tiles) + " ; parallel runs: " + str(processes) + " ; cores per run: " + str(cores_per_run))
+
+    if vos.static_field_cache_dir != None: os.environ.setdefault("STATIC_FIELD_CACHE_DIR", vos.static_field_cache_dir)
+    shared = read_shared_static_inputs(run, tile_folder + "/static/", backend, sparse, climatology = False)
+
+    try:
+        # the runs of the tiles (without checkpoints and with the default netcdf layout)
+        context = multiprocessing.get_context("spawn")
+        pool = context.Pool(processes = processes, maxtasksperchild = 1)
+        results = []
+        for row_sta, row_end in tiles:
+            tile = dict(run)
+            tile.update({"name": "%s_rows_%i_%i" % (run.get("name", "run"), row_sta, row_end), "tile": (row_sta, row_end), \
+                         "output_folder": tile_folder + "/%i_%i/" % (row_sta, row_end), "resume": False, "append": False, "checkpoint_interval": 0, \
+                         "async_writer": False, "netcdf_options": None})
+            results.append((tile, pool.apply_async(run_member, (tile, shared, cores_per_run, backend, sparse))))
+        pool.close()
+        for tile, result in results:
+            try:
+                result.get()
+            except Exception as error:
+                pool.terminate()
+                raise Exception("The tile " + str(tile["name"]) + " failed: " + str(error))
+        pool.join()
+
+        # the output files of the run, written by a CalcFramework of the entire clone map (with the shared static inputs)
+        modelTime = ModelTime()
+        modelTime.getStartEndTimeSteps("%s-01-01" % (run["start_year"]), "%s-12-31" % (run["end_year"]))
+        static_inputs = dict((name, attach_shared_array(descriptor)) for name, descriptor in shared["static_inputs"].items())
+        model = irrigation_demand.CalcFramework(input_files["clone_map"], modelTime, input_files, output_files, backend = backend, sparse = sparse, static_inputs = static_inputs, \
+                                                async_writer = bool(run.get("async_writer", False)), sync_interval = int(run.get("sync_interval", 12)), \
+                                                netcdf_options = run.get("netcdf_options", None), checkpoint_interval = 0)
+        del static_inputs
+        model.initial()
+        merge_tiles(model, [get_files(tile)[1] for tile, result in results])
+        model.netcdf_report.close()
+        logger.info("The tiles are merged.")
+    finally:
+        release_shared_blocks()
+
+    write_run_output_manifest(run, input_files, output_files)
+
+    shutil.rmtree(tile_folder, ignore_errors = True)
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Run several irrigation demand calculations (see dynamic_calc_framework_for_estimating_irrigation_demand.py) given in a manifest.")
+    parser.add_argument("manifest", help = "json file with the runs")
+    parser.add_argument("--gcm", default = None, help = "overrides the gcm of the manifest")
+    parser.add_argument("--total_cores", type = int, default = None, help = "total number of cores for all runs (default: manifest total_cores or all cores)")
+    parser.add_argument("--cores_per_run", type = int, default = None, help = "number of cores per run (default: manifest cores_per_run or 24)")
+    parser.add_argument("--resume", action = "store_true", help = "continue the existing output files of the runs (see the --resume option of dynamic_calc_framework_for_estimating_irrigation_demand.py)")
+    parser.add_argument("--append", action = "store_true", help = "calculate only the missing or stale months of the runs (see the --append option of dynamic_calc_framework_for_estimating_irrigation_demand.py)")
+    parser.add_argument("--set", action = "append", default = [], metavar = "KEY=VALUE", help = "overrides a setting of the manifest (e.g. a folder)")
+    args = parser.parse_args()
+
+    with open(args.manifest) as manifest_file: manifest = json.load(manifest_file)
+    if args.gcm != None: manifest["gcm"] = args.gcm
+    if args.resume: manifest["resume"] = True
+    if args.append: manifest["append"] = True
+    if args.resume and args.append: parser.error("--resume and --append cannot be used together")
+    for setting in args.set:
+        key, value = setting.split("=", 1)
+        manifest[key] = value
+    runs = get_runs(manifest)
+
+    backend = manifest.get("backend", "pcraster")
+    sparse  = bool(manifest.get("sparse", False))
+
+    # core budget
+    total_cores   = args.total_cores   or manifest.get("total_cores")   or multiprocessing.cpu_count()
+    cores_per_run = args.cores_per_run or manifest.get("cores_per_run") or 24
+    cores_per_run = max(1, min(cores_per_run, total_cores))
+    nr_of_workers = max(1, min(len(runs), total_cores // cores_per_run))
+
+    # folder for the batch log files (and the temporary files used while reading the static inputs)
+    batch_folder = manifest.get("batch_folder", os.path.join(os.path.dirname(os.path.abspath(runs[0]["output_folder"])), "batch"))
+    try:
+        os.makedirs(batch_folder + "/log/")
+    except:
+        pass
+    vos.initialize_logging(batch_folder + "/log/", log_file_front_name = "batch")
+    logger.info("Batch runs: " + str([run["name"] for run in runs]))
+    logger.info("Total cores: " + str(total_cores) + " ; cores per run: " + str(cores_per_run) + " ; parallel runs: " + str(nr_of_workers))
+
+    # static inputs, shared by all runs (the runs must use the same pcrglobwb input folder)
+    if len(set(run["pcrglobwb_input_folder"] for run in runs)) > 1: raise Exception("All runs in a manifest must use the same pcrglobwb_input_folder.")
+    vos.static_field_cache_dir = os.path.join(batch_folder, "..", "static_field_cache")
+    if "STATIC_FIELD_CACHE_DIR" in os.environ: vos.static_field_cache_dir = os.environ["STATIC_FIELD_CACHE_DIR"]
+    if "STATIC_FIELD_KEY_MODE" in os.environ: vos.static_field_key_mode = os.environ["STATIC_FIELD_KEY_MODE"]
+    shared = read_shared_static_inputs(runs[0], batch_folder, backend, sparse, climatology = bool(manifest.get("shared_climatology", True)))
+
+    # the runs - every run has its own (new) process
+    failed = []
+    try:
+        context = multiprocessing.get_context("spawn")
+        pool = context.Pool(processes = nr_of_workers, maxtasksperchild = 1)
+        results = [(run["name"], pool.apply_async(run_member, (run, shared, cores_per_run, backend, sparse))) for run in runs]
+        pool.close()
+        for name, result in results:
+            try:
+                result.get()
+                logger.info("Batch run " + str(name) + " is finished.")
+            except Exception as error:
+                logger.error("Batch run " + str(name) + " failed: " + str(error))
+                failed.append(name)
+        pool.join()
+    finally:
+        release_shared_blocks()
+
+    if len(failed) > 0: return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Benchmark of netcdf output layouts (chunk shape, compression and quantization): write cost against read cost for map and point (time series) access
+# - a synthetic monthly field (with missing values, as the irrigation demand over land) is written month by month, as done by OutputNetcdf
+# - map access: a few complete months; point access: the time series of a few cells and of a 'basin' (a block of cells)
+# - the time-major copy is made with rechunk_netcdf.py
+#
+# usage: python benchmark_netcdf_layout.py [rows] [cols] [months] [work_folder]
+#        (default: 360 720 240 /tmp; the global 5 arcmin grid is 2160 4320)
+
+import os
+import sys
+import time
+import datetime
+
+import numpy as np
+import netCDF4 as nc
+
+import virtualOS as vos
+from outputNetcdf import OutputNetcdf
+import rechunk_netcdf
+
+def timed(function, *args):
+    start = time.time()
+    result = function(*args)
+    return time.time() - start, result
+
+def write_file(ncFileName, fields, layout):
+    rows, cols = fields.shape[1:]
+    report = OutputNetcdf({'cellsize': 180. / rows, 'rows': rows, 'cols': cols, 'xUL': -180., 'yUL': 90.}, netcdf_format = "NETCDF4", **layout)
+    report.createNetCDF(ncFileName, "estimate_irrigation_demand", "km3.month-1")
+    for month in range(len(fields)):
+        timeStamp = datetime.datetime(2001 + month // 12, month % 12 + 1, 1)
+        report.dataList2NetCDF(ncFileName, ["estimate_irrigation_demand"], {"estimate_irrigation_demand": fields[month]}, timeStamp)
+    report.close()
+
+def read_maps(ncFileName, months):
+    with nc.Dataset(ncFileName) as f:
+        for month in months: f.variables["estimate_irrigation_demand"][month, :, :]
+
+def read_points(ncFileName, cells):
+    with nc.Dataset(ncFileName) as f:
+        for row, col in cells: f.variables["estimate_irrigation_demand"][:, row, col]
+
+def read_basin(ncFileName, rows, cols):
+    with nc.Dataset(ncFileName) as f:
+        f.variables["estimate_irrigation_demand"][:, rows, cols].sum(axis = (1, 2))
+
+def main():
+
+    rows, cols, months = 360, 720, 240
+    if len(sys.argv) > 3: rows, cols, months = int(sys.argv[1]), int(sys.argv[2]), int(sys.argv[3])
+    work_folder = "/tmp"
+    if len(sys.argv) > 4: work_folder = sys.argv[4]
+
+    # synthetic monthly fields (km3/month) with missing values over 'sea'
+    random = np.random.RandomState(0)
+    land   = random.rand(rows, cols) > 0.6
+    fields = (random.rand(months, rows, cols) * 1e-3).astype(np.float32)
+    fields[:, ~land] = vos.MV
+
+    map_months = random.randint(0, months, 12)
+    cells      = list(zip(random.randint(0, rows, 20), random.randint(0, cols, 20)))
+    basin      = (slice(rows // 3, rows // 3 + rows // 20 + 1), slice(cols // 3, cols // 3 + cols // 20 + 1))
+
+    layouts = [("default (no compression)",         {}),\
+               ("zlib",                             {'netcdf_zlib': True}),\
+               ("zlib, chunks (1, rows, cols)",     {'netcdf_zlib': True, 'netcdf_chunksizes': (1, rows, cols)}),\
+               ("zlib, chunks (12, 64, 64)",        {'netcdf_zlib': True, 'netcdf_chunksizes': (12, 64, 64)}),\
+               ("zlib, chunks (12, 64, 64), lsd 8", {'netcdf_zlib': True, 'netcdf_chunksizes': (12, 64, 64), 'netcdf_least_significant_digit': 8}),\
+               ("zlib, chunks (12, 64, 64), async", {'netcdf_zlib': True, 'netcdf_chunksizes': (12, 64, 64), 'async_writer': True})]
+
+    print("%i x %i cells, %i months" % (rows, cols, months))
+    print("%-40s %10s %10s %10s %10s %10s" % ("layout", "write (s)", "size (MB)", "maps (s)", "points (s)", "basin (s)"))
+    for name, layout in layouts + [("time-major copy (rechunk_netcdf.py)", None)]:
+        ncFileName = os.path.join(work_folder, "benchmark_netcdf_layout.nc")
+        if layout == None:
+            # - the cost of the copy (from the last written file) is reported as the write cost
+            copyFileName = os.path.join(work_folder, "benchmark_netcdf_layout_time_major.nc")
+            time_write, _ = timed(rechunk_netcdf.rechunk, ncFileName, copyFileName)
+            ncFileName = copyFileName
+        else:
+            time_write, _ = timed(write_file, ncFileName, fields, layout)
+        time_maps,   _ = timed(read_maps,   ncFileName, map_months)
+        time_points, _ = timed(read_points, ncFileName, cells)
+        time_basin,  _ = timed(read_basin,  ncFileName, basin[0], basin[1])
+        print("%-40s %10.3f %10.1f %10.3f %10.3f %10.3f" % (name, time_write, os.path.getsize(ncFileName) / 1024.**2, time_maps, time_points, time_basin))
+
+    for fileName in ["benchmark_netcdf_layout.nc", "benchmark_netcdf_layout_time_major.nc"]:
+        os.remove(os.path.join(work_folder, fileName))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Benchmark of the vectorized regridData2FinerGrid and regridToCoarse against their old (Python loop) versions
+# - global case: 30 arcmin (360 x 720) to 5 arcmin (2160 x 4320) and back
+#
+# usage: python benchmark_regrid.py [number_of_coarse_rows]
+#        (use a smaller number of rows to limit the run time of the old regridToCoarse)
+
+import sys
+import time
+
+import numpy as np
+
+import virtualOS as vos
+
+def timed(function, *args):
+    start = time.time()
+    result = function(*args)
+    return time.time() - start, result
+
+def main():
+
+    # 30 arcmin global grid (or a band of it) and the factor to the 5 arcmin grid
+    nr_coarse_rows = 360
+    if len(sys.argv) > 1: nr_coarse_rows = int(sys.argv[1])
+    factor = 6
+
+    coarse = np.random.RandomState(0).rand(nr_coarse_rows, 720).astype(np.float32)
+    coarse[np.random.RandomState(1).rand(nr_coarse_rows, 720) > 0.7] = vos.MV
+
+    print("30 arcmin to 5 arcmin: %i x %i to %i x %i" % (coarse.shape[0], coarse.shape[1], coarse.shape[0]*factor, coarse.shape[1]*factor))
+
+    time_old, fine_old = timed(vos.regridData2FinerGridOLD, factor, coarse, vos.MV)
+    time_new, fine_new = timed(vos.regridData2FinerGrid,    factor, coarse, vos.MV)
+    print("regridData2FinerGrid     old: %8.3f s   new: %8.3f s   speed-up: %8.1f   identical: %s" % (time_old, time_new, time_old / max(time_new, 1e-9), np.array_equal(fine_old, fine_new)))
+
+    # back to 30 arcmin with a field that has missing values at the fine resolution
+    fine = np.random.RandomState(2).rand(coarse.shape[0]*factor, coarse.shape[1]*factor)
+    fine[np.random.RandomState(3).rand(*fine.shape) > 0.7] = vos.MV
+    for mode in ['average', 'median', 'sum', 'min', 'max']:
+        time_old, coarse_old = timed(vos.regridToCoarseOLD, fine, factor, mode, vos.MV)
+        time_new, coarse_new = timed(vos.regridToCoarse,    fine, factor, mode, vos.MV)
+        print("regridToCoarse %-8s  old: %8.3f s   new: %8.3f s   speed-up: %8.1f   max. abs. difference: %g" % (mode, time_old, time_new, time_old / max(time_new, 1e-9), np.max(np.abs(coarse_old - coarse_new))))
+
+if __name__ == '__main__':
+    sys.exit(main())
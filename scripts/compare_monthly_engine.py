@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Regression harness for the monthly engine of dynamic_calc_framework_for_estimating_irrigation_demand.py (--engine monthly) against the daily engine
+# - both engines are run (in their own processes) with all output variables, in <work_folder>/daily and <work_folder>/monthly
+# - the difference is reported per variable and month: the totals (km3/month), the relative difference of the totals, the normalized absolute difference
+#   (sum |monthly - daily| / sum |daily|), the 95th percentile and the maximum of the cell relative differences, and the cells that are missing in one of the files only
+# - the monthly engine uses the monthly et0 (referencePotET_monthTot_output_*.nc in the monthly output folder) and the monthly mean kc, so that the
+#   irrigation requirement (and the water gap and the demand) differ by the covariance of kc and et0 within the month; the supply and withdrawal should be the same
+#
+# usage: python compare_monthly_engine.py <start_year> <end_year> <pcrglobwb_input_folder> <irrigated_area_in_hectar_input_file> \
+#                                         <pcrglobwb_monthly_output_folder> <pcrglobwb_daily_output_folder> <work_folder> [--backend numpy] [--sparse] [--compare_only]
+
+import os
+import sys
+import argparse
+import subprocess
+import time
+
+import numpy as np
+import netCDF4 as nc
+
+output_file = "irrigation_demand.nc"
+variables   = ["estimate_irrigation_demand", "irrigation_requirement", "irrigation_supply", "irrigation_withdrawal", "irrigation_water_gap"]
+
+def run_engine(args, engine):
+    # run the calculation with the given engine; returns the wall clock time (s)
+    script  = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dynamic_calc_framework_for_estimating_irrigation_demand.py")
+    command = [sys.executable, script, args.start_year, args.end_year, args.pcrglobwb_input_folder, args.irrigated_area_in_hectar_input_file, \
+               args.pcrglobwb_monthly_output_folder, args.pcrglobwb_daily_output_folder, os.path.join(args.work_folder, engine), output_file, \
+               "--engine", engine, "--backend", args.backend, "--output_variables", ",".join(variables), "--checkpoint_interval", "0"]
+    if args.sparse: command.append("--sparse")
+    start = time.time()
+    with open(os.path.join(args.work_folder, engine + ".stdout"), "w") as stdout:
+        subprocess.check_call(command, stdout = stdout, stderr = subprocess.STDOUT)
+    return time.time() - start
+
+def read_variable(ncFileName, varName):
+    # float64 array [time, lat, lon] with NaN as missing values, and the dates
+    with nc.Dataset(ncFileName) as f:
+        field = np.ma.filled(np.ma.asarray(f.variables[varName][:]).astype(np.float64), np.nan)
+        dates = nc.num2date(f.variables["time"][:], f.variables["time"].units, getattr(f.variables["time"], "calendar", "standard"))
+    field[field == 1e20] = np.nan
+    return field, dates
+
+def compare_month(daily, monthly):
+    # statistics of the difference of the monthly engine (monthly) against the daily engine (daily) for one month
+    valid = ~np.isnan(daily) & ~np.isnan(monthly)
+    d, m  = daily[valid], monthly[valid]
+    total_daily, total_monthly = d.sum(), m.sum()
+    relative_total = (total_monthly - total_daily) / abs(total_daily) if total_daily != 0.0 else 0.0
+    normalized_abs = np.abs(m - d).sum() / np.abs(d).sum() if np.abs(d).sum() > 0.0 else 0.0
+    # - cell relative differences of the cells with values (relative to the largest value, to ignore the negligible ones)
+    significant = np.abs(d) > 1e-6 * np.abs(d).max() if len(d) > 0 else np.zeros(0, dtype = bool)
+    relative = np.abs(m - d)[significant] / np.abs(d)[significant]
+    p95 = np.percentile(relative, 95) if len(relative) > 0 else 0.0
+    rel_max = relative.max() if len(relative) > 0 else 0.0
+    mask_differences = int((np.isnan(daily) != np.isnan(monthly)).sum())
+    return total_daily, total_monthly, relative_total, normalized_abs, p95, rel_max, mask_differences
+
+def compare(work_folder):
+    # report of the differences; returns the largest normalized absolute difference per variable
+    summary = {}
+    for varName in variables:
+        daily,   dates = read_variable(os.path.join(work_folder, "daily",   output_file), varName)
+        monthly, _     = read_variable(os.path.join(work_folder, "monthly", output_file), varName)
+        if daily.shape != monthly.shape: raise Exception("The output files of " + varName + " have different shapes: " + str(daily.shape) + " and " + str(monthly.shape))
+        print("")
+        print(varName)
+        print("%-10s %14s %14s %12s %12s %12s %12s %8s" % ("month", "daily (km3)", "monthly (km3)", "rel. total", "norm. abs.", "cell p95", "cell max", "mask"))
+        summary[varName] = 0.0
+        for i in range(len(daily)):
+            statistics = compare_month(daily[i], monthly[i])
+            print("%-10s %14.6e %14.6e %12.3e %12.3e %12.3e %12.3e %8i" % ((str(dates[i])[0:7],) + statistics))
+            summary[varName] = max(summary[varName], statistics[3])
+        statistics = compare_month(np.nansum(daily, axis = 0), np.nansum(monthly, axis = 0))
+        print("%-10s %14.6e %14.6e %12.3e %12.3e %12.3e %12.3e %8s" % (("all",) + statistics[0:6] + ("",)))
+    return summary
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Compare the monthly engine with the daily engine of dynamic_calc_framework_for_estimating_irrigation_demand.py.")
+    parser.add_argument("start_year")
+    parser.add_argument("end_year")
+    parser.add_argument("pcrglobwb_input_folder")
+    parser.add_argument("irrigated_area_in_hectar_input_file")
+    parser.add_argument("pcrglobwb_monthly_output_folder")
+    parser.add_argument("pcrglobwb_daily_output_folder")
+    parser.add_argument("work_folder")
+    parser.add_argument("--backend", default = "numpy", help = "compute backend of both runs (default: numpy)")
+    parser.add_argument("--sparse", action = "store_true", help = "sparse mode for both runs")
+    parser.add_argument("--compare_only", action = "store_true", help = "compare the output files of earlier runs in the work folder")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.work_folder): os.makedirs(args.work_folder)
+    if not args.compare_only:
+        for engine in ["daily", "monthly"]:
+            print("%s engine: %.1f s" % (engine, run_engine(args, engine)))
+
+    summary = compare(args.work_folder)
+    print("")
+    print("largest monthly normalized absolute difference: " + ", ".join("%s %.3e" % (varName, summary[varName]) for varName in variables))
+
+if __name__ == '__main__':
+    sys.exit(main())
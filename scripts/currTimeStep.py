@@ -192,3 +192,43 @@ class ModelTime(object):
     def __str__(self):
         #~ print self._currTime
         return str(self._currTime)
+
+
+class MonthlyModelTime(ModelTime):
+    # model time with monthly time steps: the time step n is the last day of the n-th month since the start time
+    # - the start and end times are rounded to entire months (the first and the last day of their months)
+
+    def getStartEndTimeSteps(self,strStartTime,strEndTime,showNumberOfTimeSteps=True):
+        ModelTime.getStartEndTimeSteps(self,strStartTime,strEndTime,showNumberOfTimeSteps=False)
+        self._nrOfTimeSteps = 12 * (self.endTime.year - self.startTime.year) + self.endTime.month - self.startTime.month + 1
+        if showNumberOfTimeSteps == True: logger.info("number of (monthly) time steps: "+str(self._nrOfTimeSteps))
+
+    def setStartTime(self, date):
+        self._startTime = date
+        self._nrOfTimeSteps = 12 * (self.endTime.year - self.startTime.year) + self.endTime.month - self.startTime.month + 1
+
+    def setEndTime(self, date):
+        self._endTime = date
+        self._nrOfTimeSteps = 12 * (self.endTime.year - self.startTime.year) + self.endTime.month - self.startTime.month + 1
+
+    def update(self,timeStepPCR):
+        self._timeStepPCR = timeStepPCR
+        
+        # the last day of the month
+        monthIndex = self._startTime.month - 1 + (timeStepPCR - 1)
+        year, month = self._startTime.year + monthIndex // 12, monthIndex % 12 + 1
+        self._currTime = datetime.date(year + month // 12, month % 12 + 1, 1) - datetime.timedelta(days=1)
+        self._fulldate = '%04i-%02i-%02i' %(self._currTime.year, self._currTime.month, self._currTime.day)
+
+        self._currTimeFull = datetime.datetime(self.year,self.month,self.day)
+        
+        # every time step is the last day of a month
+        self._monthIdx = self._monthIdx + 1
+        if self.isLastDayOfYear():
+            self._annuaIdx = self._annuaIdx + 1
+
+    def isFirstMonthOfYear(self):
+        return self.month == 1
+
+    def isLastTimeStep(self):
+        return self.timeStepPCR == self.nrOfTimeSteps
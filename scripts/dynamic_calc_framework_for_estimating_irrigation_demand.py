@@ -3,7 +3,15 @@
 
 import os
 import sys
+import argparse
 import datetime
+import json
+import hashlib
+import math
+import resource
+
+import numpy as np
+import netCDF4 as nc
 
 import pcraster as pcr
 from pcraster.framework import DynamicModel
@@ -11,71 +19,464 @@ from pcraster.framework import DynamicFramework
 
 # time object
 from currTimeStep import ModelTime
+from currTimeStep import MonthlyModelTime
 
 from outputNetcdf import OutputNetcdf
+import inputPrefetcher
+from inputPrefetcher import InputPrefetcher
 import virtualOS as vos
 
 import logging
 logger = logging.getLogger(__name__)
 
+# compute backends: "pcraster" (PCRaster maps) or "numpy" (float32 arrays with NaN as missing values; PCRaster is then only used for reading pcraster maps and the windowaverage preprocessing) 
+backends = ["pcraster", "numpy"]
+
+# time stepping engines: "daily" (daily time steps; the monthly crop requirement is the sum of the daily kc * et0) or "monthly" (monthly time steps; 
+# the monthly crop requirement is the monthly mean kc * monthly et0, see CalcFramework.calculate_crop_requirement_monthly) 
+engines = ["daily", "monthly"]
+
+# the following operations are used in the formulas of both backends
+
+def cover(field, value):
+    if isinstance(field, np.ndarray): return np.where(np.isnan(field), np.float32(value), field)
+    return pcr.cover(field, value)
+
+def maximum(value, field):
+    if isinstance(field, np.ndarray): return np.maximum(np.float32(value), field)
+    return pcr.max(value, field)
+
+def minimum(value, field):
+    if isinstance(field, np.ndarray): return np.minimum(np.float32(value), field)
+    return pcr.min(value, field)
+
+# static inputs (see CalcFramework.read_static_inputs)
+static_input_names = ["cell_area_total", "paddy_fraction_over_irrigated_area", "nonpaddy_fraction_over_irrigated_area", "efficiency"]
+
+# netcdf inputs of the decoded field store (see virtualOS.registerDecodedFieldFiles) - the inputs of the pcrglobwb input folder, which are the same for all runs
+decoded_input_names = ["kc_nonpaddy_daily", "kc_paddy_daily", "efficiency", "cell_area", "irrigated_area_in_hectar"]
+
+# minimum kc - as used in PCR-GLOBWB runs
+minimum_kc = 0.2
+
+# fields that are kept in the checkpoints (see CalcFramework.write_checkpoint)
+checkpoint_fields = ["irrigated_area", "cell_area_nonpaddy", "cell_area_paddy"]
+
+# output variables (all in km3.month-1) that can be reported (see get_output_files)
+# - title: used for the netcdf title attribute
+# - sparse_grid: the full grid field (attribute of CalcFramework) with the values of the cells without irrigated areas in the sparse mode
+output_variables = {}
+output_variables["estimate_irrigation_demand"] = {"title": "Monthly estimate irrigation demand (km3/month).",              "sparse_grid": "estimate_irrigation_demand_grid"}
+output_variables["irrigation_requirement"]     = {"title": "Monthly irrigation requirement (km3/month).",                  "sparse_grid": "irrigation_requirement_grid"}
+output_variables["irrigation_supply"]          = {"title": "Monthly irrigation supply, corrected with efficiency (km3/month).", "sparse_grid": "irrigation_supply_grid"}
+output_variables["irrigation_withdrawal"]      = {"title": "Monthly irrigation withdrawal (km3/month).",                   "sparse_grid": "irrigation_withdrawal_grid"}
+output_variables["irrigation_water_gap"]       = {"title": "Monthly irrigation water gap (km3/month).",                    "sparse_grid": "irrigation_water_gap_grid"}
+
+# regional runs (see prepare_region): the region is extended to a multiple of this number of cells, so that it is aligned with the cells of coarser inputs 
+# (e.g. 6 for 30 arcmin and 12 for 1 degree inputs on the 5 arcmin clone)
+region_alignment = 12
+
+def get_efficiency_window_sizes(cellsize, rows, cols):
+    # the window sizes (map units) of the gap filling (extrapolation) of the irrigation efficiency, as done in PCR-GLOBWB (see CalcFramework.read_efficiency)
+    window_size = 1.25 * cellsize
+    window_size = min(window_size, min(rows, cols)*cellsize)
+    return (window_size, window_size, window_size, window_size, window_size, 0.75, 1.00, 1.50)
+
+def get_efficiency_halo(cellsize, rows, cols):
+    # number of cells around a region that can change the gap filled efficiency of the region (the reach of all window averages)
+    return sum(int(math.ceil(size / (2. * cellsize))) + 1 for size in get_efficiency_window_sizes(cellsize, rows, cols))
+
 class CalcFramework(DynamicModel):
 
     def __init__(self, cloneMapFileName,\
                        modelTime, \
                        input_files, \
-                       output_files
+                       output_files, \
+                       backend = "pcraster", \
+                       sparse = False, \
+                       static_inputs = None, \
+                       async_writer = False, \
+                       sync_interval = 12, \
+                       netcdf_options = None, \
+                       resume = False, \
+                       checkpoint_interval = 3, \
+                       output_start_date = None, \
+                       engine = "daily", \
+                       tile = None, \
+                       region = None, \
+                       prefetch = True
                        ):
         DynamicModel.__init__(self)
         
+        # compute backend (see backends)
+        self.backend = backend
+        
+        # sparse mode (numpy backend only): the calculation is done for the cells with irrigated areas only (see update_cells)
+        self.sparse = sparse
+        if self.sparse and self.backend != "numpy": raise Exception("The sparse mode requires the numpy backend.")
+        
         # set the clone map
         self.cloneMapFileName = cloneMapFileName
         pcr.setclone(self.cloneMapFileName)
+        # - the clone header is read only once (see the clone geometry registry in virtualOS)
+        self.cloneGeometry = vos.getCloneGeometry(self.cloneMapFileName)
+        
+        # tiled mode (numpy backend only): the calculation is done for a band of rows (tile: first row and last row excluded) of the clone map
+        # - the tile geometry is used as the clone of the numpy readers, so that only the hyperslab of the tile is read from the netcdf inputs
+        # - the static inputs must be given (on the full clone map, see batch_calculate_irrigation_demand.run_tiles)
+        self.tile = tile
+        if self.tile != None:
+            if self.backend != "numpy": raise Exception("The tiled mode requires the numpy backend.")
+            if static_inputs == None: raise Exception("The tiled mode requires the static inputs.")
+            self.cloneGeometry    = vos.getTileGeometry(self.cloneGeometry, self.tile[0], self.tile[1])
+            self.cloneMapFileName = self.cloneGeometry
         
-        # time variable/object
+        # time variable/object (a MonthlyModelTime for the monthly engine)
         self.modelTime = modelTime
+        self.engine    = engine
+        if self.engine not in engines: raise Exception("Unknown engine: " + str(self.engine) + " (see engines).")
         
         # a dictionary containing input files
         self.input_files = input_files
+        # - the netcdf inputs whose decoded fields are kept in the decoded field store (if any, see virtualOS)
+        vos.registerDecodedFieldFiles([self.input_files[name] for name in decoded_input_names if name in self.input_files])
         
         # a dictionary containing output files
         self.output_files  = output_files 
         self.output_folder = self.output_files["folder"]
         
+        # checkpoints (see write_checkpoint) and resuming
+        # - checkpoint_interval: a checkpoint is written at the end of the months that are a multiple of this number (0: no checkpoints)
+        # - resume: the output files exist already and the run continues them (starting from the first day of the model time)
+        # - output_start_date: the first day of the output files (the start of the original run), used for the time positions in the output files 
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_file     = self.output_folder + "/checkpoint/checkpoint.npz"
+        self.resume              = resume
+        self.output_start_date   = output_start_date
+        if self.output_start_date == None: self.output_start_date = self.modelTime.startTime
+        
+        # regional run (see prepare_region): the clone map is the one of the region; the region contains the clone map of the region with a halo (for the gap filling of the efficiency) and the mask 
+        self.region = region
+        
         # prepare temporary directory
         self.tmpDir = self.output_folder + "/tmp/"
         try:
             os.makedirs(self.tmpDir)
         except:
-            os.system('rm -r '+tmpDir+"/*")
+            os.system('rm -r '+self.tmpDir+"/*")
+        
+        # static inputs: cell area, paddy and nonpaddy fractions over irrigated areas, and irrigation efficiency 
+        # - these can also be given as numpy arrays (e.g. from the shared memory of the batch runner, see batch_calculate_irrigation_demand.py)
+        if static_inputs == None:
+            self.read_static_inputs()
+        else:
+            for name in static_input_names:
+                field = static_inputs[name]
+                # - tiled mode: the rows of the tile
+                if self.tile != None and field.shape[0] != self.cloneGeometry.rows: field = field[self.tile[0]:self.tile[1]]
+                setattr(self, name, self.to_backend(field))
+        
+        # regional run with a mask: the cells outside the mask are missing values (in all output variables)
+        if self.region != None and self.region["mask"] is not None:
+            for name in static_input_names:
+                field = np.array(self.to_numpy(getattr(self, name)), dtype = np.float32)
+                field[~self.region["mask"]] = np.nan
+                setattr(self, name, self.to_backend(field))
+        
+        # sparse mode: the static fields are kept on the full grid; their values for the cells with irrigated areas are gathered in update_cells
+        # - cells_version is increased every time the cells change (it is a part of the keys of the inputs that are read ahead, see read_input)
+        self.cells_version = 0
+        if self.sparse:
+            self.static_grids = {}
+            for name in static_input_names:
+                self.static_grids[name] = getattr(self, name)
+            self.cells = None
+            # - the irrigation requirement of cells without irrigated areas: zero (or missing values if the paddy/nonpaddy fractions are missing, as in the full calculation)
+            self.static_grids["no_irrigation_requirement"] = 0.0 * (self.paddy_fraction_over_irrigated_area + self.nonpaddy_fraction_over_irrigated_area)
+        
+        # monthly engine: the monthly means of the (covered and clamped) daily kc climatologies
+        if self.engine == "monthly":
+            self.kc_monthly_means = {}
+            for name in ["kc_nonpaddy_daily", "kc_paddy_daily"]: self.kc_monthly_means[name] = self.read_kc_monthly_means(self.input_files[name])
+        
+        # object for reporting
+        # - async_writer: the monthly fields are written (and synced every sync_interval months) by a background thread (see OutputNetcdf)
+        # - netcdf_options: layout of the output variable (zlib, complevel, shuffle, chunksizes and least_significant_digit, see OutputNetcdf)
+        if netcdf_options == None: netcdf_options = {}
+        self.netcdf_report = OutputNetcdf(mapattr_dict = None,\
+                                          cloneMapFileName = self.cloneMapFileName,\
+                                          netcdf_format = "NETCDF4",\
+                                          netcdf_zlib = netcdf_options.get("zlib", False),\
+                                          netcdf_attribute_dict = None,\
+                                          netcdf_complevel = netcdf_options.get("complevel", 4),\
+                                          netcdf_shuffle = netcdf_options.get("shuffle", True),\
+                                          netcdf_chunksizes = netcdf_options.get("chunksizes", None),\
+                                          netcdf_least_significant_digit = netcdf_options.get("least_significant_digit", None),\
+                                          async_writer = async_writer,\
+                                          sync_interval = sync_interval)       
+
+        # read-ahead of the inputs: the inputs of the next reads are read by a background thread while the model calculates (see prefetch_inputs)
+        self.prefetcher = None
+        if prefetch: self.prefetcher = InputPrefetcher(max_items = 8)
+
+        
+    def read_static_inputs(self):
         
         # cell area (m2)
-        self.cell_area_total = vos.readPCRmapClone(v = self.input_files["cell_area"], \
+        self.cell_area_total = self.to_backend(
+                               vos.readPCRmapClone(v = self.input_files["cell_area"], \
                                                    cloneMapFileName = self.cloneMapFileName, \
                                                    tmpDir = self.tmpDir
-                                                   )
+                                                   ))
         
         # nonpaddy and paddy fractions - unit: m2.m-2 
-        nonpaddy_fraction = vos.readPCRmapClone(v = self.input_files["nonpaddy_fraction"], \
+        nonpaddy_fraction = self.to_backend(
+                            vos.readPCRmapClone(v = self.input_files["nonpaddy_fraction"], \
                                                 cloneMapFileName = self.cloneMapFileName, \
-                                                tmpDir = self.tmpDir)
-        paddy_fraction    = vos.readPCRmapClone(v = self.input_files["paddy_fraction"], \
+                                                tmpDir = self.tmpDir))
+        paddy_fraction    = self.to_backend(
+                            vos.readPCRmapClone(v = self.input_files["paddy_fraction"], \
                                                 cloneMapFileName = self.cloneMapFileName, \
-                                                tmpDir = self.tmpDir)
+                                                tmpDir = self.tmpDir))
         # for cells with irrigated areas, their paddy and nonpaddy fractions/distributions are calculated as the following
         # paddy fraction over irrigated area only - unit: m2.m-2
-        self.paddy_fraction_over_irrigated_area    = pcr.ifthenelse(nonpaddy_fraction + paddy_fraction > 0.0, paddy_fraction / (nonpaddy_fraction + paddy_fraction), 0.0)                                   
-        self.paddy_fraction_over_irrigated_area    = pcr.min(1.0, self.paddy_fraction_over_irrigated_area)
+        if self.backend == "numpy":
+            total_fraction = nonpaddy_fraction + paddy_fraction
+            with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                self.paddy_fraction_over_irrigated_area = np.where(total_fraction > 0.0, paddy_fraction / total_fraction, np.float32(0.0))
+            # - as pcr.ifthenelse, missing values in the condition give missing values
+            self.paddy_fraction_over_irrigated_area[np.isnan(total_fraction)] = np.nan
+        else:
+            self.paddy_fraction_over_irrigated_area = pcr.ifthenelse(nonpaddy_fraction + paddy_fraction > 0.0, paddy_fraction / (nonpaddy_fraction + paddy_fraction), 0.0)                                   
+        self.paddy_fraction_over_irrigated_area    = minimum(1.0, self.paddy_fraction_over_irrigated_area)
         # nonpaddy fraction over irrigated area only - unit: m2.m-2
-        self.nonpaddy_fraction_over_irrigated_area = pcr.max(0.0, 1.0 - self.paddy_fraction_over_irrigated_area)                                   
+        self.nonpaddy_fraction_over_irrigated_area = maximum(0.0, 1.0 - self.paddy_fraction_over_irrigated_area)                                   
         
-        # object for reporting
-        self.netcdf_report = OutputNetcdf(mapattr_dict = None,\
-                                          cloneMapFileName = cloneMapFileName,\
-                                          netcdf_format = "NETCDF4",\
-                                          netcdf_zlib = False,\
-                                          netcdf_attribute_dict = None,)       
+        # irrigation efficiency - dimensionless - this is a static field, calculated only once per run (and cached on disk; see vos.getCachedStaticField)
+        self.efficiency = self.read_efficiency()
+
+    def get_static_inputs(self):
+        # static inputs as numpy arrays (NaN as missing values)
+        if self.sparse: return dict((name, self.static_grids[name]) for name in static_input_names)
+        return dict((name, self.to_numpy(getattr(self, name))) for name in static_input_names)
+
+    def read_efficiency(self):
+
+        # parameters of the gap filling (extrapolation) - these are part of the key of the cached field
+        # - regional run: the window sizes are the ones of the entire clone map and the gap filling is done on the region with a halo (see prepare_region),
+        #   so that the efficiency of the region is the same as in the run of the entire clone map
+        rows, cols = pcr.clone().nrRows(), pcr.clone().nrCols()
+        if self.region != None: rows, cols = self.region["clone_rows"], self.region["clone_cols"]
+        parameters = {"clone"       : tuple(self.cloneGeometry),\
+                      "window_sizes": get_efficiency_window_sizes(pcr.clone().cellSize(), rows, cols),\
+                      "cover_value" : 1.0,\
+                      "minimum"     : 0.1}
+        if self.region != None: parameters["halo_clone"] = tuple(vos.getCloneGeometry(self.region["halo_clone_map"]))
+        
+        def calculate_efficiency():
+            
+            efficiency_clone = self.cloneMapFileName
+            if self.region != None: 
+                efficiency_clone = self.region["halo_clone_map"]
+                pcr.setclone(efficiency_clone)
+            
+            efficiency = vos.readPCRmapClone(v = self.input_files["efficiency"], \
+                                             cloneMapFileName = efficiency_clone, \
+                                             tmpDir = self.tmpDir)
+            
+            # extrapolate efficiency map as done in PCR-GLOBWB 
+            try:
+                for size in parameters["window_sizes"]:
+                    efficiency = pcr.cover(efficiency, pcr.windowaverage(efficiency, size))
+            except:
+                pass
+            efficiency = pcr.cover(efficiency, parameters["cover_value"])
+            efficiency = pcr.max(parameters["minimum"], efficiency)
+            efficiency = pcr.pcr2numpy(efficiency, vos.MV)
+            
+            # - regional run: the region without the halo
+            if self.region != None:
+                pcr.setclone(self.cloneMapFileName)
+                row, col = self.region["window"][0] - self.region["halo_window"][0], self.region["window"][2] - self.region["halo_window"][2]
+                efficiency = efficiency[row:row + self.cloneGeometry.rows, col:col + self.cloneGeometry.cols]
+            
+            return efficiency
+        
+        efficiency = vos.getCachedStaticField(name        = "efficiency",\
+                                              sourceFiles = [self.input_files["efficiency"]],\
+                                              parameters  = parameters,\
+                                              calculate   = calculate_efficiency)
+        
+        if self.backend == "numpy": return self.to_backend(efficiency)
+        return pcr.numpy2pcr(pcr.Scalar, efficiency, vos.MV)
+
+    def read_kc_monthly_means(self, kc_file):
 
+        # the monthly means of the daily kc (see vos.readClimatologyMonthlyMeans), calculated only once (and cached on disk; see vos.getCachedStaticField)
+        parameters = {"clone"      : tuple(self.cloneGeometry),\
+                      "cover_value": 0.0,\
+                      "minimum"    : minimum_kc}
         
+        def calculate_kc_monthly_means():
+            return vos.readClimatologyMonthlyMeans(ncFile           = kc_file,\
+                                                   varName          = "automatic",\
+                                                   cloneMapFileName = self.cloneMapFileName,\
+                                                   coverValue       = parameters["cover_value"],\
+                                                   minimumValue     = parameters["minimum"])
+        
+        return vos.getCachedStaticField(name        = "kc_monthly_means",\
+                                        sourceFiles = [kc_file],\
+                                        parameters  = parameters,\
+                                        calculate   = calculate_kc_monthly_means)
+
+    def to_backend(self, field):
+        # convert a PCRaster map or a numpy array (with vos.MV as missing values) to the field type of the backend
+        if self.backend == "numpy":
+            if not isinstance(field, np.ndarray): field = pcr.pcr2numpy(field, vos.MV)
+            field = np.array(field, dtype = np.float32)
+            field[field == np.float32(vos.MV)] = np.nan
+            return field
+        if isinstance(field, np.ndarray): 
+            # - float64, so that the missing values are exactly vos.MV 
+            field = np.where(np.isnan(field), vos.MV, field.astype(np.float64))
+            return pcr.numpy2pcr(pcr.Scalar, field, vos.MV)
+        return field
+
+    def update_cells(self, irrigated_area_in_hectar):
+        # sparse mode: index (flat indexes on the clone map) of the cells with irrigated areas and the static fields of these cells (1-D vectors) 
+        self.set_cells(np.flatnonzero(irrigated_area_in_hectar > 0.0))
+        logger.info("Sparse mode: number of cells with irrigated areas: " + str(len(self.cells)) + " of " + str(irrigated_area_in_hectar.size))
+
+    def set_cells(self, cells):
+        self.cells = cells
+        self.cells_version += 1
+        for name in self.static_grids:
+            setattr(self, name, self.gather(self.static_grids[name]))
+
+    def gather(self, field):
+        # sparse mode: values of the cells with irrigated areas (1-D vector)
+        if self.sparse: return field.ravel()[self.cells]
+        return field
+
+    def scatter(self, vector, grid):
+        # sparse mode: put the values of the cells with irrigated areas in a full grid 
+        grid = np.array(grid, dtype = np.float32)
+        grid.ravel()[self.cells] = vector
+        return grid
+
+    def to_numpy(self, field):
+        # numpy array with NaN as missing values
+        if isinstance(field, np.ndarray): return field
+        return pcr.pcr2numpy(field, np.nan)
+
+    def read_netcdf(self, ncFile, useDoy = None, date = None):
+        # read the field of the current date (or the given date) from a netcdf file (the field type depends on the backend)
+        if date == None: date = self.modelTime.fulldate
+        if self.backend == "numpy":
+            return vos.netcdf2NumpySlabClone(ncFile            = ncFile,\
+                                             varName           = "automatic",\
+                                             startDate         = date,\
+                                             endDate           = date,\
+                                             useDoy            = useDoy,\
+                                             cloneMapFileName  = self.cloneMapFileName)[0]
+        return vos.netcdf2PCRobjClone(ncFile            = ncFile,\
+                                      varName           = "automatic",\
+                                      dateInput         = date,\
+                                      useDoy            = useDoy,\
+                                      cloneMapFileName  = self.cloneMapFileName)
+
+    def get_input_file(self, name, year):
+        # the input file of a year (most inputs are yearly files, with the year in their names)
+        try:
+            return self.input_files[name] % (str(year), str(year))
+        except:
+            return self.input_files[name]
+
+    def get_month_days(self, year, month, day = 1):
+        # the first (the given day) and the last day of a month (within the simulation period)
+        month_sta = datetime.datetime(year, month, day)
+        next_month_sta = datetime.datetime(year + month // 12, month % 12 + 1, 1)
+        month_end = min(next_month_sta - datetime.timedelta(days = 1), \
+                        datetime.datetime(self.modelTime.endTime.year, self.modelTime.endTime.month, self.modelTime.endTime.day))
+        return month_sta, month_end
+
+    # the readers of the inputs (see read_input): the arguments are the cells (sparse mode) and the arguments given to read_input
+
+    def read_et0_slab(self, cells, month_sta, month_end):
+        # reference potential evaporation (daily) of the days of a month - unit: m/day
+        return vos.netcdf2NumpySlabClone(ncFile            = self.get_input_file("et0", month_sta.year),\
+                                         varName           = "automatic",\
+                                         startDate         = month_sta,\
+                                         endDate           = month_end,\
+                                         useDoy            = None,\
+                                         cloneMapFileName  = self.cloneMapFileName,\
+                                         cells             = cells)
+
+    def read_kc_slab(self, cells, name, month_sta, month_end):
+        # crop coefficients (daily, dimensionless) of the days of a month
+        # - the day-of-year fields are cached (read, covered and clamped only once per run; see the climatology cache in virtualOS)
+        # - set minimum kc - as used in PCR-GLOBWB runs (see minimum_kc)
+        return vos.netcdf2NumpyClimatologySlabClone(ncFile            = self.input_files[name],\
+                                                    varName           = "automatic",\
+                                                    startDate         = month_sta,\
+                                                    endDate           = month_end,\
+                                                    useDoy            = "daily_seasonal",\
+                                                    cloneMapFileName  = self.cloneMapFileName,\
+                                                    coverValue        = 0.0,\
+                                                    minimumValue      = minimum_kc,\
+                                                    cells             = cells)
+
+    def read_monthly_field(self, cells, name, date):
+        # the field of a monthly input (PCR-GLOBWB output) of a date (the last day of a month) 
+        return self.read_netcdf(self.get_input_file(name, int(date[0:4])), date = date)
+
+    def read_irrigated_area(self, cells, date):
+        # the irrigated area (hectar) of a date (the first day of a year)
+        return self.read_netcdf(self.input_files["irrigated_area_in_hectar"], date = date)
+
+    def read_input(self, name, *args):
+        # read an input with its reader (read_<name>), or take it from the read-ahead buffer if it was read ahead (see prefetch_inputs)
+        reader = getattr(self, "read_" + name)
+        cells  = self.cells if self.sparse else None
+        if self.prefetcher == None: return reader(cells, *args)
+        return self.prefetcher.get((name,) + args + (self.cells_version,), reader, cells, *args)
+
+    def get_input_bytes(self, name, *args):
+        # estimated size (bytes, float32) of an input read with read_input: the daily slabs are of the cells only in the sparse mode, the other inputs are full grids
+        grid_cells = int(self.cloneGeometry.rows) * int(self.cloneGeometry.cols)
+        if name in ["et0_slab", "kc_slab"]:
+            cells = len(self.cells) if self.sparse else grid_cells
+            return ((args[-1] - args[-2]).days + 1) * cells * 4
+        return grid_cells * 4
+
+    def prefetch_input(self, name, *args):
+        # schedule the read of an input (see read_input); it is not read ahead if the read-ahead buffer is full (see InputPrefetcher)
+        self.prefetcher.prefetch((name,) + args + (self.cells_version,), self.get_input_bytes(name, *args), getattr(self, "read_" + name), self.cells if self.sparse else None, *args)
+
+    def prefetch_inputs(self):
+        # read-ahead of the inputs, scheduled after the inputs of the current time step are read:
+        # - daily engine (at the start of a month): the monthly fields of the end of the month, and the daily fields of the next month
+        # - monthly engine: the fields of the next month
+        # - in December: the irrigated area of the next year
+        # the fields read with read_netcdf are read ahead with the numpy backend only (the PCRaster maps are made in the main thread), and, in the sparse mode,
+        # the daily fields are not read ahead across the end of the year (as the cells are refreshed every year)
+        if self.prefetcher == None: return
+        year, month = self.modelTime.year, self.modelTime.month
+        next_year, next_month = year + month // 12, month % 12 + 1
+        monthly_inputs = ["evaporation_from_irrigation", "total_irrigation_withdrawal"]
+        if self.engine == "monthly": monthly_inputs = ["et0_monthly"] + monthly_inputs
+        if self.engine == "daily" and self.backend == "numpy":
+            date = self.get_month_days(year, month)[1].strftime("%Y-%m-%d")
+            for name in monthly_inputs: self.prefetch_input("monthly_field", name, date)
+        if datetime.date(next_year, next_month, 1) > self.modelTime.endTime: return
+        month_sta, month_end = self.get_month_days(next_year, next_month)
+        if self.engine == "monthly" and self.backend == "numpy":
+            for name in monthly_inputs: self.prefetch_input("monthly_field", name, month_end.strftime("%Y-%m-%d"))
+        if self.engine == "daily" and not (self.sparse and next_year != year):
+            self.prefetch_input("et0_slab", month_sta, month_end)
+            for name in ["kc_nonpaddy_daily", "kc_paddy_daily"]: self.prefetch_input("kc_slab", name, month_sta, month_end)
+        if next_year != year and self.backend == "numpy": self.prefetch_input("irrigated_area", "%04i-01-01" % (next_year))
+
     def initial(self): 
 
         # general attributes for netcdf output files
@@ -87,14 +488,27 @@ class CalcFramework(DynamicModel):
         attributeDictionary['comment'    ]   = "See description. Calculated on the folder " + str(self.output_files["folder"]) 
         attributeDictionary['disclaimer' ]   = "Great care was exerted to prepare these data. Notwithstanding, use of the model and/or its outcome is the sole responsibility of the user." 
 
-        # make a netcdf output file for monthly estimate irrigation demand
-        attributeDictionary['title'      ]   = "Monthly estimate irrigation demand (km3/month)."
+        # make the netcdf output files (by default: one file for monthly estimate irrigation demand; see get_output_files)
         attributeDictionary['description']   = "The files are created based on the 5 arcmin PCR-GLOBWB runs for the project WRI (World Resources Institute) Aqueduct 2021. "
-        self.netcdf_report.createNetCDF(self.output_files["estimate_irrigation_demand"],\
-                                        "estimate_irrigation_demand",\
-                                        "km3.month-1",\
-                                        "estimate_irrigation_demand",\
-                                        attributeDictionary)
+        # - a resumed run continues the existing files
+        if self.resume: return
+        for ncFileName, varNames in self.get_output_file_variables().items():
+            attributeDictionary['title'      ] = output_variables[varNames[0]]["title"]
+            if len(varNames) > 1: attributeDictionary['title'] = "Monthly estimate irrigation demand and its components (km3/month)."
+            self.netcdf_report.createNetCDF(ncFileName,\
+                                            varNames[0],\
+                                            "km3.month-1",\
+                                            varNames[0],\
+                                            attributeDictionary)
+            # - other variables in the same file
+            for varName in varNames[1:]:
+                self.netcdf_report.addNewVariable(ncFileName, varName, "km3.month-1", varName, closeFile = True)
+
+    def get_output_file_variables(self):
+        # output file name -> the names of the variables reported in this file
+        files = {}
+        for varName in self.output_files["variables"]: files.setdefault(self.output_files[varName], []).append(varName)
+        return files
 
     def dynamic(self):
         
@@ -103,91 +517,41 @@ class CalcFramework(DynamicModel):
 
 
         # read yearly irrigated area (input files are originally in hectar and here converted to m2)
-        if self.modelTime.doy == 1:
-            
-            irrigated_area_in_hectar = pcr.cover(
-                                       vos.netcdf2PCRobjClone(ncFile            = self.input_files["irrigated_area_in_hectar"],\
-                                                              varName           = "automatic",\
-                                                              dateInput         = self.modelTime.fulldate,\
-                                                              useDoy            = None,\
-                                                              cloneMapFileName  = self.cloneMapFileName), 
-                                                0.0)
-            # irrigated area in m2
-            self.irrigated_area     = irrigated_area_in_hectar * 10000.
+        # - a resumed run (that may start in the middle of a year) takes these fields from the checkpoint (if it is of the current year) or reads them for the first day of the year
+        if self.modelTime.doy == 1 or self.modelTime.isFirstTimestep() or (self.engine == "monthly" and self.modelTime.isFirstMonthOfYear()):
+            if not (self.resume and self.modelTime.isFirstTimestep() and self.read_checkpoint()):
+                self.read_yearly_fields()
         
-            # nonpaddy cell area (m2)
-            self.cell_area_nonpaddy = self.irrigated_area * self.nonpaddy_fraction_over_irrigated_area
 
-            # paddy cell area (m2)
-            self.cell_area_paddy    = self.irrigated_area * self.paddy_fraction_over_irrigated_area
+        # monthly crop requirement (still not including efficiency) for irrigated crops - calculated from potential evaporation - unit: m3.month-1
+        if self.engine == "monthly":
+            self.calculate_crop_requirement_monthly()
         
+        # - the daily fields of the entire month are read at once (one hyperslab read per input) and reduced with numpy
+        elif self.modelTime.day == 1 or self.modelTime.isFirstTimestep():
 
-        # read efficiency - dimensionless
-        if self.modelTime.doy == 1:
+            # the days of the current month (within the simulation period)
+            month_sta, month_end = self.get_month_days(self.modelTime.year, self.modelTime.month, self.modelTime.day)
 
-            self.efficiency = vos.readPCRmapClone(v = self.input_files["efficiency"], \
-                                                    cloneMapFileName = self.cloneMapFileName, \
-                                                    tmpDir = self.tmpDir)
+            # get reference potential evaporation (daily) - unit: m/day
+            et0 = self.read_input("et0_slab", month_sta, month_end)
 
-            # extrapolate efficiency map as done in PCR-GLOBWB 
-            window_size = 1.25 * pcr.clone().cellSize()
-            window_size = min(window_size, min(pcr.clone().nrRows(), pcr.clone().nrCols())*pcr.clone().cellSize())
-            try:
-                self.efficiency = pcr.cover(self.efficiency, pcr.windowaverage(self.efficiency, window_size))
-                self.efficiency = pcr.cover(self.efficiency, pcr.windowaverage(self.efficiency, window_size))
-                self.efficiency = pcr.cover(self.efficiency, pcr.windowaverage(self.efficiency, window_size))
-                self.efficiency = pcr.cover(self.efficiency, pcr.windowaverage(self.efficiency, window_size))
-                self.efficiency = pcr.cover(self.efficiency, pcr.windowaverage(self.efficiency, window_size))
-                self.efficiency = pcr.cover(self.efficiency, pcr.windowaverage(self.efficiency, 0.75))
-                self.efficiency = pcr.cover(self.efficiency, pcr.windowaverage(self.efficiency, 1.00))
-                self.efficiency = pcr.cover(self.efficiency, pcr.windowaverage(self.efficiency, 1.50))
-            except:
-                pass
-            self.efficiency = pcr.cover(self.efficiency, 1.0)
-            self.efficiency = pcr.max(0.1, self.efficiency)
-
-
-        # get crop coefficient values (daily) for nonpaddy and paddy - dimensionless
-        self.kc_nonpaddy_daily     = pcr.cover(
-                                               vos.netcdf2PCRobjClone(ncFile            = self.input_files["kc_nonpaddy_daily"],\
-                                                                      varName           = "automatic",\
-                                                                      dateInput         = self.modelTime.fulldate,\
-                                                                      useDoy            = "daily_seasonal",\
-                                                                      cloneMapFileName  = self.cloneMapFileName), 
-                                               0.0)
-        self.kc_paddy_daily        = pcr.cover(
-                                               vos.netcdf2PCRobjClone(ncFile            = self.input_files["kc_paddy_daily"],\
-                                                                      varName           = "automatic",\
-                                                                      dateInput         = self.modelTime.fulldate,\
-                                                                      useDoy            = "daily_seasonal",\
-                                                                      cloneMapFileName  = self.cloneMapFileName), 
-                                               0.0)
-        # set minimum kc - as used in PCR-GLOBWB runs
-        minimum_kc = 0.2
-        self.kc_nonpaddy_daily = pcr.max(minimum_kc, self.kc_nonpaddy_daily)
-        self.kc_paddy_daily    = pcr.max(minimum_kc, self.kc_paddy_daily)
-
-
-        # get reference potential evaporation (daily) - unit: m/day
-        if self.modelTime.day == 1:
-            try:
-                self.et0_file = self.input_files["et0"] % (str(self.modelTime.year), str(self.modelTime.year))
-            except:
-                self.et0_file = self.input_files["et0"]
-        self.et0 = vos.netcdf2PCRobjClone(ncFile            = self.et0_file,\
-                                          varName           = "automatic",\
-                                          dateInput         = self.modelTime.fulldate,\
-                                          useDoy            = None,\
-                                          cloneMapFileName  = self.cloneMapFileName)
-
-
-        # calculate crop requirement (still not including efficiency) for irrigated crops - calculated from potential evaporation
-        # - daily value - m3.day-1
-        self.crop_requirement_daily = self.kc_nonpaddy_daily * self.et0 * self.cell_area_nonpaddy +\
-                                      self.kc_paddy_daily    * self.et0 * self.cell_area_paddy
-        # - monthly aggregation - m3.month-1
-        if self.modelTime.day == 1: self.crop_requirement_monthly = pcr.scalar(0.0)
-        self.crop_requirement_monthly = self.crop_requirement_monthly + self.crop_requirement_daily
+            # get crop coefficient values (daily) for nonpaddy and paddy - dimensionless (see read_kc_slab)
+            kc_nonpaddy = self.read_input("kc_slab", "kc_nonpaddy_daily", month_sta, month_end)
+            # - sum over the month of kc * et0 (m/month) - the first axis is time (the other ones are rows and columns or, in the sparse mode, cells) 
+            kc_et0_nonpaddy = np.einsum('i...,i...->...', kc_nonpaddy, et0)
+            del kc_nonpaddy
+            kc_paddy    = self.read_input("kc_slab", "kc_paddy_daily", month_sta, month_end)
+            kc_et0_paddy    = np.einsum('i...,i...->...', kc_paddy, et0)
+            del kc_paddy, et0
+
+            # - monthly aggregation - m3.month-1
+            crop_requirement_monthly = kc_et0_nonpaddy * self.to_numpy(self.cell_area_nonpaddy) +\
+                                       kc_et0_paddy    * self.to_numpy(self.cell_area_paddy)
+            self.crop_requirement_monthly = self.to_backend(crop_requirement_monthly)
+
+            # read-ahead of the next inputs (while the days of the month are calculated)
+            self.prefetch_inputs()
         
         # monthly irrigation requirement (including efficiency) - unit: km3/month - note this can be supplied by precipitation and irrigation withdrawal 
         if self.modelTime.isLastDayOfMonth():
@@ -202,32 +566,30 @@ class CalcFramework(DynamicModel):
 
             # read irrigation supply (the one that evaporated; note this is still not including efficiency) - unit: m/month
             
-            self.evaporation_from_irrigation_file = self.input_files["evaporation_from_irrigation"] % (str(self.modelTime.year), str(self.modelTime.year)) 
-            
             # - irrigation supply, but still not including efficiency - unit: m/month - note this consists the ones from precipitation and irrigation withdrawal
-            self.irrigation_supply = vos.netcdf2PCRobjClone(ncFile            = self.evaporation_from_irrigation_file,\
-                                                            varName           = "automatic",\
-                                                            dateInput         = self.modelTime.fulldate,\
-                                                            useDoy            = None,\
-                                                            cloneMapFileName  = self.cloneMapFileName)
+            self.irrigation_supply = self.read_input("monthly_field", "evaporation_from_irrigation", self.modelTime.fulldate)
 
             # - irrigation supply corrected with efficiency - unit: km3/month
-            self.irrigation_supply = self.irrigation_supply / self.efficiency * self.cell_area_total / 1e9
+            if self.sparse:
+                # sparse mode: the full grid is needed for the cells without irrigated areas (see below)
+                self.irrigation_supply_grid = self.irrigation_supply / self.static_grids["efficiency"] * self.static_grids["cell_area_total"] / 1e9
+                self.irrigation_supply      = self.gather(self.irrigation_supply_grid)
+            else:
+                self.irrigation_supply = self.irrigation_supply / self.efficiency * self.cell_area_total / 1e9
 
         
         # get irrigation withdrawal (km3/month): amount of water that has been withdrawn to meet irrigation demand (from PCR-GLOBWB output)
         if self.modelTime.isLastDayOfMonth():
 
             # unit: m.month-1
-            self.irrigation_withdrawal_file = self.input_files["total_irrigation_withdrawal"] % (str(self.modelTime.year), str(self.modelTime.year))
-            irrigation_withdrawal = vos.netcdf2PCRobjClone(ncFile            = self.irrigation_withdrawal_file,\
-                                                           varName           = "automatic",\
-                                                           dateInput         = self.modelTime.fulldate,\
-                                                           useDoy            = None,\
-                                                           cloneMapFileName  = self.cloneMapFileName)
+            irrigation_withdrawal = self.read_input("monthly_field", "total_irrigation_withdrawal", self.modelTime.fulldate)
             
             # total irrigation withdrawal (amount of water that has been supplied to meet irrigation demand) - unit: km3/month
-            self.irrigation_withdrawal = irrigation_withdrawal * self.cell_area_total / 1e9
+            if self.sparse:
+                self.irrigation_withdrawal_grid = irrigation_withdrawal * self.static_grids["cell_area_total"] / 1e9
+                self.irrigation_withdrawal      = self.gather(self.irrigation_withdrawal_grid)
+            else:
+                self.irrigation_withdrawal = irrigation_withdrawal * self.cell_area_total / 1e9
 
 
             # ~ # the following is for the case using irrNonPaddyWithdrawal and irrPaddyWithdrawal (yet, results will be the same as above)
@@ -248,6 +610,9 @@ class CalcFramework(DynamicModel):
             # ~ # total irrigation withdrawal (amount of water that has been supplied to meet irrigation demand) - unit: km3/month
             # ~ self.irrigation_withdrawal = (self.irrPaddyWithdrawal + self.irrNonPaddyWithdrawal) * self.cell_area_total / 1e9
 
+        # monthly engine: read-ahead of the inputs of the next month (while the current month is calculated and reported)
+        if self.engine == "monthly": self.prefetch_inputs()
+
 
             			
 
@@ -255,13 +620,19 @@ class CalcFramework(DynamicModel):
         if self.modelTime.isLastDayOfMonth():
             
             # irrigation water gap - unit: km3.month-1
-            self.irrigation_water_gap       = pcr.max(0.0, self.irrigation_requirement - self.irrigation_supply)
+            self.irrigation_water_gap       = maximum(0.0, self.irrigation_requirement - self.irrigation_supply)
             
             # estimate monthly irrigation demand - unit: km3.month-1
             self.estimate_irrigation_demand = self.irrigation_withdrawal + self.irrigation_water_gap
 
+            # sparse mode: cells without irrigated areas have no irrigation requirement
+            if self.sparse:
+                self.irrigation_requirement_grid     = self.static_grids["no_irrigation_requirement"]
+                self.irrigation_water_gap_grid       = maximum(0.0, self.irrigation_requirement_grid - self.irrigation_supply_grid)
+                self.estimate_irrigation_demand_grid = self.irrigation_withdrawal_grid + self.irrigation_water_gap_grid
+
 
-        # save monthly irrigation demand and monthly irrigation requirement to files (km3/month)
+        # save monthly irrigation demand (and the selected components, see output_variables) to files (km3/month)
         if self.modelTime.isLastDayOfMonth():
 
 
@@ -269,34 +640,111 @@ class CalcFramework(DynamicModel):
             timeStamp = datetime.datetime(self.modelTime.year,\
                                           self.modelTime.month,\
                                           self.modelTime.day,0)
-            varFields = {}
-            varFields["estimate_irrigation_demand"] = pcr.pcr2numpy(self.estimate_irrigation_demand, vos.MV)
-            self.netcdf_report.dataList2NetCDF(self.output_files["estimate_irrigation_demand"],\
-                                               ["estimate_irrigation_demand"],\
-                                               varFields,\
-                                               timeStamp)
+            # - all variables of a file are written with one call (one sync per file per month)
+            for ncFileName, varNames in self.get_output_file_variables().items():
+                varFields = {}
+                for varName in varNames:
+                    field = self.to_numpy(getattr(self, varName))
+                    # - sparse mode: the values of the cells with irrigated areas are put in the full grid only here  
+                    if self.sparse: field = self.scatter(field, getattr(self, output_variables[varName]["sparse_grid"]))
+                    varFields[varName] = np.where(np.isnan(field), vos.MV, field)
+                self.netcdf_report.dataList2NetCDF(ncFileName,\
+                                                   varNames,\
+                                                   varFields,\
+                                                   timeStamp,\
+                                                   posCnt = self.get_output_position())
 
+        # checkpoint (after the output of the month, see write_checkpoint)
+        if self.modelTime.isLastDayOfMonth() and self.checkpoint_interval > 0 and self.modelTime.month % self.checkpoint_interval == 0:
+            self.write_checkpoint()
 
+        # statistics of the clone geometry registry - 'forks' should not increase after the start
+        if self.modelTime.isLastDayOfYear():
+            logger.info("Clone geometry registry (hits, misses, forks): " + str(vos.getCloneGeometryStats()))
+            logger.info("Climatology cache (hits, misses, evictions, bytes): " + str(vos.getClimatologyCacheStats()))
+            logger.info("Netcdf file pool (hits, misses, evictions, open, bytes): " + str(vos.getDatasetPoolStats()))
+            if vos.decoded_field_cache_dir != None: logger.info("Decoded field store (hits, misses, evictions, bytes): " + str(vos.getDecodedFieldCacheStats()))
+            if len(vos.retry_stats) > 0: logger.info("Input read retries per file (retries, failures): " + str(vos.getRetryStats()))
+            if self.prefetcher != None: logger.info("Read-ahead of the inputs (counts; times in s; peak_bytes): " + str(self.prefetcher.get_stats()))
+            logger.info("Peak memory use of the process (MB): " + "%.1f" % (get_peak_memory_use() / 1024.**2))
 
-def main():
-    
-    # use the following system arguments
-    start_year                          = sys.argv[1]
-    end_year                            = sys.argv[2]
-    pcrglobwb_input_folder              = sys.argv[3]
-    irrigated_area_in_hectar_input_file = sys.argv[4]
-    pcrglobwb_monthly_output_folder     = sys.argv[5]
-    pcrglobwb_daily_output_folder       = sys.argv[6]
-    output_folder_for_irrigation_demand = sys.argv[7]
-    output_file_for_irrigation_demand   = sys.argv[8]
+
+    def calculate_crop_requirement_monthly(self):
+
+        # monthly engine: monthly crop requirement from the monthly et0 and the monthly mean kc - unit: m3.month-1 
+        # - note that this ignores the covariance of kc and et0 within the month (see compare_monthly_engine.py for the difference with the daily engine)
+        
+        # get reference potential evaporation (monthly) - unit: m/month
+        et0 = self.read_input("monthly_field", "et0_monthly", self.modelTime.fulldate)
+        if self.sparse: et0 = self.gather(et0)
+
+        # monthly mean kc for nonpaddy and paddy - dimensionless (see read_kc_monthly_means)
+        month_index = vos.getClimatologyMonthIndex(self.modelTime.year, self.modelTime.month)
+        kc_nonpaddy = self.to_backend(self.gather(self.kc_monthly_means["kc_nonpaddy_daily"][month_index]))
+        kc_paddy    = self.to_backend(self.gather(self.kc_monthly_means["kc_paddy_daily"][month_index]))
+
+        self.crop_requirement_monthly = kc_nonpaddy * et0 * self.cell_area_nonpaddy +\
+                                        kc_paddy    * et0 * self.cell_area_paddy
+
+    def read_yearly_fields(self):
+
+        # the irrigated area of the year (the field of the first day of the year)
+        date = "%04i-01-01" % (self.modelTime.year)
+        irrigated_area_in_hectar = cover(self.read_input("irrigated_area", date), 0.0)
+        # - sparse mode: the index of cells with irrigated areas is refreshed every year
+        if self.sparse:
+            self.update_cells(irrigated_area_in_hectar)
+            irrigated_area_in_hectar = self.gather(irrigated_area_in_hectar)
+        # irrigated area in m2
+        self.irrigated_area     = irrigated_area_in_hectar * 10000.
     
-    # starting and end date
-    startDate = "%s-01-01" % (str(start_year))
-    endDate   = "%s-12-31" % (str(end_year))
+        # nonpaddy cell area (m2)
+        self.cell_area_nonpaddy = self.irrigated_area * self.nonpaddy_fraction_over_irrigated_area
 
-    # ~ startDate = "1960-01-01"
-    # ~ endDate   = "2019-12-31"
+        # paddy cell area (m2)
+        self.cell_area_paddy    = self.irrigated_area * self.paddy_fraction_over_irrigated_area
+
+    def get_output_position(self):
+        # time index of the current month in the output files (months since output_start_date)
+        return (self.modelTime.year - self.output_start_date.year) * 12 + self.modelTime.month - self.output_start_date.month
+
+    def write_checkpoint(self):
+
+        # the state needed to continue the run after the current month: the yearly fields (the monthly crop requirement is calculated at the start of every month, so it is not needed) 
+        # - the output written so far is flushed first, so that the output files are at least as far as the checkpoint
+        self.netcdf_report.flush()
+        state = {}
+        state["date"]    = np.array(self.modelTime.fulldate)
+        state["backend"] = np.array(self.backend)
+        state["sparse"]  = np.array(self.sparse)
+        for name in checkpoint_fields: state[name] = self.to_numpy(getattr(self, name))
+        if self.sparse: state["cells"] = self.cells
+        
+        # - written to a temporary file first and then renamed (a killed job does not leave a broken checkpoint)
+        if not os.path.exists(os.path.dirname(self.checkpoint_file)): os.makedirs(os.path.dirname(self.checkpoint_file))
+        tmp_file = self.checkpoint_file + ".tmp.npz"
+        np.savez(tmp_file, **state)
+        os.replace(tmp_file, self.checkpoint_file)
+        logger.info("Checkpoint written for " + str(self.modelTime.fulldate) + ": " + self.checkpoint_file)
 
+    def read_checkpoint(self):
+
+        # restore the state of the checkpoint if it can be used for the current (resumed) date: of the same year, before the current date, and with the same backend and sparse mode
+        # - the checkpoints are not used if checkpoint_interval is 0 (e.g. in the append mode)
+        if self.checkpoint_interval <= 0 or not os.path.exists(self.checkpoint_file): return False
+        state = np.load(self.checkpoint_file)
+        date = str(state["date"])
+        if date[0:4] != self.modelTime.fulldate[0:4] or date >= self.modelTime.fulldate or \
+           str(state["backend"]) != self.backend or bool(state["sparse"]) != self.sparse:
+            logger.info("The checkpoint of " + date + " is not used for resuming at " + str(self.modelTime.fulldate) + ".")
+            return False
+        if self.sparse: self.set_cells(state["cells"])
+        for name in checkpoint_fields: setattr(self, name, self.to_backend(state[name]))
+        logger.info("Resuming at " + str(self.modelTime.fulldate) + " with the checkpoint of " + date + ".")
+        return True
+
+
+def get_input_files(pcrglobwb_input_folder, irrigated_area_in_hectar_input_file, pcrglobwb_monthly_output_folder, pcrglobwb_daily_output_folder):
 
     # a dictionary containing input files
     input_files = {}
@@ -339,7 +787,12 @@ def main():
     # - daily reference potential evaporation (m.month-1) - note this may be given in a different folder than the monthly output folder
     input_files["pgb_daily_out_dir"] = str(pcrglobwb_daily_output_folder) + "/"
     input_files["et0"] = input_files["pgb_daily_out_dir"] + "referencePotET_dailyTot_output_%4s-01-01_to_%4s-12-31.nc"
+    # - monthly reference potential evaporation (m.month-1) - used by the monthly engine
+    input_files["et0_monthly"] = input_files["pgb_monthly_out_dir"] + "/referencePotET_monthTot_output_%4s-01-31_to_%4s-12-31.nc"
 
+    return input_files
+
+def get_output_files(output_folder_for_irrigation_demand, output_file_for_irrigation_demand, variables = None, separate_files = False):
 
     # a dictionary containing output files
     output_files = {}
@@ -350,13 +803,26 @@ def main():
     output_files["folder"]                            = str(output_folder_for_irrigation_demand) + "/"
     output_files["estimate_irrigation_demand"]        = output_files["folder"] + "/" + str(output_file_for_irrigation_demand)
 
+    # the reported variables (see output_variables): by default in the same (multi-variable) file; with separate_files, the other variables get their own files (<variable>_<output file>)
+    if variables == None: variables = ["estimate_irrigation_demand"]
+    for varName in variables:
+        if varName not in output_variables: raise Exception("Unknown output variable: " + str(varName) + " (see output_variables).")
+    output_files["variables"] = list(variables)
+    for varName in variables:
+        if varName == "estimate_irrigation_demand": continue
+        output_files[varName] = output_files["estimate_irrigation_demand"]
+        if separate_files: output_files[varName] = output_files["folder"] + "/" + varName + "_" + str(output_file_for_irrigation_demand)
+
+    return output_files
 
-    # make output folder
+def prepare_output_folder(output_files, resume = False):
+
+    # make output folder (resume: the existing output folder, including its log files, is kept)
     output_folder = output_files["folder"]
     try:
         os.makedirs(output_folder)
     except:
-        os.system('rm -r ' + output_folder + "/*") ### THIS IS DANGEROUS
+        if not resume: os.system('rm -r ' + output_folder + "/*") ### THIS IS DANGEROUS
         pass
 
     # prepare logger and its directory
@@ -365,22 +831,377 @@ def main():
         os.makedirs(log_file_location)
     except:
         cmd = 'rm -r ' + log_file_location + "/*"
-        os.system(cmd)
+        if not resume: os.system(cmd)
         pass
     vos.initialize_logging(log_file_location)
     
-    # time object
-    modelTime = ModelTime() # timeStep info: year, month, day, doy, hour, etc
-    modelTime.getStartEndTimeSteps(startDate, endDate)
+    # memory budget for the (kc) climatology cache - default: 4 GB; "full" keeps the full 366-day stacks in memory
+    if "CLIMATOLOGY_CACHE_MAX_GB" in os.environ:
+        if os.environ["CLIMATOLOGY_CACHE_MAX_GB"].lower() == "full":
+            vos.climatology_cache_max_bytes = None
+        else:
+            vos.climatology_cache_max_bytes = int(float(os.environ["CLIMATOLOGY_CACHE_MAX_GB"]) * 1024**3)
+    logger.info("Memory budget for the climatology cache (bytes): " + str(vos.climatology_cache_max_bytes))
+
+    # limits of the pools of opened netcdf files: the number of open files, the memory budget of their chunk caches and the maximum chunk cache per variable
+    if "DATASET_POOL_MAX_OPEN" in os.environ: vos.dataset_pool_max_open = int(os.environ["DATASET_POOL_MAX_OPEN"])
+    if "DATASET_POOL_MAX_GB" in os.environ: vos.dataset_pool_max_bytes = int(float(os.environ["DATASET_POOL_MAX_GB"]) * 1024**3)
+    if "NETCDF_CHUNK_CACHE_MB" in os.environ: vos.dataset_chunk_cache_bytes = int(float(os.environ["NETCDF_CHUNK_CACHE_MB"]) * 1024**2)
+    logger.info("Netcdf file pool (maximum open files, chunk cache budget, chunk cache per variable): " + str((vos.dataset_pool_max_open, vos.dataset_pool_max_bytes, vos.dataset_chunk_cache_bytes)))
+
+    # memory budget of the read-ahead of the inputs (see InputPrefetcher) - the daily slabs of the global 5 arcmin grid (about 1.2 GB per month and input) 
+    # do not fit in the default budget; they are then read when they are needed
+    if "PREFETCH_MAX_MB" in os.environ: inputPrefetcher.default_max_bytes = int(float(os.environ["PREFETCH_MAX_MB"]) * 1024**2)
+    logger.info("Memory budget for the read-ahead of the inputs (bytes): " + str(inputPrefetcher.default_max_bytes))
+
+    # retries of the input reads (see vos.RetryPolicy): the number of tries and the delay (s) before the first retry (doubled for every next retry)
+    if "READ_MAX_TRIES" in os.environ: vos.max_num_of_tries = int(os.environ["READ_MAX_TRIES"])
+    if "READ_RETRY_DELAY" in os.environ: vos.retry_policy.base_delay = float(os.environ["READ_RETRY_DELAY"])
+    if "READ_RETRY_MAX_DELAY" in os.environ: vos.retry_policy.max_delay = float(os.environ["READ_RETRY_MAX_DELAY"])
+    logger.info("Input read retries (tries, first delay, maximum delay): " + str((vos.max_num_of_tries, vos.retry_policy.base_delay, vos.retry_policy.max_delay)))
+
+    # decoded field store of the netcdf inputs (see virtualOS) - default: none; e.g. a folder on a local disk, shared by the runs on the same node
+    set_decoded_field_cache()
+    logger.info("Decoded field store (folder, maximum bytes): " + str((vos.decoded_field_cache_dir, vos.decoded_field_cache_max_bytes)))
+
+    # folder for caching static fields - by default, this is shared by the runs with the same parent output folder (e.g. the scenario runs in calculate_irrigation_demand_*.sh) 
+    vos.static_field_cache_dir = os.path.abspath(os.path.join(output_folder, "..", "static_field_cache"))
+    if "STATIC_FIELD_CACHE_DIR" in os.environ: vos.static_field_cache_dir = os.environ["STATIC_FIELD_CACHE_DIR"]
+    # - the cached fields are keyed by the path, size and modification time of their source files; STATIC_FIELD_KEY_MODE=hash keys them by the content (slow for large files)
+    if "STATIC_FIELD_KEY_MODE" in os.environ: vos.static_field_key_mode = os.environ["STATIC_FIELD_KEY_MODE"]
+    logger.info("Folder for caching static fields: " + str(vos.static_field_cache_dir) + " ; key mode: " + str(vos.static_field_key_mode))
+
+def get_peak_memory_use():
+    # peak resident memory (bytes) of the process (ru_maxrss is in kilobytes on Linux, in bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin": return peak
+    return peak * 1024
+
+def set_decoded_field_cache():
+    if "DECODED_FIELD_CACHE_DIR" in os.environ: vos.decoded_field_cache_dir = os.path.abspath(os.environ["DECODED_FIELD_CACHE_DIR"])
+    if "DECODED_FIELD_CACHE_MAX_GB" in os.environ: vos.decoded_field_cache_max_bytes = int(float(os.environ["DECODED_FIELD_CACHE_MAX_GB"]) * 1024**3)
+
+def read_region_mask(mask_file, cloneGeometry):
+    # the cells of a mask (non-zero values) on the grid of the clone map: a PCRaster map or a netcdf file (the first field of its variable)
+    if mask_file.endswith(".nc") or mask_file.endswith(".nc4"):
+        with vos.netcdf_lock:
+            with nc.Dataset(mask_file) as f:
+                varName = [var for var in f.variables if var not in f.dimensions][-1]
+                field = np.ma.filled(np.ma.asarray(f.variables[varName][:]).astype(np.float64), np.nan)
+                if field.ndim == 3: field = field[0]
+                if "lat" in f.variables and f.variables["lat"][0] < f.variables["lat"][-1]: field = field[::-1]
+    else:
+        field = vos.readCSFWindow(mask_file)
+    if field.shape != (cloneGeometry.rows, cloneGeometry.cols): 
+        raise Exception("The mask " + str(mask_file) + " (" + str(field.shape) + ") is not on the grid of the clone map (" + str((cloneGeometry.rows, cloneGeometry.cols)) + ").")
+    return ~np.isnan(field) & (field != 0.0)
+
+def get_region_window(rowSta, rowEnd, colSta, colEnd, cloneGeometry, halo = 0):
+    # the window extended with a halo and to multiples of region_alignment cells (within the clone map)
+    rowSta = max(0, (rowSta - halo) // region_alignment * region_alignment)
+    colSta = max(0, (colSta - halo) // region_alignment * region_alignment)
+    rowEnd = min(cloneGeometry.rows, -(-(rowEnd + halo) // region_alignment) * region_alignment)
+    colEnd = min(cloneGeometry.cols, -(-(colEnd + halo) // region_alignment) * region_alignment)
+    return int(rowSta), int(rowEnd), int(colSta), int(colEnd)
+
+def prepare_region(input_files, output_folder, bbox = None, mask_file = None):
+    # regional run: the clone map of the region, a window of the clone map (aligned to region_alignment cells), so that the netcdf inputs are read for the window only
+    # - bbox: west, south, east, north (degrees); mask_file: a map on the grid of the clone map with the cells of the region (non-zero values), e.g. a country (see read_region_mask)
+    # - the clone map of the region with a halo is used for the gap filling of the efficiency (see CalcFramework.read_efficiency)
+    # - input_files["clone_map"] is replaced by the clone map of the region; returns the region (see CalcFramework)
+    clone_map = input_files["clone_map"]
+    clone = vos.getCloneGeometry(clone_map)
+    rowSta, rowEnd, colSta, colEnd = 0, clone.rows, 0, clone.cols
+    mask = None
+    if mask_file != None:
+        mask = read_region_mask(mask_file, clone)
+        rows, cols = np.flatnonzero(mask.any(axis = 1)), np.flatnonzero(mask.any(axis = 0))
+        if len(rows) == 0: raise Exception("The mask " + str(mask_file) + " has no cells.")
+        rowSta, rowEnd, colSta, colEnd = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+        input_files["region_mask"] = mask_file
+    if bbox != None:
+        west, south, east, north = [float(value) for value in bbox]
+        rowSta = max(rowSta, int(math.floor((clone.yUL - north) / clone.cellsize + 1e-9)))
+        rowEnd = min(rowEnd, int(math.ceil((clone.yUL - south) / clone.cellsize - 1e-9)))
+        colSta = max(colSta, int(math.floor((west - clone.xUL) / clone.cellsize + 1e-9)))
+        colEnd = min(colEnd, int(math.ceil((east - clone.xUL) / clone.cellsize - 1e-9)))
+    if rowSta >= rowEnd or colSta >= colEnd: raise Exception("The region " + str(bbox) + " has no cells in the clone map.")
+
+    header = vos.readCSFHeader(clone_map)
+    halo = get_efficiency_halo(header['cellsize'], clone.rows, clone.cols)
+    region = {"clone_rows": clone.rows, "clone_cols": clone.cols}
+    region["window"]      = get_region_window(rowSta, rowEnd, colSta, colEnd, clone)
+    region["halo_window"] = get_region_window(rowSta, rowEnd, colSta, colEnd, clone, halo)
+    region["mask"]        = None
+    if mask is not None: region["mask"] = mask[region["window"][0]:region["window"][1], region["window"][2]:region["window"][3]]
+
+    # the clone maps of the region and the region with the halo
+    region_folder = output_folder + "/region/"
+    if not os.path.exists(region_folder): os.makedirs(region_folder)
+    region["clone_map"]      = region_folder + "clone.map"
+    region["halo_clone_map"] = region_folder + "clone_with_halo.map"
+    vos.writeCSFWindow(clone_map, region["clone_map"], *region["window"])
+    vos.writeCSFWindow(clone_map, region["halo_clone_map"], *region["halo_window"])
+    input_files["clone_map"] = region["clone_map"]
+    logger.info("Regional run: rows " + str(region["window"][0:2]) + " and columns " + str(region["window"][2:4]) + " of the clone map (halo: " + str(halo) + " cells).")
+    return region
+
+def get_resume_date(output_files):
+    # the day after the last month that is (completely) available in all output files; None if an output file is missing or has no valid time step
+    last_dates = []
+    for ncFileName in sorted(set(output_files[varName] for varName in output_files["variables"])):
+        if not os.path.exists(ncFileName): return None
+        varNames = [varName for varName in output_files["variables"] if output_files[varName] == ncFileName]
+        last_date = vos.findLastValidDateInNCFile(ncFileName, varNames)
+        if last_date == None: return None
+        last_dates.append(datetime.date(last_date.year, last_date.month, last_date.day))
+    return min(last_dates) + datetime.timedelta(days = 1)
+
+def get_year_input_files(input_files, year, engine = "daily"):
+    # the input files (name, file) used for the months of a year
+    files = [(name, input_files[name]) for name in ["clone_map", "cell_area", "nonpaddy_fraction", "paddy_fraction", "kc_nonpaddy_daily", "kc_paddy_daily", "efficiency", "irrigated_area_in_hectar"]]
+    et0 = "et0" if engine == "daily" else "et0_monthly"
+    if "region_mask" in input_files: files.append(("region_mask", input_files["region_mask"]))
+    for name in [et0, "evaporation_from_irrigation", "total_irrigation_withdrawal"]:
+        try:
+            files.append((name, input_files[name] % (str(year), str(year))))
+        except:
+            files.append((name, input_files[name]))
+    return files
+
+def get_input_fingerprints(input_files, years, mode = "mtime", engine = "daily"):
+    # fingerprint (sha1) of the input files of every year (see vos.getFileFingerprint for the mode); the monthly engine is part of the fingerprint
+    file_fingerprints = {}
+    fingerprints = {}
+    for year in years:
+        key = hashlib.sha1()
+        if engine != "daily": key.update(repr(("engine", engine)).encode())
+        for name, fileName in get_year_input_files(input_files, year, engine):
+            if fileName not in file_fingerprints: file_fingerprints[fileName] = vos.getFileFingerprint(fileName, mode)
+            key.update(repr((name, file_fingerprints[fileName])).encode())
+        fingerprints[year] = key.hexdigest()
+    return fingerprints
+
+def get_output_manifest_file(output_files):
+    return output_files["folder"] + "/output_manifest.json"
+
+def read_output_manifest(output_files):
+    # the output manifest: the fingerprint of the inputs of every month ("YYYY-MM") in the output files
+    manifest_file = get_output_manifest_file(output_files)
+    if not os.path.exists(manifest_file): return None
+    with open(manifest_file) as f: return json.load(f)
+
+def write_output_manifest(output_files, manifest):
+    manifest_file = get_output_manifest_file(output_files)
+    with open(manifest_file + ".tmp", "w") as f: json.dump(manifest, f, indent = 1, sort_keys = True)
+    os.replace(manifest_file + ".tmp", manifest_file)
+
+def get_months(startDate, endDate):
+    # the months ("YYYY-MM") from startDate to endDate
+    months = []
+    year, month = startDate.year, startDate.month
+    while (year, month) <= (endDate.year, endDate.month):
+        months.append("%04i-%02i" % (year, month))
+        year, month = year + month // 12, month % 12 + 1
+    return months
+
+def get_month_period(months):
+    # the first and last day of a list of consecutive months
+    year, month = int(months[-1][0:4]), int(months[-1][5:7])
+    last_day = datetime.date(year + month // 12, month % 12 + 1, 1) - datetime.timedelta(days = 1)
+    return datetime.date(int(months[0][0:4]), int(months[0][5:7]), 1), last_day
+
+def get_append_periods(output_files, output_start_date, end_date, fingerprints, manifest):
+    # the periods (of consecutive months) that are missing in the output files or whose inputs have changed since they were calculated (stale)
+    resume_date = get_resume_date(output_files)
+    if resume_date == None: return [(output_start_date, end_date)]
+    months = get_months(output_start_date, end_date)
+    stale  = []
+    for month in months:
+        if month >= "%04i-%02i" % (resume_date.year, resume_date.month):
+            stale.append(month)
+        elif manifest != None and manifest["months"].get(month) != fingerprints[int(month[0:4])]:
+            stale.append(month)
+    logger.info("Months to be calculated: " + str(len(stale)) + " of " + str(len(months)) + ".")
+    if manifest == None: logger.warning("There is no output manifest; the months in the output files (until " + str(resume_date - datetime.timedelta(days = 1)) + ") are assumed to be up to date.")
+    periods = []
+    for month in stale:
+        if len(periods) > 0 and months.index(month) == months.index(periods[-1][-1]) + 1:
+            periods[-1].append(month)
+        else:
+            periods.append([month])
+    return [get_month_period(period) for period in periods]
+
+def run(start_year, end_year, input_files, output_files, backend = "pcraster", sparse = False, static_inputs = None, async_writer = False, sync_interval = 12, netcdf_options = None, resume = False, checkpoint_interval = 3, append = False, fingerprint_mode = "mtime", engine = "daily", tile = None, region = None, prefetch = True):
+    
+    # starting and end date
+    startDate = "%s-01-01" % (str(start_year))
+    endDate   = "%s-12-31" % (str(end_year))
+
+    # ~ startDate = "1960-01-01"
+    # ~ endDate   = "2019-12-31"
+
+    output_start_date = datetime.date(int(start_year), 1, 1)
+    output_end_date   = datetime.date(int(end_year), 12, 31)
+    periods = [(output_start_date, output_end_date)]
+
+    # fingerprints of the inputs (see the output manifest)
+    fingerprints = get_input_fingerprints(input_files, range(int(start_year), int(end_year) + 1), fingerprint_mode, engine)
+    manifest = read_output_manifest(output_files)
+    if manifest != None and manifest["output_start_date"] != str(output_start_date): 
+        raise Exception("The output files start at " + manifest["output_start_date"] + ", not at " + str(output_start_date) + " (see " + get_output_manifest_file(output_files) + ").")
+    if manifest == None or not (resume or append): manifest = {"output_start_date": str(output_start_date), "months": {}}
+    
+    # resume: continue from the month after the last month in the existing output files (the months written are not calculated again)
+    if resume:
+        resume_date = get_resume_date(output_files)
+        if resume_date == None:
+            logger.info("There is no output to resume from. The run starts at " + startDate + ".")
+            resume = False
+        elif resume_date > output_end_date:
+            logger.info("The output is complete already (until " + str(resume_date - datetime.timedelta(days = 1)) + ").")
+            return
+        else:
+            periods = [(resume_date, output_end_date)]
+            logger.info("Resuming the run at " + str(resume_date) + ".")
+            # - the months written before are assumed to be calculated with the current inputs (if they are not in the output manifest)
+            for month in get_months(output_start_date, resume_date - datetime.timedelta(days = 1)): manifest["months"].setdefault(month, fingerprints[int(month[0:4])])
+
+    # append: calculate only the months that are missing or stale (given the output manifest); they are written in place (at their time positions)
+    if append:
+        resume = get_resume_date(output_files) != None
+        periods = get_append_periods(output_files, output_start_date, output_end_date, fingerprints, manifest)
+        logger.info("Periods to be calculated: " + str([(str(sta), str(end)) for sta, end in periods]))
+
+    for period_sta, period_end in periods:
+    
+        # time object (monthly engine: monthly time steps)
+        modelTime = ModelTime() # timeStep info: year, month, day, doy, hour, etc
+        if engine == "monthly": modelTime = MonthlyModelTime()
+        modelTime.getStartEndTimeSteps(str(period_sta), str(period_end))
+        
+        # - in the append mode, the checkpoints are not used (the yearly fields are read, as the inputs may have changed)
+        calculationModel = CalcFramework(input_files["clone_map"],\
+                                         modelTime, \
+                                         input_files, \
+                                         output_files, \
+                                         backend = backend, \
+                                         sparse = sparse, \
+                                         static_inputs = static_inputs, \
+                                         async_writer = async_writer, \
+                                         sync_interval = sync_interval, \
+                                         netcdf_options = netcdf_options, \
+                                         resume = resume, \
+                                         checkpoint_interval = 0 if append else checkpoint_interval, \
+                                         output_start_date = output_start_date, \
+                                         engine = engine, \
+                                         tile = tile, \
+                                         region = region, \
+                                         prefetch = prefetch)
+    
+        dynamic_framework = DynamicFramework(calculationModel, modelTime.nrOfTimeSteps)
+        dynamic_framework.setQuiet(True)
+        dynamic_framework.run()
+        
+        # write the remaining fields and close the output files (errors of the write-behind thread are raised here)
+        calculationModel.netcdf_report.close()
+
+        # stop the read-ahead thread
+        if calculationModel.prefetcher != None:
+            logger.info("Read-ahead of the inputs (counts; times in s; peak_bytes): " + str(calculationModel.prefetcher.get_stats()))
+            calculationModel.prefetcher.close()
+        logger.info("Peak memory use of the process (MB): " + "%.1f" % (get_peak_memory_use() / 1024.**2))
+
+        # the output manifest of the months calculated
+        for month in get_months(period_sta, period_end): manifest["months"][month] = fingerprints[int(month[0:4])]
+        write_output_manifest(output_files, manifest)
+
+        # - the next period continues the output files, with the same static inputs
+        static_inputs = calculationModel.get_static_inputs()
+        resume = True
+
+def main():
+    
+    # use the following system arguments (the positional ones are the same as before; the options are optional)
+    parser = argparse.ArgumentParser(description = "Estimate monthly irrigation demand from PCR-GLOBWB input and output files.")
+    parser.add_argument("start_year")
+    parser.add_argument("end_year")
+    parser.add_argument("pcrglobwb_input_folder")
+    parser.add_argument("irrigated_area_in_hectar_input_file")
+    parser.add_argument("pcrglobwb_monthly_output_folder")
+    parser.add_argument("pcrglobwb_daily_output_folder")
+    parser.add_argument("output_folder_for_irrigation_demand")
+    parser.add_argument("output_file_for_irrigation_demand")
+    parser.add_argument("--backend", choices = backends, default = "pcraster", help = "compute backend (default: pcraster)")
+    parser.add_argument("--sparse", action = "store_true", help = "calculate only for the cells with irrigated areas (requires --backend numpy)")
+    parser.add_argument("--async_writer", action = "store_true", help = "write the output files with a background (write-behind) thread")
+    parser.add_argument("--sync_interval", type = int, default = 12, help = "number of months between the syncs of the output files with --async_writer (default: 12)")
+    parser.add_argument("--zlib", action = "store_true", help = "compress the output variable")
+    parser.add_argument("--complevel", type = int, default = 4, help = "deflate level (1-9) used with --zlib (default: 4)")
+    parser.add_argument("--no_shuffle", action = "store_true", help = "do not use the shuffle filter with --zlib")
+    parser.add_argument("--chunksizes", default = None, metavar = "TIME,LAT,LON", help = "chunk shape of the output variable, e.g. 12,64,64 (default: netcdf library default)")
+    parser.add_argument("--least_significant_digit", type = int, default = None, help = "lossy quantization of the output: number of decimals kept, e.g. 8 for km3/month (default: lossless)")
+    parser.add_argument("--output_variables", default = "estimate_irrigation_demand", metavar = "VAR1,VAR2", help = "reported variables: " + ", ".join(output_variables.keys()) + " (default: estimate_irrigation_demand)")
+    parser.add_argument("--separate_files", action = "store_true", help = "report every variable in its own file (default: one file with all variables)")
+    parser.add_argument("--resume", action = "store_true", help = "continue the existing output files from the month after their last (complete) month")
+    parser.add_argument("--append", action = "store_true", help = "calculate only the months that are missing in the existing output files or whose inputs have changed (see the output manifest) and write them in place")
+    parser.add_argument("--fingerprint", choices = ["mtime", "hash"], default = "mtime", help = "how changed inputs are detected with --append: size and modification time, or a hash of the content (default: mtime)")
+    parser.add_argument("--engine", choices = engines, default = "daily", help = "daily time steps, or monthly time steps with the monthly et0 and the monthly mean kc (faster, but an approximation; see compare_monthly_engine.py) (default: daily)")
+    parser.add_argument("--parallel_years", type = int, default = 0, metavar = "PROCESSES", help = "calculate chunks of years in parallel with this number of processes and merge them in the output files (see --years_per_chunk; default: 0, serial run)")
+    parser.add_argument("--years_per_chunk", type = int, default = 1, help = "number of years per chunk with --parallel_years (default: 1)")
+    parser.add_argument("--tiles", type = int, default = 0, metavar = "PROCESSES", help = "calculate bands of rows (tiles) of the clone map in parallel with this number of processes and merge them in the output files (requires --backend numpy; default: 0, no tiles)")
+    parser.add_argument("--tile_rows", type = int, default = None, help = "number of rows per tile with --tiles, rounded up to a multiple of 12 (default: rows / processes)")
+    parser.add_argument("--bbox", default = None, metavar = "WEST,SOUTH,EAST,NORTH", help = "regional run: calculate only for this bounding box (degrees)")
+    parser.add_argument("--mask", default = None, help = "regional run: calculate only for the cells with non-zero values of this map (PCRaster or netcdf, on the grid of the clone map), e.g. a country")
+    parser.add_argument("--no_prefetch", action = "store_true", help = "do not read the next inputs with a background (read-ahead) thread while the model calculates")
+    parser.add_argument("--checkpoint_interval", type = int, default = 3, help = "number of months between the checkpoints used by --resume (default: 3; 0: no checkpoints)")
+    args = parser.parse_args()
+    if args.sparse and args.backend != "numpy": parser.error("--sparse requires --backend numpy")
+    if args.resume and args.append: parser.error("--resume and --append cannot be used together (--append includes the missing months)")
+    if args.parallel_years > 1 and (args.resume or args.append): parser.error("--parallel_years cannot be used with --resume or --append")
+    if args.tiles > 1 and (args.resume or args.append or args.parallel_years > 1): parser.error("--tiles cannot be used with --resume, --append or --parallel_years")
+    if args.tiles > 1 and args.backend != "numpy": parser.error("--tiles requires --backend numpy")
+    if (args.bbox != None or args.mask != None) and (args.tiles > 1 or args.parallel_years > 1): parser.error("--bbox and --mask cannot be used with --tiles or --parallel_years")
+    
+    # layout of the output file
+    netcdf_options = {"zlib": args.zlib, "complevel": args.complevel, "shuffle": not args.no_shuffle, "least_significant_digit": args.least_significant_digit}
+    if args.chunksizes != None: netcdf_options["chunksizes"] = [int(size) for size in args.chunksizes.split(",")]
+    
+    # a dictionary containing input files
+    input_files  = get_input_files(args.pcrglobwb_input_folder, args.irrigated_area_in_hectar_input_file, args.pcrglobwb_monthly_output_folder, args.pcrglobwb_daily_output_folder)
+    
+    # a dictionary containing output files
+    output_files = get_output_files(args.output_folder_for_irrigation_demand, args.output_file_for_irrigation_demand, args.output_variables.split(","), args.separate_files)
+    
+    # make output folder, logger and cache settings
+    prepare_output_folder(output_files, resume = args.resume or args.append)
+    
+    # regional run (the clone map of the region replaces the one of the input files)
+    region = None
+    if args.bbox != None or args.mask != None:
+        bbox = None
+        if args.bbox != None: bbox = [float(value) for value in args.bbox.split(",")]
+        region = prepare_region(input_files, output_files["folder"], bbox, args.mask)
+    
+    # parallel chunks of years or tiles (see batch_calculate_irrigation_demand.run_year_chunks and run_tiles)
+    if args.parallel_years > 1 or args.tiles > 1:
+        import batch_calculate_irrigation_demand as batch
+        batch_run = {"name": os.path.splitext(args.output_file_for_irrigation_demand)[0], "start_year": args.start_year, "end_year": args.end_year, \
+                     "pcrglobwb_input_folder": args.pcrglobwb_input_folder, "irrigated_area_file": args.irrigated_area_in_hectar_input_file, \
+                     "monthly_output_folder": args.pcrglobwb_monthly_output_folder, "daily_output_folder": args.pcrglobwb_daily_output_folder, \
+                     "output_folder": args.output_folder_for_irrigation_demand, "output_file": args.output_file_for_irrigation_demand, \
+                     "output_variables": args.output_variables.split(","), "separate_files": args.separate_files, "async_writer": args.async_writer, \
+                     "sync_interval": args.sync_interval, "netcdf_options": netcdf_options, "fingerprint": args.fingerprint, "engine": args.engine, \
+                     "prefetch": not args.no_prefetch}
+        if args.tiles > 1:
+            batch.run_tiles(batch_run, args.tiles, args.tile_rows, backend = args.backend, sparse = args.sparse)
+        else:
+            batch.run_year_chunks(batch_run, args.parallel_years, args.years_per_chunk, backend = args.backend, sparse = args.sparse)
+        return
     
-    calculationModel = CalcFramework(input_files["clone_map"],\
-                                     modelTime, \
-                                     input_files, \
-                                     output_files)
-
-    dynamic_framework = DynamicFramework(calculationModel, modelTime.nrOfTimeSteps)
-    dynamic_framework.setQuiet(True)
-    dynamic_framework.run()
+    run(args.start_year, args.end_year, input_files, output_files, backend = args.backend, sparse = args.sparse, async_writer = args.async_writer, sync_interval = args.sync_interval, netcdf_options = netcdf_options, \
+        resume = args.resume, checkpoint_interval = args.checkpoint_interval, append = args.append, fingerprint_mode = args.fingerprint, engine = args.engine, region = region, \
+        prefetch = not args.no_prefetch)
 
 if __name__ == '__main__':
     sys.exit(main())
@@ -0,0 +1,124 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+import queue
+import collections
+
+import logging
+logger = logging.getLogger(__name__)
+
+# default memory budget (bytes) of the reads that are not taken yet (see InputPrefetcher); None means no budget
+default_max_bytes = 256 * 1024**2
+
+class InputPrefetcher():
+
+    def __init__(self, max_items = 4, max_bytes = -1):
+
+        # read-ahead of input fields: the reads given to prefetch are done by a background thread, while the model calculates the current time step
+        # - a read is identified by a key (e.g. the input, the file and the dates); get returns the prefetched result, waiting for it if it is still being read,
+        #   or reads it in the calling thread if it was not prefetched (or if the background read failed)
+        # - the buffer is bounded: at most max_items reads that are not taken yet, of at most max_bytes (the sizes given to prefetch; -1 means default_max_bytes); 
+        #   further reads are not prefetched (they are read when they are needed)
+        # - the netcdf files are only read while holding vos.netcdf_lock (see virtualOS), so that the reads overlap with the calculations but not with other reads or writes
+        self.max_items = max(1, max_items)
+        self.max_bytes = default_max_bytes if max_bytes == -1 else max_bytes
+        self.nbytes    = 0
+        self.items     = collections.OrderedDict()
+        self.queue     = queue.Queue()
+        self.lock      = threading.Lock()
+        self.reader    = None
+
+        # instrumentation (times in seconds)
+        # - read: time of the background reads; wait: time waited for reads that were not finished yet; sync_read: time of the reads that were not prefetched
+        # - hidden: time of the taken background reads that was not waited for, i.e. the I/O time overlapped with the calculations
+        # - peak_bytes: the largest size of the reads that were not taken yet
+        self.stats = {"prefetched": 0, "ready": 0, "waited": 0, "misses": 0, "skipped": 0, "failed": 0, "discarded": 0, \
+                      "read": 0.0, "wait": 0.0, "sync_read": 0.0, "hidden": 0.0, "peak_bytes": 0}
+
+    def prefetch(self, key, nbytes, function, *args, **kwargs):
+
+        # schedule the read function(*args, **kwargs) with the given key; nbytes is the (estimated) size of its result
+        with self.lock:
+            if key in self.items: return
+            if len(self.items) >= self.max_items or (self.max_bytes != None and self.nbytes + nbytes > self.max_bytes):
+                self.stats["skipped"] += 1
+                return
+            item = {"done": threading.Event(), "result": None, "error": None, "time": 0.0, "nbytes": nbytes}
+            self.items[key] = item
+            self.nbytes += nbytes
+            self.stats["prefetched"] += 1
+            self.stats["peak_bytes"] = max(self.stats["peak_bytes"], self.nbytes)
+        if self.reader == None:
+            self.reader = threading.Thread(target = self.reader_loop, name = "InputPrefetcher")
+            self.reader.daemon = True
+            self.reader.start()
+        self.queue.put((item, function, args, kwargs))
+
+    def get(self, key, function, *args, **kwargs):
+
+        # the result of the read with the given key (function(*args, **kwargs) is called if it was not prefetched)
+        with self.lock: 
+            item = self.items.pop(key, None)
+            if item != None: self.nbytes -= item["nbytes"]
+        if item != None:
+            start = time.time()
+            ready = item["done"].is_set()
+            item["done"].wait()
+            wait  = time.time() - start
+            with self.lock:
+                self.stats["wait"] += wait
+                if item["error"] == None:
+                    self.stats["ready" if ready else "waited"] += 1
+                    self.stats["hidden"] += max(0.0, item["time"] - wait)
+                    return item["result"]
+                self.stats["failed"] += 1
+            logger.warning("The prefetched read of " + str(key) + " failed (" + repr(item["error"]) + "); it is read again.")
+        start = time.time()
+        result = function(*args, **kwargs)
+        with self.lock:
+            self.stats["misses"] += 1
+            self.stats["sync_read"] += time.time() - start
+        return result
+
+    def discard(self, keep = None):
+
+        # drop the prefetched reads that are not taken (except those for which keep(key) is true), e.g. after the model jumps in time
+        with self.lock:
+            for key in list(self.items.keys()):
+                if keep != None and keep(key): continue
+                self.nbytes -= self.items.pop(key)["nbytes"]
+                self.stats["discarded"] += 1
+
+    def reader_loop(self):
+
+        # background thread
+        while True:
+            task = self.queue.get()
+            if task == None: return
+            item, function, args, kwargs = task
+            start = time.time()
+            try:
+                item["result"] = function(*args, **kwargs)
+            except Exception as error:
+                item["error"] = error
+            item["time"] = time.time() - start
+            with self.lock: self.stats["read"] += item["time"]
+            item["done"].set()
+
+    def get_stats(self):
+
+        with self.lock:
+            stats = dict(self.stats)
+        stats["io_wait"] = stats["wait"] + stats["sync_read"]
+        return stats
+
+    def close(self):
+
+        # stop the thread (after the scheduled reads) and drop the reads that are not taken
+        if self.reader != None:
+            self.queue.put(None)
+            self.reader.join()
+            self.reader = None
+        self.discard()
@@ -1,13 +1,10 @@
 
-python dynamic_calc_framework_for_estimating_irrigation_demand.py 1960 2014 /projects/0/dfguu/users/edwin/data/pcrglobwb_input_aqueduct/version_2021-09-16/ historical_and_ssp_files/irrigated_areas_historical_1960-2019.nc /projects/0/dfguu2/users/edwin/pcrglobwb_aqueduct_2021_monthly_annual_files/version_2021-09-16/gfdl-esm4/historical/begin_from_1960/global/netcdf/ /projects/0/dfguu2/users/edwin/pcrglobwb_aqueduct_2021_daily_files/version_2021-09-16/gfdl-esm4/historical/begin_from_1960/global/netcdf_daily/ /scratch-shared/edwin/irrigation_demand_aqueduct_2021/version_2021-09-16/gfdl-esm4/historical estimateIrrigationDemandVolume_monthTot_output_1960-2014_km3_per_month_gfdl-esm4_historical.nc &
-
-python dynamic_calc_framework_for_estimating_irrigation_demand.py 2015 2100 /projects/0/dfguu/users/edwin/data/pcrglobwb_input_aqueduct/version_2021-09-16/ historical_and_ssp_files/irrigated_areas_ssp1_2000-2050.nc /projects/0/dfguu2/users/edwin/pcrglobwb_aqueduct_2021_monthly_annual_files/version_2021-09-16/gfdl-esm4/ssp126/begin_from_2015/global/netcdf/ /projects/0/dfguu2/users/edwin/pcrglobwb_aqueduct_2021_daily_files/version_2021-09-16/gfdl-esm4/ssp126/begin_from_2015/global/netcdf_daily/ /scratch-shared/edwin/irrigation_demand_aqueduct_2021/version_2021-09-16/gfdl-esm4/ssp126 estimateIrrigationDemandVolume_monthTot_output_2015-2100_km3_per_month_gfdl-esm4_ssp126.nc &
-
-python dynamic_calc_framework_for_estimating_irrigation_demand.py 2015 2100 /projects/0/dfguu/users/edwin/data/pcrglobwb_input_aqueduct/version_2021-09-16/ historical_and_ssp_files/irrigated_areas_ssp3_2000-2050.nc /projects/0/dfguu2/users/edwin/pcrglobwb_aqueduct_2021_monthly_annual_files/version_2021-09-16/gfdl-esm4/ssp370/begin_from_2015/global/netcdf/ /projects/0/dfguu2/users/edwin/pcrglobwb_aqueduct_2021_daily_files/version_2021-09-16/gfdl-esm4/ssp370/begin_from_2015/global/netcdf_daily/ /scratch-shared/edwin/irrigation_demand_aqueduct_2021/version_2021-09-16/gfdl-esm4/ssp370 estimateIrrigationDemandVolume_monthTot_output_2015-2100_km3_per_month_gfdl-esm4_ssp370.nc &
-
-python dynamic_calc_framework_for_estimating_irrigation_demand.py 2015 2100 /projects/0/dfguu/users/edwin/data/pcrglobwb_input_aqueduct/version_2021-09-16/ historical_and_ssp_files/irrigated_areas_ssp5_2000-2050.nc /projects/0/dfguu2/users/edwin/pcrglobwb_aqueduct_2021_monthly_annual_files/version_2021-09-16/gfdl-esm4/ssp585/begin_from_2015/global/netcdf/ /projects/0/dfguu2/users/edwin/pcrglobwb_aqueduct_2021_daily_files/version_2021-09-16/gfdl-esm4/ssp585/begin_from_2015/global/netcdf_daily/ /scratch-shared/edwin/irrigation_demand_aqueduct_2021/version_2021-09-16/gfdl-esm4/ssp585 estimateIrrigationDemandVolume_monthTot_output_2015-2100_km3_per_month_gfdl-esm4_ssp585.nc &
-
-wait
+# run historical, ssp126, ssp370 and ssp585 for gfdl-esm4 (see the manifest); the static inputs are read once and shared by the runs
+python batch_calculate_irrigation_demand.py jobs/manifest_aqueduct_2021.json --gcm gfdl-esm4 --total_cores 96 --cores_per_run 24 \
+       --set pcrglobwb_input_folder=/projects/0/dfguu/users/edwin/data/pcrglobwb_input_aqueduct/version_2021-09-16/ \
+       --set pgb_monthly_out_folder=/projects/0/dfguu2/users/edwin/pcrglobwb_aqueduct_2021_monthly_annual_files/ \
+       --set pgb_daily_out_folder=/projects/0/dfguu2/users/edwin/pcrglobwb_aqueduct_2021_daily_files/ \
+       --set irr_demand_output_folder=/scratch-shared/edwin/irrigation_demand_aqueduct_2021/
 
 
     # ~ start_year                          = sys.argv[1]
@@ -20,10 +20,6 @@
 # load all modules (software) needed
 . /quanta1/home/sutan101/load_my_miniconda_and_my_default_env.sh
 
-# use 24 cores (there are 4 processes in total, hence 96 cores will be used)
-export PCRASTER_NR_WORKER_THREADS=24
-
-
 # go to the script folder
 cd /quanta1/home/sutan101/github/edwinkost/estimate_irrigation_demand/scripts/
 
@@ -35,19 +31,11 @@ PGB_DAILY_OUT_FOLDER="/scratch/depfg/sutan101/pcrglobwb_wri_aqueduct_2021/pcrglo
 IRR_DEMAND_OUTPUT_FOLDER="/scratch/depfg/sutan101/irrigation_demand_aqueduct_2021/"
 
 
-# run the following scripts
-
-# historical
-python dynamic_calc_framework_for_estimating_irrigation_demand.py 1960 2014 ${PGB_INP_FOLDER} historical_and_ssp_files/irrigated_areas_historical_1960-2019.nc ${PGB_MONTHLY_OUT_FOLDER}/version_2021-09-16/mri-esm2-0/historical/begin_from_1960/global/netcdf/ ${PGB_DAILY_OUT_FOLDER}/version_2021-09-16/mri-esm2-0/historical/begin_from_1960/global/netcdf_daily/ ${IRR_DEMAND_OUTPUT_FOLDER}/version_2021-09-16/mri-esm2-0/historical estimateIrrigationDemandVolume_monthTot_output_1960-2014_km3_per_month_mri-esm2-0_historical.nc &
-
-# ssp126
-python dynamic_calc_framework_for_estimating_irrigation_demand.py 2015 2100 ${PGB_INP_FOLDER} historical_and_ssp_files/irrigated_areas_ssp1_2000-2050.nc ${PGB_MONTHLY_OUT_FOLDER}/version_2021-09-16/mri-esm2-0/ssp126/begin_from_2015/global/netcdf/ ${PGB_DAILY_OUT_FOLDER}/version_2021-09-16/mri-esm2-0/ssp126/begin_from_2015/global/netcdf_daily/ ${IRR_DEMAND_OUTPUT_FOLDER}/version_2021-09-16/mri-esm2-0/ssp126 estimateIrrigationDemandVolume_monthTot_output_2015-2100_km3_per_month_mri-esm2-0_ssp126.nc &
-
-# ssp370
-python dynamic_calc_framework_for_estimating_irrigation_demand.py 2015 2100 ${PGB_INP_FOLDER} historical_and_ssp_files/irrigated_areas_ssp3_2000-2050.nc ${PGB_MONTHLY_OUT_FOLDER}/version_2021-09-16/mri-esm2-0/ssp370/begin_from_2015/global/netcdf/ ${PGB_DAILY_OUT_FOLDER}/version_2021-09-16/mri-esm2-0/ssp370/begin_from_2015/global/netcdf_daily/ ${IRR_DEMAND_OUTPUT_FOLDER}/version_2021-09-16/mri-esm2-0/ssp370 estimateIrrigationDemandVolume_monthTot_output_2015-2100_km3_per_month_mri-esm2-0_ssp370.nc &
-
-# ssp585
-python dynamic_calc_framework_for_estimating_irrigation_demand.py 2015 2100 ${PGB_INP_FOLDER} historical_and_ssp_files/irrigated_areas_ssp5_2000-2050.nc ${PGB_MONTHLY_OUT_FOLDER}/version_2021-09-16/mri-esm2-0/ssp585/begin_from_2015/global/netcdf/ ${PGB_DAILY_OUT_FOLDER}/version_2021-09-16/mri-esm2-0/ssp585/begin_from_2015/global/netcdf_daily/ ${IRR_DEMAND_OUTPUT_FOLDER}/version_2021-09-16/mri-esm2-0/ssp585 estimateIrrigationDemandVolume_monthTot_output_2015-2100_km3_per_month_mri-esm2-0_ssp585.nc &
-
-wait
+# run historical, ssp126, ssp370 and ssp585 (see the manifest); the static inputs are read once and shared by the runs
+# - 96 cores in total, 24 cores per run (4 runs at the same time)
+python batch_calculate_irrigation_demand.py jobs/manifest_aqueduct_2021.json --gcm mri-esm2-0 --total_cores 96 --cores_per_run 24 \
+       --set pcrglobwb_input_folder=${PGB_INP_FOLDER} \
+       --set pgb_monthly_out_folder=${PGB_MONTHLY_OUT_FOLDER} \
+       --set pgb_daily_out_folder=${PGB_DAILY_OUT_FOLDER} \
+       --set irr_demand_output_folder=${IRR_DEMAND_OUTPUT_FOLDER}
 
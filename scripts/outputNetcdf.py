@@ -7,13 +7,18 @@ import datetime
 import time
 import re
 import subprocess
+import threading
+import queue
 import netCDF4 as nc
 import numpy as np
 import pcraster as pcr
 import virtualOS as vos
 
-# the following dictionary is needed to avoid open and closing files
-filecache = dict()
+import logging
+logger = logging.getLogger(__name__)
+
+# the following pool is needed to avoid open and closing files (the least recently used files are closed if there are too many, see vos.DatasetPool)
+filecache = vos.DatasetPool("output")
 
 class OutputNetcdf():
     
@@ -21,12 +26,44 @@ class OutputNetcdf():
                        cloneMapFileName = None,\
                        netcdf_format = "NETCDF3_CLASSIC",\
                        netcdf_zlib = False,\
-                       netcdf_attribute_dict = None):
+                       netcdf_attribute_dict = None,\
+                       netcdf_complevel = 4,\
+                       netcdf_shuffle = True,\
+                       netcdf_chunksizes = None,\
+                       netcdf_least_significant_digit = None,\
+                       async_writer = False,\
+                       sync_interval = 12,\
+                       max_queue_size = 24):
         		
         # netcdf format and zlib setup
         self.format = netcdf_format
         self.zlib   = netcdf_zlib 
 
+        # layout of the (time, lat, lon) variables (NETCDF4 formats only)
+        # - complevel and shuffle: deflate level (1-9) and shuffle filter (both only used with zlib)
+        # - chunksizes: chunk shape (time, lat, lon); None means the netcdf library default; e.g. (12, 64, 64) for a good compromise between map and time series access
+        #   (with more than one time step per chunk, use the write-behind mode with sync_interval equal to the time chunk size, so that complete chunks are written; see benchmark_netcdf_layout.py)
+        # - least_significant_digit: lossy quantization (number of decimals kept), None for lossless
+        self.complevel = netcdf_complevel
+        self.shuffle   = netcdf_shuffle
+        self.chunksizes = netcdf_chunksizes
+        self.least_significant_digit = netcdf_least_significant_digit
+        # - the time axis is a float64 variable with chunks of time_chunksize time steps (the netcdf library default for an unlimited dimension is one time step per chunk)
+        self.time_chunksize = 1024
+
+        # write-behind mode: the fields given to data2NetCDF/dataList2NetCDF are written by a background thread (see writer_loop)
+        # - the thread owns the netcdf files it writes to; it writes the time steps of a file together and syncs the file every sync_interval time steps (and at flush/close)
+        # - the queue is bounded (max_queue_size time steps), so that the model waits if the writing cannot keep up
+        # - errors of the thread are raised by the next call of data2NetCDF, dataList2NetCDF, flush or close
+        self.async_writer  = async_writer
+        self.sync_interval = max(1, sync_interval)
+        if self.async_writer:
+            self.queue         = queue.Queue(maxsize = max_queue_size)
+            self.writer        = None
+            self.writer_error  = None
+            self.writer_files  = {}
+            self.writer_buffer = {}
+
         # longitudes and latitudes
         if cloneMapFileName != None:\
            self.longitudes, self.latitudes, cellSizeInArcMin = self.set_latlon_based_on_cloneMapFileName(cloneMapFileName)
@@ -58,22 +95,19 @@ class OutputNetcdf():
         
     def set_latlon_based_on_cloneMapFileName(self, cloneMapFileName):
 
-        # cloneMap
-        cloneMap = pcr.boolean(pcr.readmap(cloneMapFileName))
-        cloneMap = pcr.boolean(pcr.scalar(1.0))
-        
-        # properties of the clone maps
+        # properties of the clone maps (from the clone geometry registry in virtualOS)
+        cloneGeometry = vos.getCloneGeometry(cloneMapFileName)
         # - numbers of rows and colums
-        rows = pcr.clone().nrRows() 
-        cols = pcr.clone().nrCols()
+        rows = cloneGeometry.rows
+        cols = cloneGeometry.cols
         # - cell size in arc minutes rounded to one value behind the decimal
-        cellSizeInArcMin = round(pcr.clone().cellSize() * 60.0, 1) 
+        cellSizeInArcMin = round(cloneGeometry.cellsize * 60.0, 1) 
         # - cell sizes in ar degrees for longitude and langitude direction 
         deltaLon = cellSizeInArcMin / 60.
         deltaLat = deltaLon
         # - coordinates of the upper left corner - rounded to two values behind the decimal in order to avoid rounding errors during (future) resampling process
-        x_min = round(pcr.clone().west(), 2)
-        y_max = round(pcr.clone().north(), 2)
+        x_min = round(cloneGeometry.xUL, 2)
+        y_max = round(cloneGeometry.yUL, 2)
         # - coordinates of the lower right corner - rounded to two values behind the decimal in order to avoid rounding errors during (future) resampling process
         x_max = round(x_min + cols*deltaLon, 2) 
         y_min = round(y_max - rows*deltaLat, 2) 
@@ -119,8 +153,35 @@ class OutputNetcdf():
 
         return longitudes, latitudes, cellSizeInArcMin  
 
+    def get_variable_layout(self):
+
+        # keyword arguments of createVariable for the (time, lat, lon) variables
+        layout = {'zlib': self.zlib}
+        if self.zlib: 
+            layout['complevel'] = self.complevel
+            layout['shuffle']   = self.shuffle
+        if self.chunksizes != None:
+            # - the chunk shape cannot be larger than the lat and lon dimensions
+            layout['chunksizes'] = (max(1, int(self.chunksizes[0])),\
+                                    max(1, min(int(self.chunksizes[1]), len(self.latitudes))),\
+                                    max(1, min(int(self.chunksizes[2]), len(self.longitudes))))
+        if self.least_significant_digit != None: layout['least_significant_digit'] = self.least_significant_digit
+        return layout
+
+    def get_time_layout(self):
+
+        # keyword arguments of createVariable for the time variable (chunking is only available in the NETCDF4 formats)
+        if not self.format.startswith("NETCDF4"): return {}
+        return {'chunksizes': (self.time_chunksize,)}
+
     def createNetCDF(self, ncFileName, varName, varUnits, longName = None, attributeDictionary = None):
 
+        if self.async_writer: self.close(ncFileName)
+
+        with vos.netcdf_lock: self.createNetCDFFile(ncFileName, varName, varUnits, longName, attributeDictionary)
+
+    def createNetCDFFile(self, ncFileName, varName, varUnits, longName = None, attributeDictionary = None):
+
         rootgrp = nc.Dataset(ncFileName,'w',format= self.format)
 
         #-create dimensions - time is unlimited, others are fixed
@@ -128,7 +189,7 @@ class OutputNetcdf():
         rootgrp.createDimension('lat',len(self.latitudes))
         rootgrp.createDimension('lon',len(self.longitudes))
 
-        date_time = rootgrp.createVariable('time','f4',('time',))
+        date_time = rootgrp.createVariable('time','f8',('time',),**self.get_time_layout())
         date_time.standard_name = 'time'
         date_time.long_name = 'Days since 1901-01-01'
 
@@ -152,7 +213,7 @@ class OutputNetcdf():
         longVarName  = varName
         if longName != None: longVarName = longName
 
-        var = rootgrp.createVariable(shortVarName,'f4',('time','lat','lon',),fill_value=vos.MV,zlib=self.zlib)
+        var = rootgrp.createVariable(shortVarName,'f4',('time','lat','lon',),fill_value=vos.MV,**self.get_variable_layout())
         var.standard_name = varName
         var.long_name = longVarName
         var.units = varUnits
@@ -166,90 +227,178 @@ class OutputNetcdf():
 
     def changeAtrribute(self, ncFileName, attributeDictionary, closeFile = False):
 
-        if ncFileName in filecache.keys():
-            #~ print "Cached: ", ncFileName
-            rootgrp = filecache[ncFileName]
-        else:
-            #~ print "New: ", ncFileName
-            rootgrp = nc.Dataset(ncFileName,'a')
-            filecache[ncFileName] = rootgrp
+        # write-behind mode: the file is closed by the thread first (a file can only be opened once for writing)
+        if self.async_writer: self.close(ncFileName)
 
-        for k, v in attributeDictionary.items(): setattr(rootgrp,k,v)
+        with vos.netcdf_lock:
+            rootgrp = vos.openDataset(ncFileName, 'a', filecache)
 
-        rootgrp.sync()
-        if closeFile == True: rootgrp.close()
+            for k, v in attributeDictionary.items(): setattr(rootgrp,k,v)
 
-    def addNewVariable(self, ncFileName, varName, varUnits, longName=None, closeFile = False):
-
-        if ncFileName in filecache.keys():
-            #~ print "Cached: ", ncFileName
-            rootgrp = filecache[ncFileName]
-        else:
-            #~ print "New: ", ncFileName
-            rootgrp = nc.Dataset(ncFileName,'a')
-            filecache[ncFileName] = rootgrp
+            rootgrp.sync()
+            # - write-behind mode: the file is always closed (the thread opens it again for the next fields)
+            if closeFile == True or self.async_writer: 
+                rootgrp.close()
+                filecache.pop(ncFileName, None)
 
-        shortVarName = varName
-
-        var = rootgrp.createVariable(shortVarName,'f4',('time','lat','lon',) ,fill_value=vos.MV,zlib=self.zlib)
-        var.standard_name = varName
-        var.long_name = varName
-        var.units = varUnits
-
-        rootgrp.sync()
-        if closeFile == True: rootgrp.close()
+    def addNewVariable(self, ncFileName, varName, varUnits, longName=None, closeFile = False):
 
-    def data2NetCDF(self, ncFileName, shortVarName, varField, timeStamp, posCnt = None, closeFile = False):
+        if self.async_writer: self.close(ncFileName)
 
-        if ncFileName in filecache.keys():
-            #~ print "Cached: ", ncFileName
-            rootgrp = filecache[ncFileName]
-        else:
-            #~ print "New: ", ncFileName
-            rootgrp = nc.Dataset(ncFileName,'a')
-            filecache[ncFileName] = rootgrp
+        with vos.netcdf_lock:
+            rootgrp = vos.openDataset(ncFileName, 'a', filecache)
 
-        date_time = rootgrp.variables['time']
-        if posCnt == None: posCnt = len(date_time)
-        date_time[posCnt] = nc.date2num(timeStamp,date_time.units,date_time.calendar)
+            shortVarName = varName
 
-        rootgrp.variables[shortVarName][posCnt,:,:] = varField
+            var = rootgrp.createVariable(shortVarName,'f4',('time','lat','lon',) ,fill_value=vos.MV,**self.get_variable_layout())
+            var.standard_name = varName
+            var.long_name = varName
+            if longName != None: var.long_name = longName
+            var.units = varUnits
 
-        rootgrp.sync()
-        if closeFile == True: rootgrp.close()
+            rootgrp.sync()
+            # - write-behind mode: the file is always closed (the thread opens it again for the next fields)
+            if closeFile == True or self.async_writer: 
+                rootgrp.close()
+                filecache.pop(ncFileName, None)
 
-    def dataList2NetCDF(self, ncFileName, shortVarNameList, varFieldList, timeStamp, posCnt = None, closeFile = False):
+    def data2NetCDF(self, ncFileName, shortVarName, varField, timeStamp, posCnt = None, closeFile = False):
 
-        if ncFileName in filecache.keys():
-            #~ print "Cached: ", ncFileName
-            rootgrp = filecache[ncFileName]
-        else:
-            #~ print "New: ", ncFileName
-            rootgrp = nc.Dataset(ncFileName,'a')
-            filecache[ncFileName] = rootgrp
+        if self.async_writer: return self.dataList2NetCDF(ncFileName, [shortVarName], {shortVarName: varField}, timeStamp, posCnt, closeFile)
 
-        date_time = rootgrp.variables['time']
-        if posCnt == None: posCnt = len(date_time)
+        with vos.netcdf_lock:
+            rootgrp = vos.openDataset(ncFileName, 'a', filecache)
 
-        for shortVarName in shortVarNameList:
+            date_time = rootgrp.variables['time']
+            if posCnt == None: posCnt = len(date_time)
             date_time[posCnt] = nc.date2num(timeStamp,date_time.units,date_time.calendar)
-            rootgrp.variables[shortVarName][posCnt,:,:] = varFieldList[shortVarName]
 
-        rootgrp.sync()
-        if closeFile == True: rootgrp.close()
+            rootgrp.variables[shortVarName][posCnt,:,:] = varField
 
-    def close(self, ncFileName):
+            rootgrp.sync()
+            if closeFile == True: 
+                rootgrp.close()
+                filecache.pop(ncFileName, None)
 
-        if ncFileName in filecache.keys():
-            #~ print "Cached: ", ncFileName
-            rootgrp = filecache[ncFileName]
-        else:
-            #~ print "New: ", ncFileName
-            rootgrp = nc.Dataset(ncFileName,'a')
-            filecache[ncFileName] = rootgrp
-
-        # closing the file 
-        rootgrp.close()
+    def dataList2NetCDF(self, ncFileName, shortVarNameList, varFieldList, timeStamp, posCnt = None, closeFile = False):
 
-        # remove ncFilename from filecache
-        if ncFileName in filecache.keys(): filecache.pop(ncFileName, None)
+        if self.async_writer:
+            # the fields are copied, as the model may change them before they are written
+            fields = dict((shortVarName, np.array(varFieldList[shortVarName], dtype = np.float32)) for shortVarName in shortVarNameList)
+            self.put(("data", ncFileName, shortVarNameList, fields, timeStamp, posCnt))
+            if closeFile == True: self.put(("close", ncFileName, None))
+            return
+
+        with vos.netcdf_lock:
+            rootgrp = vos.openDataset(ncFileName, 'a', filecache)
+
+            date_time = rootgrp.variables['time']
+            if posCnt == None: posCnt = len(date_time)
+
+            for shortVarName in shortVarNameList:
+                date_time[posCnt] = nc.date2num(timeStamp,date_time.units,date_time.calendar)
+                rootgrp.variables[shortVarName][posCnt,:,:] = varFieldList[shortVarName]
+
+            rootgrp.sync()
+            if closeFile == True: 
+                rootgrp.close()
+                filecache.pop(ncFileName, None)
+
+    def flush(self):
+
+        # write-behind mode: wait until all fields given so far are written and synced
+        if self.async_writer:
+            if self.writer != None:
+                done = threading.Event()
+                self.queue.put(("flush", None, done))
+                done.wait()
+            self.raise_writer_error()
+
+        for rootgrp in filecache.values(): 
+            with vos.netcdf_lock: rootgrp.sync()
+
+    def close(self, ncFileName = None):
+
+        # write-behind mode: the file (or all files and the thread if ncFileName is None) is closed by the thread 
+        if self.async_writer:
+            if self.writer != None:
+                done = threading.Event()
+                self.queue.put(("close", ncFileName, done))
+                done.wait()
+                if ncFileName == None:
+                    self.queue.put(("stop", None, None))
+                    self.writer.join()
+                    self.writer = None
+
+        # closing the file (or all files if ncFileName is None) and removing it from filecache 
+        # - write-behind mode: the files that are still opened in filecache (e.g. by changeAtrribute), not by the thread
+        with vos.netcdf_lock:
+            for ncFileToClose in (filecache.keys() if ncFileName == None else [ncFileName]):
+                if ncFileToClose in filecache: filecache.evict(ncFileToClose)
+
+        if self.async_writer: self.raise_writer_error()
+
+    def put(self, item):
+
+        self.raise_writer_error()
+        if self.writer == None:
+            self.writer = threading.Thread(target = self.writer_loop, name = "OutputNetcdfWriter")
+            self.writer.daemon = True
+            self.writer.start()
+        self.queue.put(item)
+
+    def raise_writer_error(self):
+
+        if self.writer_error != None:
+            error, self.writer_error = self.writer_error, None
+            raise error
+
+    def writer_loop(self):
+
+        # background thread of the write-behind mode
+        while True:
+            item = self.queue.get()
+            kind, ncFileName = item[0], item[1]
+            try:
+                if kind == "data" and self.writer_error == None:
+                    self.writer_buffer.setdefault(ncFileName, []).append(item[2:])
+                    if len(self.writer_buffer[ncFileName]) >= self.sync_interval: self.write_buffer(ncFileName)
+                if kind in ["flush", "close", "stop"] and self.writer_error == None:
+                    for fileName in list(self.writer_buffer.keys()):
+                        if ncFileName == None or fileName == ncFileName: self.write_buffer(fileName)
+                if kind in ["close", "stop"]:
+                    for fileName in list(self.writer_files.keys()):
+                        if ncFileName == None or fileName == ncFileName:
+                            with vos.netcdf_lock: self.writer_files.pop(fileName).close()
+            except Exception as error:
+                logger.error("Writing the netcdf output (write-behind thread) failed: " + repr(error))
+                self.writer_error = error
+            # - after an error, the fields are not written anymore (but the queue is still emptied, so that the model does not wait) 
+            if self.writer_error != None: self.writer_buffer.clear()
+            if kind in ["flush", "close"] and item[2] != None: item[2].set()
+            if kind == "stop": return
+
+    def write_buffer(self, ncFileName):
+
+        # write all buffered time steps of a file (consecutive time steps of a variable with one write) and sync the file
+        records = self.writer_buffer.pop(ncFileName, [])
+        if len(records) == 0: return
+        with vos.netcdf_lock:
+            if ncFileName not in self.writer_files: self.writer_files[ncFileName] = nc.Dataset(ncFileName,'a')
+            rootgrp = self.writer_files[ncFileName]
+            date_time = rootgrp.variables['time']
+            nextPosCnt = len(date_time)
+            positions = []
+            for shortVarNameList, varFieldList, timeStamp, posCnt in records:
+                if posCnt == None: posCnt = nextPosCnt
+                positions.append(posCnt)
+                nextPosCnt = max(nextPosCnt, posCnt + 1)
+            sta = 0
+            while sta < len(records):
+                end = sta + 1
+                while end < len(records) and positions[end] == positions[end - 1] + 1 and records[end][0] == records[sta][0]: end += 1
+                date_time[positions[sta]:positions[sta] + end - sta] = nc.date2num([record[2] for record in records[sta:end]], date_time.units, date_time.calendar)
+                for shortVarName in records[sta][0]:
+                    rootgrp.variables[shortVarName][positions[sta]:positions[sta] + end - sta,:,:] = np.stack([record[1][shortVarName] for record in records[sta:end]])
+                sta = end
+            rootgrp.sync()
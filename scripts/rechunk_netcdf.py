@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Make a time-major copy of a (time, lat, lon) netcdf file, e.g. an output file of dynamic_calc_framework_for_estimating_irrigation_demand.py
+# - the chunks of the copy contain the entire time series (or --time_chunk time steps) of a small block of cells, which is fast for extracting (per basin/point) time series
+# - the (time, lat, lon) variables are copied band by band (lat), so that the memory use is limited (see --memory_gb)
+# - other variables, dimensions and attributes are copied as they are
+#
+# usage: python rechunk_netcdf.py <input.nc> <output.nc> [--time_chunk 0] [--space_chunk 16] [--complevel 4] [--no_shuffle] [--least_significant_digit N] [--memory_gb 4]
+
+import sys
+import argparse
+import time
+
+import numpy as np
+import netCDF4 as nc
+
+def get_chunksizes(variable, time_chunk, space_chunk):
+    # chunk shape of a (time, lat, lon) variable in the copy: time_chunk = 0 means all time steps
+    ntime, nlat, nlon = variable.shape
+    if time_chunk <= 0: time_chunk = ntime
+    return (max(1, min(time_chunk, ntime)), max(1, min(space_chunk, nlat)), max(1, min(space_chunk, nlon)))
+
+def is_time_lat_lon(variable):
+    return variable.dimensions == ('time', 'lat', 'lon')
+
+def rechunk(input_file, output_file, time_chunk = 0, space_chunk = 16, complevel = 4, shuffle = True, least_significant_digit = None, memory_gb = 4.0):
+
+    src = nc.Dataset(input_file)
+    dst = nc.Dataset(output_file, 'w', format = "NETCDF4")
+
+    # global attributes and dimensions (the size of the time dimension is fixed in the copy)
+    dst.setncatts(dict((k, src.getncattr(k)) for k in src.ncattrs()))
+    for name, dimension in src.dimensions.items():
+        dst.createDimension(name, len(dimension))
+
+    for name, variable in src.variables.items():
+
+        fill_value = getattr(variable, '_FillValue', None)
+        options = {}
+        if is_time_lat_lon(variable) and variable.shape[0] > 0:
+            options['chunksizes'] = get_chunksizes(variable, time_chunk, space_chunk)
+            options['zlib']       = complevel > 0
+            options['complevel']  = max(1, complevel)
+            options['shuffle']    = shuffle
+            if least_significant_digit != None: options['least_significant_digit'] = least_significant_digit
+        out = dst.createVariable(name, variable.dtype, variable.dimensions, fill_value = fill_value, **options)
+        out.setncatts(dict((k, variable.getncattr(k)) for k in variable.ncattrs() if k != '_FillValue'))
+
+        if not is_time_lat_lon(variable) or variable.shape[0] == 0:
+            out[...] = variable[...]
+            continue
+
+        # (time, lat, lon) variables: bands of rows that are aligned with the chunks of the copy, limited by the memory budget
+        ntime, nlat, nlon = variable.shape
+        rows_per_chunk = options['chunksizes'][1]
+        band_rows = rows_per_chunk * max(1, int(memory_gb * 1024**3 / (ntime * rows_per_chunk * nlon * variable.dtype.itemsize)))
+        start = time.time()
+        for row in range(0, nlat, band_rows):
+            out[:, row:row + band_rows, :] = variable[:, row:row + band_rows, :]
+        print("%s: %i x %i x %i, chunks %s, %.1f s" % (name, ntime, nlat, nlon, str(options['chunksizes']), time.time() - start))
+
+    dst.close()
+    src.close()
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Make a time-major (chunked for time series access) copy of a (time, lat, lon) netcdf file.")
+    parser.add_argument("input_file")
+    parser.add_argument("output_file")
+    parser.add_argument("--time_chunk", type = int, default = 0, help = "number of time steps per chunk (default: 0, all time steps)")
+    parser.add_argument("--space_chunk", type = int, default = 16, help = "number of rows and columns per chunk (default: 16)")
+    parser.add_argument("--complevel", type = int, default = 4, help = "deflate level, 0 for no compression (default: 4)")
+    parser.add_argument("--no_shuffle", action = "store_true", help = "do not use the shuffle filter")
+    parser.add_argument("--least_significant_digit", type = int, default = None, help = "lossy quantization: number of decimals kept (default: lossless); note that the irrigation demand is in km3/month, so that e.g. 8 is needed")
+    parser.add_argument("--memory_gb", type = float, default = 4.0, help = "memory budget for a band of rows (default: 4)")
+    args = parser.parse_args()
+
+    rechunk(args.input_file, args.output_file, args.time_chunk, args.space_chunk, args.complevel, not args.no_shuffle, args.least_significant_digit, args.memory_gb)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -29,6 +29,7 @@ from __future__ import print_function
 
 import shutil
 import subprocess
+import socket
 import datetime
 import random
 import os
@@ -39,6 +40,13 @@ import sys
 import types
 import calendar
 import glob
+import struct
+import collections
+import warnings
+import hashlib
+import time
+import threading
+import itertools
 
 import netCDF4 as nc
 import numpy as np
@@ -51,8 +59,168 @@ from six.moves import range
 
 logger = logging.getLogger(__name__)
 
-# file cache to minimize/reduce opening/closing files.  
-filecache = dict()
+# the netcdf-c library is not thread-safe: netcdf files are only accessed while holding this lock (see the write-behind thread in outputNetcdf.py)
+netcdf_lock = threading.RLock()
+
+# pools of opened netcdf files (see DatasetPool): the number of open files and the memory of their HDF5 chunk caches are limited over all pools
+# - dataset_pool_max_open: maximum number of open files; dataset_pool_max_bytes: memory budget (bytes) of the chunk caches, None means no budget
+# - dataset_chunk_cache_bytes: maximum chunk cache (bytes) per variable; the chunk cache of a variable is sized to hold one time step (see getChunkCacheSize)
+dataset_pool_max_open     = 64
+dataset_pool_max_bytes    = 2 * 1024**3
+dataset_chunk_cache_bytes = 64 * 1024**2
+dataset_pool_stats = {"hits": 0, "misses": 0, "evictions": 0}
+dataset_pools = []
+dataset_pool_clock = itertools.count()
+
+class DatasetPool(object):
+    # least recently used pool of opened netcdf files (netCDF4.Dataset), keyed by file name; it can be used as the dictionary it replaces (e.g. filecache[ncFile] = f)
+    # - a file added to the pool gets its chunk caches sized (see setDatasetChunkCache); the least recently used files (of all pools) are closed if the limits are exceeded
+    # - on_evict(key) is called after a file is closed by the pool, e.g. to drop the cached data of the file
+    # - all access is guarded by netcdf_lock; the file that is added is never closed by the same call, so that it can be used by the caller
+    
+    def __init__(self, name, on_evict = None):
+        self.name     = name
+        self.on_evict = on_evict
+        self.datasets = collections.OrderedDict()
+        self.last_use = dict()
+        self.nbytes   = dict()
+        dataset_pools.append(self)
+
+    def __contains__(self, key):
+        return key in self.datasets
+
+    def __len__(self):
+        return len(self.datasets)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return list(self.datasets.keys())
+
+    def values(self):
+        return list(self.datasets.values())
+
+    def items(self):
+        return list(self.datasets.items())
+
+    def __getitem__(self, key):
+        with netcdf_lock:
+            f = self.datasets[key]
+            self.datasets.move_to_end(key)
+            self.last_use[key] = next(dataset_pool_clock)
+            dataset_pool_stats["hits"] += 1
+            return f
+
+    def __setitem__(self, key, f):
+        with netcdf_lock:
+            if key in self.datasets and self.datasets[key] is not f: self.datasets[key].close()
+            self.pop(key, None)
+            dataset_pool_stats["misses"] += 1
+            self.datasets[key] = f
+            self.last_use[key] = next(dataset_pool_clock)
+            self.nbytes[key]   = setDatasetChunkCache(f)
+            evictDatasets(keep = (self, key))
+
+    def pop(self, key, *default):
+        # removes the file from the pool (without closing it)
+        with netcdf_lock:
+            if key not in self.datasets and len(default) > 0: return default[0]
+            self.last_use.pop(key, None)
+            self.nbytes.pop(key, None)
+            return self.datasets.pop(key)
+
+    def __delitem__(self, key):
+        self.pop(key)
+
+    def clear(self):
+        with netcdf_lock:
+            for key in self.keys(): self.pop(key)
+
+    def evict(self, key):
+        # closes the file and removes it from the pool
+        with netcdf_lock:
+            f = self.pop(key)
+            try:
+                f.close()
+            except Exception as error:
+                logger.warning("Closing the netcdf file " + str(key) + " failed: " + repr(error))
+            if self.on_evict != None: self.on_evict(key)
+
+def getChunkCacheSize(variable):
+    # chunk cache (bytes, number of slots) that holds the chunks of one time step (one layer of chunks of the first dimension) of a variable, 
+    # limited by dataset_chunk_cache_bytes; None for contiguous (e.g. NETCDF3) variables 
+    try:
+        chunking = variable.chunking()
+        itemsize = np.dtype(variable.dtype).itemsize
+    except:
+        return None
+    if chunking == None or chunking == "contiguous" or len(chunking) == 0: return None
+    nchunks = 1
+    for length, chunk in zip(variable.shape[1:], chunking[1:]): nchunks *= max(1, int(math.ceil(float(length) / chunk)))
+    size = min(int(np.prod(chunking)) * itemsize * nchunks, dataset_chunk_cache_bytes)
+    # - the number of slots: a prime number of about 10 times the number of chunks (as recommended for the HDF5 chunk cache)
+    nelems = max(nchunks * 10, 101)
+    while any(nelems % d == 0 for d in range(2, int(math.sqrt(nelems)) + 1)): nelems += 1
+    return size, nelems
+
+def setDatasetChunkCache(f):
+    # sizes the chunk caches of the variables of an opened netcdf file; returns the total (bytes)
+    total = 0
+    for variable in f.variables.values():
+        cache = getChunkCacheSize(variable)
+        if cache == None: continue
+        try:
+            variable.set_var_chunk_cache(size = cache[0], nelems = cache[1])
+            total += cache[0]
+        except Exception as error:
+            logger.debug("Setting the chunk cache of " + str(variable.name) + " failed: " + repr(error))
+    return total
+
+def evictDatasets(keep = None):
+    # closes the least recently used files (of all pools) until the number of open files and their chunk caches are within the limits; keep: (pool, key) not to be closed
+    with netcdf_lock:
+        while True:
+            nopen  = sum(len(pool) for pool in dataset_pools)
+            nbytes = sum(sum(pool.nbytes.values()) for pool in dataset_pools)
+            if nopen <= dataset_pool_max_open and (dataset_pool_max_bytes == None or nbytes <= dataset_pool_max_bytes): return
+            candidates = []
+            for pool in dataset_pools:
+                for key in pool.datasets:
+                    if keep == None or pool is not keep[0] or key != keep[1]:
+                        candidates.append((pool.last_use[key], pool, key))
+                        break
+            if len(candidates) == 0: return
+            last_use, pool, key = min(candidates, key = lambda candidate: candidate[0])
+            logger.debug("Closing the least recently used netcdf file: " + str(key))
+            pool.evict(key)
+            dataset_pool_stats["evictions"] += 1
+
+def openDataset(ncFile, mode = "r", pool = None):
+    # the opened netcdf file from a pool (default: filecache); the file is opened and added to the pool if needed
+    if pool == None: pool = filecache
+    with netcdf_lock:
+        if ncFile in pool: return pool[ncFile]
+        f = nc.Dataset(ncFile, mode)
+        pool[ncFile] = f
+        return f
+
+def releaseDatasetCaches(ncFile):
+    # drops the data cached for a netcdf file that is closed (the decoded time axis, the chunk-aligned blocks and the variable descriptors)
+    timeindexcache.pop(ncFile, None)
+    for key in [key for key in slabcache if key[0] == ncFile]: slabcache.pop(key, None)
+    for key in [key for key in ncdescriptorcache if key[0] == ncFile]: ncdescriptorcache.pop(key, None)
+
+def getDatasetPoolStats():
+    # hits, misses, evictions, and the number of open files and their chunk caches (bytes) over all pools
+    with netcdf_lock:
+        stats = dict(dataset_pool_stats)
+        stats["open"]  = sum(len(pool) for pool in dataset_pools)
+        stats["bytes"] = sum(sum(pool.nbytes.values()) for pool in dataset_pools)
+    return stats
+
+# file cache to minimize/reduce opening/closing files (the input files).  
+filecache = DatasetPool("input", on_evict = releaseDatasetCaches)
 
 # Global variables:
 MV = 1e20
@@ -67,6 +235,79 @@ netcdf_suffixes = ('.nc4','.nc')
 # maximum number of tries for reading files:
 max_num_of_tries = 5
 
+# I/O errors that are raised by the netcdf and PCRaster libraries as RuntimeError (other RuntimeErrors are not retried, see RetryPolicy)
+retry_error_messages = ["NetCDF:", "HDF", "can not be opened", "cannot open", "Input/output error", "Resource temporarily unavailable", "Stale file handle"]
+# number of retries and of failed reads (after all tries) per file
+retry_stats = dict()
+retry_stats_lock = threading.Lock()
+
+class RetryPolicy(object):
+
+    def __init__(self, max_tries = None, base_delay = 2.0, max_delay = 120.0, jitter = 0.5):
+        # retries of the readers: the delay before retry i (1, 2, ...) is base_delay * 2**(i - 1) seconds, at most max_delay, 
+        # shortened by a random fraction (at most jitter) so that the runs of a batch do not retry at the same moment
+        # - only I/O errors are retried (see retryable); other errors (e.g. a missing variable) are raised at once
+        # - before every retry, the cached netcdf file is closed, so that it is opened again (see closeCachedDataset)
+        # - max_tries: the number of tries; None means max_num_of_tries
+        self.max_tries  = max_tries
+        self.base_delay = base_delay
+        self.max_delay  = max_delay
+        self.jitter     = jitter
+        self.random     = random.Random()
+
+    def retryable(self, error):
+        # - an error of a nested reader that was already retried (e.g. netcdf2PCRobjClone in readPCRmapClone) is not retried again
+        if getattr(error, "retries_exhausted", False): return False
+        if isinstance(error, (OSError, IOError)): return True
+        if isinstance(error, RuntimeError): return any(message in str(error) for message in retry_error_messages)
+        return False
+
+    def delay(self, retry):
+        delay = min(self.max_delay, self.base_delay * 2**(retry - 1))
+        return delay * (1.0 - self.jitter * self.random.random())
+
+    def call(self, fileName, function, *args):
+        # returns function(*args), reading fileName; the last error is raised if all tries fail 
+        max_tries = self.max_tries
+        if max_tries == None: max_tries = max_num_of_tries
+        fileName = str(fileName)
+        tries = 0
+        while True:
+            try:
+                return function(*args)
+            except Exception as error:
+                tries = tries + 1
+                if not self.retryable(error): raise
+                if tries >= max(1, max_tries):
+                    with retry_stats_lock: retry_stats.setdefault(fileName, {"retries": 0, "failures": 0})["failures"] += 1
+                    logger.error("CANNOT READ file: " + fileName + " (" + str(tries) + " tries; " + repr(error) + ")")
+                    try:
+                        error.retries_exhausted = True
+                    except AttributeError:
+                        pass
+                    raise
+                delay = self.delay(tries)
+                with retry_stats_lock: retry_stats.setdefault(fileName, {"retries": 0, "failures": 0})["retries"] += 1
+                logger.warning("Re-try to read file: " + fileName + " in " + "%.1f" % (delay) + " s (try " + str(tries + 1) + " of " + str(max_tries) + "; " + repr(error) + ")")
+                closeCachedDataset(fileName)
+                time.sleep(delay)
+
+# the retry policy of the readers (netcdf2PCRobjClone, netcdf2NumpySlabClone, readPCRmapClone, ...)
+retry_policy = RetryPolicy()
+
+def getRetryStats():
+    with retry_stats_lock:
+        return dict((fileName, dict(stats)) for fileName, stats in retry_stats.items())
+
+def closeCachedDataset(ncFile):
+    # close a file of the input file pool (it is opened again by the next read)
+    with netcdf_lock:
+        if ncFile in filecache: filecache.evict(ncFile)
+
+def callWithNetcdfLock(function, *args):
+    with netcdf_lock:
+        return function(*args)
+
 def initialize_logging(log_file_location, log_file_front_name = "log", debug_mode = True):
     """
     Initialize logging. Prints to both the console and a log file, at configurable levels
@@ -139,17 +380,11 @@ def checkVariableInNC(ncFile,varName):
 
     logger.debug('Check whether the variable: '+str(varName)+' is defined in the file: '+str(ncFile))
     
-    if ncFile in list(filecache.keys()):
-        f = filecache[ncFile]
-        #~ print "Cached: ", ncFile
-    else:
-        f = nc.Dataset(ncFile)
-        filecache[ncFile] = f
-        #~ print "New: ", ncFile
-    
     varName = str(varName)
     
-    return varName in list(f.variables.keys())
+    with netcdf_lock:
+        f = openDataset(ncFile)
+        return varName in list(f.variables.keys())
 
 def netcdf2PCRobjCloneWithoutTime(ncFile, varName,\
                                   cloneMapFileName  = None,\
@@ -157,26 +392,69 @@ def netcdf2PCRobjCloneWithoutTime(ncFile, varName,\
                                   specificFillValue = None,\
                                   absolutePath = None):
     
-    iter_try = 0
-    while iter_try < max_num_of_tries:
-        try:     
-            return singleTryNetcdf2PCRobjCloneWithoutTime(ncFile, varName,\
-                                                          cloneMapFileName, LatitudeLongitude, specificFillValue)
-            iter_try = max_num_of_tries + 100
-        except:     
-            iter_try = iter_try + 1
-            logger.warning("Re-try to read file: " + str(ncFile))
-    
-    if iter_try >= max_num_of_tries:
-        logger.error("CANNOT READ file: " + str(ncFile))
-        return singleTryNetcdf2PCRobjCloneWithoutTime(ncFile, varName,\
-                                                      cloneMapFileName, LatitudeLongitude, specificFillValue)
+    # read with retries (see RetryPolicy)
+    return retry_policy.call(ncFile, callWithNetcdfLock, singleTryNetcdf2PCRobjCloneWithoutTime, ncFile, varName,\
+                             cloneMapFileName, LatitudeLongitude, specificFillValue)
 
 def singleTryNetcdf2PCRobjCloneWithoutTime(ncFile, varName,\
                                            cloneMapFileName  = None,\
                                            LatitudeLongitude = True,\
                                            specificFillValue = None,\
                                            absolutePath = None):
+    # as singleTryNetcdf2PCRobjCloneWithoutTimeOLD, but only the hyperslab of the clone map is read (the crop window is cached, see getNCCropWindow)
+    
+    if absolutePath != None: ncFile = getFullPath(ncFile, absolutePath)
+    
+    logger.debug('reading variable: '+str(varName)+' from the file: '+str(ncFile))
+    
+    f = openDataset(ncFile)
+    
+    varName = str(varName)
+    if varName == "automatic":
+        nc_dims = [dim for dim in f.dimensions]
+        nc_vars = [var for var in f.variables]
+        for var in nc_vars:                   
+            if var not in nc_dims and var not in ["lat", "lon", "latitude", "longitude"]: varName = var
+        logger.debug('reading variable: '+str(varName)+' from the file: '+str(ncFile))
+
+    if LatitudeLongitude == True:
+        try:
+            f.variables['lat'] = f.variables['latitude']
+            f.variables['lon'] = f.variables['longitude']
+        except:
+            pass
+    
+    # the hyperslab needed to match the clone map and the resampling factor
+    window, factor = getNCCropWindow(f, cloneMapFileName)
+    if window == None: window = (slice(None), slice(None))
+
+    # convert to PCR object
+    if specificFillValue != None:
+        fillValue = float(specificFillValue)
+    else:
+        try:
+            fillValue = float(f.variables[varName]._FillValue)
+        except:
+            fillValue = float(f.variables[varName].missing_value)
+
+    # - registered files: from the decoded field store (see readDecodedFields), with the missing values (NaN) set to the fill value
+    if useDecodedFieldCache(ncFile):
+        cropData = decodedField2Fill(readDecodedFields(f, ncFile, varName, None, window, specificFillValue)[0], fillValue)
+    else:
+        cropData = f.variables[varName][window[0], window[1]]
+    outPCR = pcr.numpy2pcr(pcr.Scalar, \
+              regridData2FinerGrid(factor, cropData, fillValue), \
+              fillValue)
+    
+    f = None ; cropData = None 
+    # PCRaster object
+    return (outPCR)
+
+def singleTryNetcdf2PCRobjCloneWithoutTimeOLD(ncFile, varName,\
+                                              cloneMapFileName  = None,\
+                                              LatitudeLongitude = True,\
+                                              specificFillValue = None,\
+                                              absolutePath = None):
     
     if absolutePath != None: ncFile = getFullPath(ncFile, absolutePath)
     
@@ -217,8 +495,8 @@ def singleTryNetcdf2PCRobjCloneWithoutTime(ncFile, varName,\
     sameClone = True
     # check whether clone and input maps have the same attributes:
     if cloneMapFileName != None:
-        # get the attributes of cloneMap
-        attributeClone = getMapAttributesALL(cloneMapFileName)
+        # get the attributes of cloneMap (from the clone geometry registry)
+        attributeClone = getCloneGeometry(cloneMapFileName)
         cellsizeClone = attributeClone['cellsize']
         rowsClone = attributeClone['rows']
         colsClone = attributeClone['cols']
@@ -314,20 +592,9 @@ def netcdf2PCRobjClone(ncFile,\
                        LatitudeLongitude = True,\
                        specificFillValue = None):
     
-    iter_try = 0
-    while iter_try < max_num_of_tries:
-        try:     
-            return singleTryNetcdf2PCRobjClone(ncFile, varName, dateInput, useDoy, cloneMapFileName, LatitudeLongitude, \
-                                               specificFillValue)
-            iter_try = max_num_of_tries + 100
-        except:     
-            iter_try = iter_try + 1
-            logger.warning("Re-try to read file: " + str(ncFile))
-    
-    if iter_try >= max_num_of_tries:
-        logger.error("CANNOT READ file: " + str(ncFile))
-        return singleTryNetcdf2PCRobjClone(ncFile, varName, dateInput, useDoy, cloneMapFileName, LatitudeLongitude, \
-                                           specificFillValue)
+    # read with retries (see RetryPolicy)
+    return retry_policy.call(ncFile, callWithNetcdfLock, singleTryNetcdf2PCRobjClone, ncFile, varName, dateInput, useDoy, cloneMapFileName, LatitudeLongitude, \
+                             specificFillValue)
 
 def singleTryNetcdf2PCRobjClone_version_until_2020_07_14(ncFile,\
                                 varName = "automatic" ,
@@ -619,32 +886,142 @@ def singleTryNetcdf2PCRobjClone_version_until_2020_07_14(ncFile,\
     return (outPCR)
 
 
-def singleTryNetcdf2PCRobjClone(ncFile,\
-                                varName = "automatic" ,
-                                dateInput = None,\
-                                useDoy = None,\
-                                cloneMapFileName  = None,\
-                                LatitudeLongitude = True,\
-                                specificFillValue = None):
-    # 
-    # EHS (19 APR 2013): To convert netCDF (tss) file to PCR file.
-    # --- with clone checking
-    #     Only works if cells are 'square'.
-    #     Only works if cellsizeClone <= cellsizeInput
-    # Get netCDF file and variable name:
+# time index cache: the time axis of every netcdf file is decoded only once
+timeindexcache = dict()
+
+class NCTimeIndex(object):
+    # decoded time axis of a netcdf file: a date -> index hash map plus sorted arrays for the 'before', 'after' and 'nearest' searches
+
+    def __init__(self, ncTimeVariable):
+        object.__init__(self)
+        self.units    = ncTimeVariable.units
+        self.calendar = getattr(ncTimeVariable, "calendar", "standard")
+        self.values   = np.ma.getdata(ncTimeVariable[:]).astype(np.float64)
+        self.dates    = nc.num2date(self.values, self.units, self.calendar)
+        # date -> index hash map (the first index is used for duplicated dates)
+        self.index = dict()
+        for i, d in enumerate(self.dates):
+            key = (d.year, d.month, d.day, d.hour, d.minute, d.second)
+            if key not in self.index: self.index[key] = i
+        # sorted time values
+        self.order         = np.argsort(self.values, kind = "mergesort")
+        self.sorted_values = self.values[self.order]
+        # the first and last years (as in findFirstYearInNCTime and findLastYearInNCTime)
+        self.first_year = self.dates[0].year
+        self.last_year  = self.dates[len(self.dates) - 1].year
+
+    def __len__(self):
+        return len(self.values)
+
+    def exact(self, date):
+        key = (date.year, date.month, date.day, getattr(date, "hour", 0), getattr(date, "minute", 0), getattr(date, "second", 0))
+        if key not in self.index: raise ValueError("The date " + str(date) + " is not available in the time axis.")
+        return self.index[key]
+
+    def before(self, date):
+        pos = int(np.searchsorted(self.sorted_values, nc.date2num(date, self.units, self.calendar), side = "left")) - 1
+        if pos < 0: raise ValueError("There is no date before " + str(date) + " in the time axis.")
+        return int(self.order[pos])
+
+    def after(self, date):
+        pos = int(np.searchsorted(self.sorted_values, nc.date2num(date, self.units, self.calendar), side = "left"))
+        if pos >= len(self.sorted_values): raise ValueError("There is no date after " + str(date) + " in the time axis.")
+        return int(self.order[pos])
+
+    def nearest(self, date):
+        value = nc.date2num(date, self.units, self.calendar)
+        pos = int(np.searchsorted(self.sorted_values, value))
+        candidates = [p for p in (pos, pos - 1) if p >= 0 and p < len(self.sorted_values)]
+        pos = min(candidates, key = lambda p: abs(self.sorted_values[p] - value))
+        return int(self.order[pos])
+
+    def select(self, date, select = "exact"):
+        return getattr(self, select)(date)
+
+def getNCTimeIndex(ncFile, f = None):
+    if ncFile in timeindexcache: return timeindexcache[ncFile]
+    if f is None: f = filecache[ncFile]
+    logger.debug('Decoding the time axis of the file: '+str(ncFile))
+    timeindexcache[ncFile] = NCTimeIndex(f.variables['time'])
+    return timeindexcache[ncFile]
+
+def findTimeIndexInNC(f, ncFile, varName, dateInput, useDoy = None):
+    # returns the time index to be read (and the date used for it); the logic follows singleTryNetcdf2PCRobjClone_version_until_2020_07_14 
+    date = dateInput
     
-    #~ print ncFile
+    if dateInput == None:
+        logger.debug('Using the first time step in the netcdf file.')
+        if len(f.variables['time']) > 1: logger.warning('NOTE that there are more than one time steps in the netcdf file.')
+        return 0, date
+
+    if useDoy == "Yes": 
+        logger.debug('Finding the date based on the given climatology doy index (1 to 366, or index 0 to 365)')
+        return int(dateInput) - 1, date
+
+    # make sure that date is in the correct format
+    if isinstance(date, str) == True: date = \
+                    datetime.datetime.strptime(str(date),'%Y-%m-%d') 
+
+    if useDoy == "month":  # PS: WE NEED THIS ONE FOR NETCDF FILES that contain only 12 monthly values (e.g. cropCoefficientWaterNC).
+        logger.debug('Finding the date based on the given climatology month index (1 to 12, or index 0 to 11)')
+        return int(date.month) - 1, date
     
-    if varName != "automatic": logger.debug('reading variable: '+str(varName)+' from the file: '+str(ncFile))
+    time_index = getNCTimeIndex(ncFile, f)
     
-    if ncFile in list(filecache.keys()):
-        f = filecache[ncFile]
-        #~ print "Cached: ", ncFile
-    else:
-        f = nc.Dataset(ncFile)
-        filecache[ncFile] = f
-        #~ print "New: ", ncFile
+    date = datetime.datetime(date.year,date.month,date.day)
+    if useDoy == "yearly":
+        date  = datetime.datetime(date.year,int(1),int(1))
+    if useDoy == "monthly":
+        date = datetime.datetime(date.year,date.month,int(1))
+    if useDoy == "yearly" or useDoy == "monthly" or useDoy == "daily_seasonal" or useDoy == "daily" or useDoy == "daily_per_monthly_file":
+        # if the desired year is not available, use the first year or the last year that is available
+        available_year = None
+        if date.year < time_index.first_year: available_year = time_index.first_year
+        if date.year > time_index.last_year : available_year = time_index.last_year
+        if available_year is not None:
+            if date.day == 29 and date.month == 2 and calendar.isleap(date.year) and calendar.isleap(available_year) == False:
+                date = datetime.datetime(available_year, date.month, 28)
+            else:
+                date = datetime.datetime(available_year, date.month, date.day)
+            msg  = "\n"
+            msg += "WARNING related to the netcdf file: "+str(ncFile)+" ; variable: "+str(varName)+" !!!!!!"+"\n"
+            msg += "The date "+str(dateInput)+" is NOT available. "
+            msg += "The date "+str(date.year)+"-"+str(date.month)+"-"+str(date.day)+" is used."
+            msg += "\n"
+            logger.warning(msg)
+    try:
+        idx = time_index.exact(date)
+        msg = "The date "+str(date.year)+"-"+str(date.month)+"-"+str(date.day)+" 00:00:00 is available. The 'exact' option is used while selecting netcdf time."
+        logger.debug(msg)
+    except ValueError:
+        msg = "The date "+str(date.year)+"-"+str(date.month)+"-"+str(date.day)+" 00:00:00 is NOT available. The 'exact' option CANNOT be used while selecting netcdf time."
+        logger.debug(msg)
+        if useDoy == "daily":
+            select = "after"
+        else:
+            select = "before"
+            try:                                  
+                idx = time_index.before(date)
+            except ValueError:
+                select = "after"
+        if select == "after": idx = time_index.after(date)
+        msg  = "\n"
+        msg += "WARNING related to the netcdf file: "+str(ncFile)+" ; variable: "+str(varName)+" !!!!!!"+"\n"
+        msg += "The date "+str(date.year)+"-"+str(date.month)+"-"+str(date.day)+" 00:00:00 is NOT available. The '"+select+"' option is used while selecting netcdf time."
+        msg += "\n"
+        logger.warning(msg)
+        logger.warning('Using the datetime '+str(time_index.dates[int(idx)]))
+        logger.warning(msg)
     
+    idx = int(idx)                                                  
+    logger.debug('Using the date index '+str(idx))
+    logger.debug('Using the datetime '+str(time_index.dates[idx]))
+    
+    return idx, date
+
+
+def resolveNCVariableName(f, ncFile, varName, LatitudeLongitude = True):
+
     varName = str(varName)
     
     if LatitudeLongitude == True:
@@ -661,259 +1038,186 @@ def singleTryNetcdf2PCRobjClone(ncFile,\
             if var not in nc_dims and var not in ["lat", "lon", "latitude", "longitude"]: varName = var
         logger.debug('reading variable: '+str(varName)+' from the file: '+str(ncFile))
     
-    if varName == "evapotranspiration":        
+    # variable names in PCR-GLOBWB and their names in the netcdf files 
+    aliases = {"evapotranspiration": "referencePotET",\
+               "kc"                : "Cropcoefficient",\
+               "interceptCapInput" : "Interceptioncapacity",\
+               "coverFractionInput": "Coverfraction",\
+               "fracVegCover"      : "vegetation_fraction",\
+               "minSoilDepthFrac"  : "minRootDepthFraction",\
+               "maxSoilDepthFrac"  : "maxRootDepthFraction",\
+               "arnoBeta"          : "arnoSchemeBeta"}
+    if varName in aliases:
         try:
-            f.variables['evapotranspiration'] = f.variables['referencePotET']
+            f.variables[varName] = f.variables[aliases[varName]]
         except:
             pass
 
-    if varName == "kc":   # the variable name in PCR-GLOBWB     
-       try:
-           f.variables['kc'] = \
-                f.variables['Cropcoefficient']  # the variable name in the netcdf file
-       except:
-           pass
-
-    if varName == "interceptCapInput":   # the variable name in PCR-GLOBWB     
-       try:
-           f.variables['interceptCapInput'] = \
-                f.variables['Interceptioncapacity']  # the variable name in the netcdf file
-       except:
-           pass
-
-    if varName == "coverFractionInput":   # the variable name in PCR-GLOBWB     
-       try:
-           f.variables['coverFractionInput'] = \
-                f.variables['Coverfraction']  # the variable name in the netcdf file
-       except:
-           pass
+    return varName
 
-    if varName == "fracVegCover":   # the variable name in PCR-GLOBWB     
-       try:
-           f.variables['fracVegCover'] = \
-                f.variables['vegetation_fraction']  # the variable name in the netcdf file
-       except:
-           pass
+# crop windows (see getNCCropWindow), keyed by the netcdf file (and its variable shape) and the clone geometry
+cropwindowcache = dict()
 
-    if varName == "minSoilDepthFrac":   # the variable name in PCR-GLOBWB     
-       try:
-           f.variables['minSoilDepthFrac'] = \
-                f.variables['minRootDepthFraction']  # the variable name in the netcdf file
-       except:
-           pass
-
-    if varName == "maxSoilDepthFrac":   # the variable name in PCR-GLOBWB     
-       try:
-           f.variables['maxSoilDepthFrac'] = \
-                f.variables['maxRootDepthFraction']  # the variable name in the netcdf file
-       except:
-           pass
-
-    if varName == "arnoBeta":   # the variable name in PCR-GLOBWB     
-       try:
-           f.variables['arnoBeta'] = \
-                f.variables['arnoSchemeBeta']  # the variable name in the netcdf file
-       except:
-           pass
+def getNCCropWindow(f, cloneMapFileName):
+    # returns the hyperslab (row and column slices) needed to match the clone map and the resampling factor
+    # - the window is None if the netcdf file and the clone map have the same attributes
+    # - the window is calculated only once per file and clone (see cropwindowcache)
+    #   Only works if cells are 'square'.
+    #   Only works if cellsizeClone <= cellsizeInput
+    if cloneMapFileName == None: return None, 1
 
-    if dateInput == None:
-        logger.debug('Using the first time step in the netcdf file.')
-        idx = 0
-        if len(f.variables['time']) > 1: logger.warning('NOTE that there are more than one time steps in the netcdf file.')
-        
-    else:
-        
-        # date
-        date = dateInput
-        if useDoy == "Yes": 
-            logger.debug('Finding the date based on the given climatology doy index (1 to 366, or index 0 to 365)')
-            idx = int(dateInput) - 1
-        elif useDoy == "month":  # PS: WE NEED THIS ONE FOR NETCDF FILES that contain only 12 monthly values (e.g. cropCoefficientWaterNC).
-            logger.debug('Finding the date based on the given climatology month index (1 to 12, or index 0 to 11)')
-            # make sure that date is in the correct format
-            if isinstance(date, str) == True: date = \
-                            datetime.datetime.strptime(str(date),'%Y-%m-%d') 
-            idx = int(date.month) - 1
-        else:
-            # make sure that date is in the correct format
-            if isinstance(date, str) == True: date = \
-                            datetime.datetime.strptime(str(date),'%Y-%m-%d') 
-            date = datetime.datetime(date.year,date.month,date.day)
-            if useDoy == "yearly":
-                date  = datetime.datetime(date.year,int(1),int(1))
-            if useDoy == "monthly":
-                date = datetime.datetime(date.year,date.month,int(1))
-            if useDoy == "yearly" or useDoy == "monthly" or useDoy == "daily_seasonal" or useDoy == "daily" or useDoy == "daily_per_monthly_file":
-                # if the desired year is not available, use the first year or the last year that is available
-                first_year_in_nc_file = findFirstYearInNCTime(f.variables['time'])
-                last_year_in_nc_file  =  findLastYearInNCTime(f.variables['time'])
-                #
-                if date.year < first_year_in_nc_file:  
-                    if date.day == 29 and date.month == 2 and calendar.isleap(date.year) and calendar.isleap(first_year_in_nc_file) == False:
-                        date = datetime.datetime(first_year_in_nc_file, date.month, 28)
-                    else:
-                        date = datetime.datetime(first_year_in_nc_file, date.month, date.day)
-                    msg  = "\n"
-                    msg += "WARNING related to the netcdf file: "+str(ncFile)+" ; variable: "+str(varName)+" !!!!!!"+"\n"
-                    msg += "The date "+str(dateInput)+" is NOT available. "
-                    msg += "The date "+str(date.year)+"-"+str(date.month)+"-"+str(date.day)+" is used."
-                    msg += "\n"
-                    logger.warning(msg)
-                if date.year > last_year_in_nc_file:  
-                    if date.day == 29 and date.month == 2 and calendar.isleap(date.year) and calendar.isleap(last_year_in_nc_file) == False:
-                        date = datetime.datetime(last_year_in_nc_file, date.month, 28)
-                    else:
-                        date = datetime.datetime(last_year_in_nc_file, date.month, date.day)
-                    msg  = "\n"
-                    msg += "WARNING related to the netcdf file: "+str(ncFile)+" ; variable: "+str(varName)+" !!!!!!"+"\n"
-                    msg += "The date "+str(dateInput)+" is NOT available. "
-                    msg += "The date "+str(date.year)+"-"+str(date.month)+"-"+str(date.day)+" is used."
-                    msg += "\n"
-                    logger.warning(msg)
-            try:
-                idx = nc.date2index(date, f.variables['time'], calendar = f.variables['time'].calendar, \
-                                    select ='exact')
-                msg = "The date "+str(date.year)+"-"+str(date.month)+"-"+str(date.day)+" 00:00:00 is available. The 'exact' option is used while selecting netcdf time."
-                logger.debug(msg)
-            except:
-                msg = "The date "+str(date.year)+"-"+str(date.month)+"-"+str(date.day)+" 00:00:00 is NOT available. The 'exact' option CANNOT be used while selecting netcdf time."
-                logger.debug(msg)
-                if useDoy == "daily":
-                    idx = nc.date2index(date, f.variables['time'], calendar = f.variables['time'].calendar, \
-                                        select = 'after')
-                    msg  = "\n"
-                    msg += "WARNING related to the netcdf file: "+str(ncFile)+" ; variable: "+str(varName)+" !!!!!!"+"\n"
-                    msg += "The date "+str(date.year)+"-"+str(date.month)+"-"+str(date.day)+" 00:00:00 is NOT available. The 'after' option is used while selecting netcdf time."
-                    msg += "\n"
-                else:
-                    try:                                  
-                        idx = nc.date2index(date, f.variables['time'], calendar = f.variables['time'].calendar, \
-                                            select = 'before')
-                        msg  = "\n"
-                        msg += "WARNING related to the netcdf file: "+str(ncFile)+" ; variable: "+str(varName)+" !!!!!!"+"\n"
-                        msg += "The date "+str(date.year)+"-"+str(date.month)+"-"+str(date.day)+" 00:00:00 is NOT available. The 'before' option is used while selecting netcdf time."
-                        msg += "\n"
-                    except:
-                        idx = nc.date2index(date, f.variables['time'], calendar = f.variables['time'].calendar, \
-                                            select = 'after')
-                        msg  = "\n"
-                        msg += "WARNING related to the netcdf file: "+str(ncFile)+" ; variable: "+str(varName)+" !!!!!!"+"\n"
-                        msg += "The date "+str(date.year)+"-"+str(date.month)+"-"+str(date.day)+" 00:00:00 is NOT available. The 'after' option is used while selecting netcdf time."
-                        msg += "\n"
-                logger.warning(msg)
-                date_string = nc.num2date(f.variables['time'][int(idx)], f.variables['time'].units, f.variables['time'].calendar)
-                logger.warning('Using the datetime '+str(date_string))
-                logger.warning(msg)
-                                                  
-    idx = int(idx)                                                  
-    logger.debug('Using the date index '+str(idx))
+    # get the attributes of cloneMap (from the clone geometry registry)
+    attributeClone = getCloneGeometry(cloneMapFileName)
+    try:
+        fileKey = f.filepath()
+    except ValueError:
+        fileKey = id(f)
+    key = (fileKey, len(f.variables['lat']), len(f.variables['lon']), tuple(attributeClone))
+    if key not in cropwindowcache: cropwindowcache[key] = calculateNCCropWindow(f, attributeClone)
+    return cropwindowcache[key]
+
+def calculateNCCropWindow(f, attributeClone):
+    # the crop window of getNCCropWindow
+    cellsizeClone = attributeClone['cellsize']
+    rowsClone = attributeClone['rows']
+    colsClone = attributeClone['cols']
+    xULClone = attributeClone['xUL']
+    yULClone = attributeClone['yUL']
+    # get the attributes of input (netCDF) 
+    cellsizeInput = f.variables['lat'][0]- f.variables['lat'][1]
+    cellsizeInput = float(cellsizeInput)
+    rowsInput = len(f.variables['lat'])
+    colsInput = len(f.variables['lon'])
+    xULInput = f.variables['lon'][0]-0.5*cellsizeInput
+    yULInput = f.variables['lat'][0]+0.5*cellsizeInput
+    # check whether both maps have the same attributes 
+    sameClone = True
+    if cellsizeClone != cellsizeInput: sameClone = False
+    if rowsClone != rowsInput: sameClone = False
+    if colsClone != colsInput: sameClone = False
+    if xULClone != xULInput: sameClone = False
+    if yULClone != yULInput: sameClone = False
+    if sameClone: return None, 1
 
-    date_string = nc.num2date(f.variables['time'][int(idx)], f.variables['time'].units, f.variables['time'].calendar)
-    logger.debug('Using the datetime '+str(date_string))
+    # get resampling factor
+    factor = int(round(float(cellsizeInput)/float(cellsizeClone)))
+    if factor > 1: logger.debug('Resample: input cell size = '+str(float(cellsizeInput))+' ; output/clone cell size = '+str(float(cellsizeClone)))
 
-    sameClone = True
-    # check whether clone and input maps have the same attributes:
-    if cloneMapFileName != None:
-        # get the attributes of cloneMap
-        attributeClone = getMapAttributesALL(cloneMapFileName)
-        cellsizeClone = attributeClone['cellsize']
-        rowsClone = attributeClone['rows']
-        colsClone = attributeClone['cols']
-        xULClone = attributeClone['xUL']
-        yULClone = attributeClone['yUL']
-        # get the attributes of input (netCDF) 
-        cellsizeInput = f.variables['lat'][0]- f.variables['lat'][1]
-        cellsizeInput = float(cellsizeInput)
-        rowsInput = len(f.variables['lat'])
-        colsInput = len(f.variables['lon'])
-        xULInput = f.variables['lon'][0]-0.5*cellsizeInput
-        yULInput = f.variables['lat'][0]+0.5*cellsizeInput
-        # check whether both maps have the same attributes 
-        if cellsizeClone != cellsizeInput: sameClone = False
-        if rowsClone != rowsInput: sameClone = False
-        if colsClone != colsInput: sameClone = False
-        if xULClone != xULInput: sameClone = False
-        if yULClone != yULInput: sameClone = False
+    # crop to cloneMap:
+    minX    = min(abs(f.variables['lon'][:] - (xULClone + 0.5*cellsizeInput))) # ; print(minX)
+    xIdxSta = int(np.where(abs(f.variables['lon'][:] - (xULClone + 0.5*cellsizeInput)) == minX)[0][0])
+    xIdxEnd = int(math.ceil(xIdxSta + colsClone /(factor)))
+    minY    = min(abs(f.variables['lat'][:] - (yULClone - 0.5*cellsizeInput))) # ; print(minY)
+    yIdxSta = int(np.where(abs(f.variables['lat'][:] - (yULClone - 0.5*cellsizeInput)) == minY)[0][0])
+    yIdxEnd = int(math.ceil(yIdxSta + rowsClone /(factor)))
 
+    return (slice(yIdxSta, yIdxEnd), slice(xIdxSta, xIdxEnd)), factor
 
+def readNCField(f, ncFile, varName, idx, window = None):
+    # read a field (or a stack of fields if idx is a slice) from a netcdf variable; window is the hyperslab from getNCCropWindow
+    if window == None: window = (slice(None), slice(None))
     # check data on dimensions - this correction is needed in case of the WFDEI_Forcing which has includes levels for surface varables (time, height/level, lat, lon)
     if f.variables[varName].ndim == 4:
         # not standard NC format
         logger.warning('WARNING: the netCDF file %s has an additional dimension for variable %s ; the last two are read as latitude, longitude' % (ncFile, varName))
         # file with additional layer/dimension
-        cropData = f.variables[varName][int(idx),0,:,:]     # still original data
-    else:
-        # standard nc file
-        cropData = f.variables[varName][int(idx),:,:]       # still original data
-
-
-    factor = 1                                 # needed in regridData2FinerGrid
-    if sameClone == False:
-
-        factor = int(round(float(cellsizeInput)/float(cellsizeClone)))
-
-        # crop to cloneMap:
-        minX    = min(abs(f.variables['lon'][:] - (xULClone + 0.5*cellsizeInput))) # ; print(minX)
-
-        xIdxSta = int(np.where(abs(f.variables['lon'][:] - (xULClone + 0.5*cellsizeInput)) == minX)[0])
+        return f.variables[varName][idx, 0, window[0], window[1]]
+    # standard nc file
+    return f.variables[varName][idx, window[0], window[1]]
 
-        #~ xIdxSta = int(np.where(np.abs(f.variables['lon'][:] - (xULClone - cellsizeInput/2)) == minX)[0][0])
-        #~ # see: https://github.com/UU-Hydro/PCR-GLOBWB_model/pull/13
-
-        #~ xIdxEnd = int(math.ceil(xIdxSta + colsClone /(cellsizeInput/cellsizeClone)))
-        xIdxEnd = int(math.ceil(xIdxSta + colsClone /(factor)))
-
-        minY    = min(abs(f.variables['lat'][:] - (yULClone - 0.5*cellsizeInput))) # ; print(minY)
-
-        yIdxSta = int(np.where(abs(f.variables['lat'][:] - (yULClone - 0.5*cellsizeInput)) == minY)[0])
-
-        #~ yIdxSta = int(np.where(np.abs(f.variables['lat'][:] - (yULClone - cellsizeInput/2)) == minY)[0][0])
-        #~ # see: https://github.com/UU-Hydro/PCR-GLOBWB_model/pull/13
-
-        #~ yIdxEnd = int(math.ceil(yIdxSta + rowsClone /(cellsizeInput/cellsizeClone)))
-        yIdxEnd = int(math.ceil(yIdxSta + rowsClone /(factor)))
-
-        # retrieve data from netCDF for slice
-
-        if f.variables[varName].ndim == 4:
-            # not standard NC format
-            logger.warning('WARNING: the netCDF file %s has an additional dimension for variable %s ; the last two are read as latitude, longitude' % (ncFile, varName))
-            #-file with additional layer
-            cropData = f.variables[varName][int(idx),0,yIdxSta:yIdxEnd,xIdxSta:xIdxEnd]     # selection of original data
-        else:
-            # standard nc file
-            cropData = f.variables[varName][int(idx),  yIdxSta:yIdxEnd,xIdxSta:xIdxEnd]       # selection of original data
-
-        # get resampling factor
-        factor = int(round(float(cellsizeInput)/float(cellsizeClone)))
-        if factor > 1: logger.debug('Resample: input cell size = '+str(float(cellsizeInput))+' ; output/clone cell size = '+str(float(cellsizeClone)))
+def getNCFillValue(f, varName, specificFillValue = None):
+    if specificFillValue != None: return float(specificFillValue)
+    try:
+        return float(f.variables[varName]._FillValue)
+    except:
+        return float(f.variables[varName].missing_value)
+
+# variable descriptors (see NCDescriptor), keyed by the file, the requested variable name, the clone map and the fill value
+ncdescriptorcache = dict()
+
+class NCDescriptor(object):
+
+    def __init__(self, f, ncFile, varName = "automatic", LatitudeLongitude = True, cloneMapFileName = None, specificFillValue = None):
+        # metadata of a variable of an opened netcdf file that the readers need for every time step, determined only once (see getNCDescriptor): 
+        # the variable name (automatic detection and PCR-GLOBWB aliases, see resolveNCVariableName), the variable and lat/lon handles, 
+        # the fill value (None if the variable has none), the number of dimensions, and the hyperslab and resampling factor of the clone map (see getNCCropWindow)
+        self.dataset  = f
+        self.ncFile   = ncFile
+        self.varName  = resolveNCVariableName(f, ncFile, varName, LatitudeLongitude)
+        self.variable = f.variables[self.varName]
+        self.lat      = f.variables.get('lat')
+        self.lon      = f.variables.get('lon')
+        self.ndim     = self.variable.ndim
+        try:
+            self.fillValue = getNCFillValue(f, self.varName, specificFillValue)
+        except AttributeError:
+            self.fillValue = None
+        self.window, self.factor = getNCCropWindow(f, cloneMapFileName)
+
+    def findTimeIndex(self, dateInput, useDoy = None):
+        # the time index of a date (see findTimeIndexInNC; the decoded time axis is cached in timeindexcache)
+        return findTimeIndexInNC(self.dataset, self.ncFile, self.varName, dateInput, useDoy)
+
+    def getDateIndices(self, startDate, endDate = None, useDoy = None):
+        return getNCDateIndices(self.dataset, self.ncFile, self.varName, startDate, endDate, useDoy)
+
+def isNCVariableWithTime(ncFile, varName = "automatic"):
+    # whether the variable of a netcdf file has a time dimension (more than the lat and lon dimensions), opened with retries (see RetryPolicy)
+    def hasTime():
+        with netcdf_lock:
+            return getNCDescriptor(openDataset(ncFile), ncFile, varName).ndim > 2
+    return retry_policy.call(ncFile, hasTime)
+
+def getNCDescriptor(f, ncFile, varName = "automatic", LatitudeLongitude = True, cloneMapFileName = None, specificFillValue = None):
+    # the descriptor of a variable of an opened netcdf file; it is made again if the file was opened again (its handles belong to the opened file)
+    key = (ncFile, str(varName), LatitudeLongitude, cloneMapFileName, specificFillValue)
+    descriptor = ncdescriptorcache.get(key)
+    if descriptor is None or descriptor.dataset is not f:
+        descriptor = NCDescriptor(f, ncFile, varName, LatitudeLongitude, cloneMapFileName, specificFillValue)
+        ncdescriptorcache[key] = descriptor
+    return descriptor
 
+def singleTryNetcdf2PCRobjClone(ncFile,\
+                                varName = "automatic" ,
+                                dateInput = None,\
+                                useDoy = None,\
+                                cloneMapFileName  = None,\
+                                LatitudeLongitude = True,\
+                                specificFillValue = None):
+    # 
+    # EHS (19 APR 2013): To convert netCDF (tss) file to PCR file.
+    # --- with clone checking
+    #     Only works if cells are 'square'.
+    #     Only works if cellsizeClone <= cellsizeInput
+    # Get netCDF file and variable name:
+    
+    #~ print ncFile
+    
+    if varName != "automatic": logger.debug('reading variable: '+str(varName)+' from the file: '+str(ncFile))
+    
+    f = openDataset(ncFile)
+    
+    # the variable name (automatic detection and PCR-GLOBWB aliases), its fill value, and the hyperslab needed to match the clone map and the resampling factor
+    # - determined only once per file (see getNCDescriptor)
+    descriptor = getNCDescriptor(f, ncFile, varName, LatitudeLongitude, cloneMapFileName, specificFillValue)
+    varName, window, factor = descriptor.varName, descriptor.window, descriptor.factor
 
-    #~ # convert to PCR object and close f - OLD METHOD
-    #~ if specificFillValue != None:
-        #~ outPCR = pcr.numpy2pcr(pcr.Scalar, \
-                  #~ regridData2FinerGrid(factor,cropData,MV), \
-                  #~ float(specificFillValue))
-    #~ else:
-        #~ outPCR = pcr.numpy2pcr(pcr.Scalar, \
-                  #~ regridData2FinerGrid(factor,cropData,MV), \
-                  #~ float(f.variables[varName]._FillValue))
+    # find the time index (using the time index cache)
+    idx, date = descriptor.findTimeIndex(dateInput, useDoy)
 
+    # retrieve data from netCDF (only the selection needed)
+    # - registered files: from the decoded field store (see readDecodedFields), with the missing values (NaN) set to the fill value
+    fillValue = descriptor.fillValue
+    if fillValue == None: fillValue = getNCFillValue(f, varName, specificFillValue)
+    if useDecodedFieldCache(ncFile):
+        cropData = decodedField2Fill(readDecodedFields(f, ncFile, varName, np.array([idx], dtype = np.int64), window, fillValue)[0], fillValue)
+    else:
+        cropData = readNCField(f, ncFile, varName, idx, window)
 
     # convert to PCR object and close f 
-    if specificFillValue != None:
-        outPCR = pcr.numpy2pcr(pcr.Scalar, \
-                  regridData2FinerGrid(factor, cropData, float(specificFillValue)), \
-                  float(specificFillValue))
-    else:
-        try:
-            outPCR = pcr.numpy2pcr(pcr.Scalar, \
-                  regridData2FinerGrid(factor, cropData, float(f.variables[varName]._FillValue)), \
-                  float(f.variables[varName]._FillValue))
-        except:
-            outPCR = pcr.numpy2pcr(pcr.Scalar, \
-                  regridData2FinerGrid(factor, cropData, float(f.variables[varName].missing_value)), \
-                  float(f.variables[varName].missing_value))
+    outPCR = pcr.numpy2pcr(pcr.Scalar, \
+              regridData2FinerGrid(factor, cropData, fillValue), \
+              fillValue)
 
     #~ pcr.aguila(outPCR)
     
@@ -923,10 +1227,8 @@ def singleTryNetcdf2PCRobjClone(ncFile,\
         # close the file on the last day of the month
         tomorrow = date + datetime.timedelta(days=1)
         if tomorrow.day == 1: 
-            # close the file
-            f.close()
-            # remove from the cache
-            del filecache[ncFile]
+            # close the file and remove it from the cache
+            filecache.evict(ncFile)
     
     del f ; del cropData
     f = None ; cropData = None 
@@ -935,6 +1237,408 @@ def singleTryNetcdf2PCRobjClone(ncFile,\
     return (outPCR)
 
 
+# the last chunk-aligned block read by the slab reader (per file, variable and window) 
+slabcache = dict()
+# maximum size (bytes) of a chunk-aligned block; bigger blocks are read without alignment
+slab_cache_max_bytes = 2 * 1024**3
+
+def netcdf2NumpySlabClone(ncFile,\
+                          varName = "automatic",\
+                          startDate = None,\
+                          endDate = None,\
+                          useDoy = None,\
+                          cloneMapFileName  = None,\
+                          LatitudeLongitude = True,\
+                          specificFillValue = None,\
+                          cells = None):
+    
+    # read with retries (see RetryPolicy)
+    return retry_policy.call(ncFile, callWithNetcdfLock, singleTryNetcdf2NumpySlabClone, ncFile, varName, startDate, endDate, useDoy, cloneMapFileName, LatitudeLongitude, \
+                             specificFillValue, cells)
+
+def singleTryNetcdf2NumpySlabClone(ncFile,\
+                                   varName = "automatic",\
+                                   startDate = None,\
+                                   endDate = None,\
+                                   useDoy = None,\
+                                   cloneMapFileName  = None,\
+                                   LatitudeLongitude = True,\
+                                   specificFillValue = None,\
+                                   cells = None):
+    # returns a float32 array [ndays, rows, cols] with the daily fields from startDate to endDate (both included) 
+    # - the fields are read with one hyperslab read (aligned to the chunking of the time dimension)
+    # - the dates are resolved as in singleTryNetcdf2PCRobjClone (see findTimeIndexInNC)
+    # - missing values are returned as NaN
+    # - if cells (flat indexes on the clone map) is given, only these cells are returned: [ndays, len(cells)]
+    
+    logger.debug('reading a slab of the variable: '+str(varName)+' from the file: '+str(ncFile)+' for the period '+str(startDate)+' to '+str(endDate))
+    
+    f = openDataset(ncFile)
+    
+    # the variable name (automatic detection and PCR-GLOBWB aliases), its fill value, and the hyperslab needed to match the clone map and the resampling factor
+    # - determined only once per file (see getNCDescriptor)
+    descriptor = getNCDescriptor(f, ncFile, varName, LatitudeLongitude, cloneMapFileName, specificFillValue)
+    varName, window, factor = descriptor.varName, descriptor.window, descriptor.factor
+
+    # time indexes of all days (using the time index cache)
+    indices = descriptor.getDateIndices(startDate, endDate, useDoy)
+    
+    # one hyperslab read covering all time indexes (missing values as NaN)
+    inputCells = getNCInputCells(f, varName, cells, cloneMapFileName, window, factor)
+    slab = readNCSlab(f, ncFile, varName, indices, window, descriptor.fillValue, inputCells)
+    
+    # resample to the clone resolution
+    if factor > 1 and cells is None: slab = slab.repeat(factor, axis = 1).repeat(factor, axis = 2)
+    
+    return slab
+
+def getNCDateIndices(f, ncFile, varName, startDate, endDate = None, useDoy = None):
+    # returns the time indexes of all days from startDate to endDate (both included)
+    if isinstance(startDate, str): startDate = datetime.datetime.strptime(str(startDate),'%Y-%m-%d')
+    if isinstance(endDate, str)  : endDate   = datetime.datetime.strptime(str(endDate),'%Y-%m-%d')
+    if endDate == None: endDate = startDate
+    dates   = [startDate + datetime.timedelta(days = i) for i in range((endDate - startDate).days + 1)]
+    return np.array([findTimeIndexInNC(f, ncFile, varName, date, useDoy)[0] for date in dates], dtype = np.int64)
+
+def getNCInputCells(f, varName, cells, cloneMapFileName, window, factor):
+    # flat indexes (on the hyperslab read) of the input cells covering the given clone cells  
+    if cells is None: return None
+    if window == None:
+        windowCols = f.variables[varName].shape[-1]
+    else:
+        windowCols = len(range(*window[1].indices(f.variables[varName].shape[-1])))
+    cloneCols = windowCols
+    if cloneMapFileName != None: cloneCols = int(getCloneGeometry(cloneMapFileName)['cols'])
+    rows, cols = np.divmod(np.asarray(cells, dtype = np.int64), cloneCols)
+    return (rows // factor) * windowCols + cols // factor
+
+def readNCSlab(f, ncFile, varName, indices, window = None, specificFillValue = None, inputCells = None, writable = False):
+    # read the fields of the given time indexes with one hyperslab read; returns a float32 array with missing values as NaN
+    # - if inputCells (flat indexes on the hyperslab) is given, only these cells are returned: [len(indices), len(inputCells)]
+    # - the fields of the files registered for the decoded field store are taken from the store (see readDecodedFields); a single field is then 
+    #   returned as a read-only memory-mapped array, unless writable is True
+    if useDecodedFieldCache(ncFile):
+        slab = readDecodedFields(f, ncFile, varName, indices, window, specificFillValue)
+        if inputCells is not None: slab = slab.reshape(len(indices), -1)[:, inputCells]
+        if writable and not slab.flags.writeable: slab = np.array(slab)
+        return slab
+    return decodeNCSlab(f, ncFile, varName, indices, window, specificFillValue, inputCells)
+
+def decodeNCSlab(f, ncFile, varName, indices, window = None, specificFillValue = None, inputCells = None):
+    # the hyperslab read of readNCSlab (from the netcdf file)
+    blockSta, blockEnd, block = readNCChunkAlignedBlock(f, ncFile, varName, int(indices.min()), int(indices.max()) + 1, window)
+    slab = block[indices - blockSta]
+    if inputCells is not None: slab = slab.reshape(len(indices), -1)[:, inputCells]
+    fillValue = getNCFillValue(f, varName, specificFillValue)
+    slab = np.ma.filled(np.ma.asarray(slab).astype(np.float32), np.nan)
+    slab[slab == np.float32(fillValue)] = np.nan
+    return slab
+
+# decoded field store: the decoded fields (float32, missing values as NaN, the hyperslab of the clone map) of the registered input files are written
+# as .npy files in decoded_field_cache_dir the first time they are read; later reads (of all processes using the same folder) memory-map them
+# - None means no store; the files are registered with registerDecodedFieldFiles (e.g. the daily crop coefficients and the irrigated areas)
+# - the entries are keyed by the file (path, size and modification time), the variable, the time index and the hyperslab (i.e. the clone geometry)
+# - the least recently used entries are removed if the store is larger than decoded_field_cache_max_bytes
+decoded_field_cache_dir       = None
+decoded_field_cache_max_bytes = 32 * 1024**3
+decoded_field_cache_files     = set()
+decoded_field_cache_stats     = {"hits": 0, "misses": 0, "evictions": 0, "bytes": None}
+# file fingerprints (see getFileFingerprint), determined once per file
+decoded_field_fingerprints    = dict()
+
+def registerDecodedFieldFiles(ncFiles):
+    for ncFile in ncFiles: decoded_field_cache_files.add(os.path.abspath(ncFile))
+
+def useDecodedFieldCache(ncFile):
+    return decoded_field_cache_dir != None and os.path.abspath(ncFile) in decoded_field_cache_files
+
+def getDecodedFieldFile(ncFile, varName, idx, window):
+    # file name of a decoded field (idx None: a file without time dimension)
+    ncFile = os.path.abspath(ncFile)
+    if ncFile not in decoded_field_fingerprints: decoded_field_fingerprints[ncFile] = getFileFingerprint(ncFile)
+    windowKey = None
+    if window != None: windowKey = (window[0].start, window[0].stop, window[1].start, window[1].stop)
+    key = hashlib.sha1(repr((ncFile, decoded_field_fingerprints[ncFile], str(varName), idx, windowKey)).encode()).hexdigest()
+    return os.path.join(decoded_field_cache_dir, key[0:2], key + ".npy")
+
+def readDecodedFields(f, ncFile, varName, indices, window = None, specificFillValue = None):
+    # the fields of the given time indexes (indices None: the field of a file without time dimension) as [len(indices), rows, cols]
+    # - a single field is returned as a view of the memory-mapped file (no copy)
+    # - the fields that are not in the store yet are read with one hyperslab read (decodeNCSlab) and written to the store
+    keys   = [None] if indices is None else [int(idx) for idx in indices]
+    files  = [getDecodedFieldFile(ncFile, varName, idx, window) for idx in keys]
+    fields = dict()
+    for idx, fieldFile in zip(keys, files):
+        try:
+            fields[idx] = np.load(fieldFile, mmap_mode = "r")
+            os.utime(fieldFile)
+        except (OSError, ValueError):
+            pass
+    missing = [idx for idx in keys if idx not in fields]
+    decoded_field_cache_stats["hits"]   += len(keys) - len(missing)
+    decoded_field_cache_stats["misses"] += len(missing)
+    if len(missing) > 0:
+        if indices is None:
+            if window == None: window = (slice(None), slice(None))
+            fillValue = getNCFillValue(f, varName, specificFillValue)
+            slab = np.ma.filled(np.ma.asarray(f.variables[varName][window[0], window[1]]).astype(np.float32), np.nan)[None]
+            slab[slab == np.float32(fillValue)] = np.nan
+        else:
+            slab = decodeNCSlab(f, ncFile, varName, np.array(missing, dtype = np.int64), window, specificFillValue)
+        for i, idx in enumerate(missing):
+            fields[idx] = slab[i]
+            writeDecodedField(files[keys.index(idx)], slab[i])
+        evictDecodedFields()
+    if len(keys) == 1: return fields[keys[0]][None]
+    return np.stack([fields[idx] for idx in keys])
+
+def writeDecodedField(fieldFile, field):
+    # write to a temporary file first and rename it (atomic), so that other processes never read an incomplete file
+    try:
+        os.makedirs(os.path.dirname(fieldFile), exist_ok = True)
+        tmpFile = "%s.%i.%i.tmp.npy" % (fieldFile[:-len(".npy")], os.getpid(), threading.get_ident())
+        np.save(tmpFile, np.ascontiguousarray(field, dtype = np.float32))
+        os.replace(tmpFile, fieldFile)
+        if decoded_field_cache_stats["bytes"] != None: decoded_field_cache_stats["bytes"] += os.path.getsize(fieldFile)
+    except OSError:
+        logger.warning("The decoded field cannot be stored in " + str(fieldFile))
+
+def evictDecodedFields(force = False):
+    # remove the least recently used (read or written) entries until the store is smaller than 90% of decoded_field_cache_max_bytes
+    # - the size of the store is determined once (and after every eviction); it is then increased with the written entries of this process
+    if decoded_field_cache_dir == None: return
+    if not force and decoded_field_cache_stats["bytes"] != None and decoded_field_cache_stats["bytes"] <= decoded_field_cache_max_bytes: return
+    entries = []
+    for fieldFile in glob.glob(os.path.join(decoded_field_cache_dir, "*", "*.npy")):
+        if fieldFile.endswith(".tmp.npy"): continue
+        try:
+            stat = os.stat(fieldFile)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, fieldFile))
+    size = sum(entry[1] for entry in entries)
+    if size > decoded_field_cache_max_bytes:
+        for mtime, fieldSize, fieldFile in sorted(entries):
+            if size <= 0.9 * decoded_field_cache_max_bytes: break
+            try:
+                os.remove(fieldFile)
+            except OSError:
+                continue
+            size = size - fieldSize
+            decoded_field_cache_stats["evictions"] += 1
+    decoded_field_cache_stats["bytes"] = size
+
+def getDecodedFieldCacheStats():
+    return dict(decoded_field_cache_stats)
+
+def decodedField2Fill(field, fillValue):
+    # a decoded field with fillValue as missing values (float64, so that they are exactly fillValue)
+    return np.where(np.isnan(field), fillValue, np.asarray(field, dtype = np.float64))
+
+# climatology fields (e.g. the daily crop coefficients used with useDoy = "daily_seasonal"), keyed by file and time index
+climatologycache = collections.OrderedDict()
+# memory budget (bytes) for the climatology cache: the least recently used fields are dropped; None means that the full stack is kept (about 13.6 GB per 366-day file at 5 arcmin)
+climatology_cache_max_bytes = 4 * 1024**3
+# entire climatology stacks (e.g. in the shared memory of the batch runner, see setClimatologyStack), keyed by file; they are not part of the memory budget and never dropped
+climatologystacks = {}
+climatology_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0}
+
+def netcdf2NumpyClimatologySlabClone(ncFile,\
+                                     varName = "automatic",\
+                                     startDate = None,\
+                                     endDate = None,\
+                                     useDoy = "daily_seasonal",\
+                                     cloneMapFileName  = None,\
+                                     LatitudeLongitude = True,\
+                                     specificFillValue = None,\
+                                     coverValue = None,\
+                                     minimumValue = None,\
+                                     cells = None):
+    # as netcdf2NumpySlabClone, but for climatology files: every field (day of year) is read, covered (coverValue) and clamped (minimumValue) only once per run
+    # - the fields are kept in the climatology cache (see climatology_cache_max_bytes)
+    # - if cells (flat indexes on the clone map) is given, only these cells are returned: [ndays, len(cells)]
+    
+    with netcdf_lock:
+        f = openDataset(ncFile)
+    
+        descriptor = getNCDescriptor(f, ncFile, varName, LatitudeLongitude, cloneMapFileName, specificFillValue)
+        varName, window, factor = descriptor.varName, descriptor.window, descriptor.factor
+        indices = descriptor.getDateIndices(startDate, endDate, useDoy)
+        specificFillValue = descriptor.fillValue
+        windowKey = None
+        if window != None: windowKey = (window[0].start, window[0].stop, window[1].start, window[1].stop)
+        keyBase = (ncFile, varName, windowKey, coverValue, minimumValue)
+    
+        # read the fields that are not in the cache yet (with one hyperslab read)
+        stack = climatologystacks.get(keyBase)
+        if stack is not None:
+            missing = np.array([], dtype = np.int64)
+        else:
+            missing = np.array(sorted(set(int(i) for i in indices if keyBase + (int(i),) not in climatologycache)), dtype = np.int64)
+        climatology_cache_stats["hits"]   += len(indices) - len(missing)
+        climatology_cache_stats["misses"] += len(missing)
+        fields = dict()
+        if len(missing) > 0:
+            logger.debug('reading '+str(len(missing))+' climatology fields of the variable: '+str(varName)+' from the file: '+str(ncFile))
+            slab = readNCSlab(f, ncFile, varName, missing, window, specificFillValue, writable = True)
+            if coverValue   != None: slab[np.isnan(slab)] = coverValue
+            if minimumValue != None: np.maximum(slab, np.float32(minimumValue), out = slab)
+            for i, idx in enumerate(missing): fields[int(idx)] = slab[i]
+        for idx in indices:
+            key = keyBase + (int(idx),)
+            if stack is not None:
+                fields[int(idx)] = stack[int(idx)]
+            elif key in climatologycache:
+                climatologycache.move_to_end(key)
+                fields[int(idx)] = climatologycache[key]
+        # - the input cells are found while the file is certainly open (it may be closed by the pool after the lock is released)
+        if cells is not None: inputCells = getNCInputCells(f, varName, cells, cloneMapFileName, window, factor)
+    
+    # stack (at the clone resolution or for the given cells only)
+    if cells is None:
+        result = np.stack([fields[int(idx)] for idx in indices])
+        if factor > 1: result = result.repeat(factor, axis = 1).repeat(factor, axis = 2)
+    else:
+        result = np.stack([fields[int(idx)].ravel()[inputCells] for idx in indices])
+
+    # store the new fields and drop the least recently used ones if needed (while holding the lock, as the fields may also be read by a background thread, see inputPrefetcher.py)
+    with netcdf_lock:
+        for idx, field in fields.items():
+            key = keyBase + (idx,)
+            if stack is not None or key in climatologycache: continue
+            field = field.copy()
+            climatologycache[key] = field
+            climatology_cache_stats["bytes"] += field.nbytes
+        while climatology_cache_max_bytes != None and climatology_cache_stats["bytes"] > climatology_cache_max_bytes and len(climatologycache) > 0:
+            key, field = climatologycache.popitem(last = False)
+            climatology_cache_stats["bytes"] -= field.nbytes
+            climatology_cache_stats["evictions"] += 1
+    
+    return result
+
+def readClimatologyStack(ncFile,\
+                         varName = "automatic",\
+                         cloneMapFileName  = None,\
+                         LatitudeLongitude = True,\
+                         specificFillValue = None,\
+                         coverValue = None,\
+                         minimumValue = None,\
+                         allocate = None,\
+                         blockSize = 31):
+    # read all fields of a climatology file (covered and clamped as in netcdf2NumpyClimatologySlabClone) 
+    # - returns the climatology cache key and the stack [ntime, rows, cols] (at the resolution of the netcdf file)
+    # - allocate(shape, dtype) can be used to provide the array (e.g. in shared memory); the fields are read in blocks of blockSize time steps 
+    with netcdf_lock:
+        f = openDataset(ncFile)
+    
+        varName = resolveNCVariableName(f, ncFile, varName, LatitudeLongitude)
+        window, factor = getNCCropWindow(f, cloneMapFileName)
+        windowKey = None
+        if window != None: windowKey = (window[0].start, window[0].stop, window[1].start, window[1].stop)
+        keyBase = (ncFile, varName, windowKey, coverValue, minimumValue)
+    
+        nrOfTimeSteps = len(f.variables['time'])
+        for sta in range(0, nrOfTimeSteps, blockSize):
+            slab = readNCSlab(f, ncFile, varName, np.arange(sta, min(sta + blockSize, nrOfTimeSteps), dtype = np.int64), window, specificFillValue, writable = True)
+            if coverValue   != None: slab[np.isnan(slab)] = coverValue
+            if minimumValue != None: np.maximum(slab, np.float32(minimumValue), out = slab)
+            if sta == 0:
+                shape = (nrOfTimeSteps,) + slab.shape[1:]
+                stack = np.empty(shape, dtype = np.float32) if allocate == None else allocate(shape, np.float32)
+            stack[sta:sta + len(slab)] = slab
+        for key in [key for key in slabcache if key[0] == ncFile]: slabcache.pop(key, None)
+    
+    return keyBase, stack
+
+def setClimatologyStack(keyBase, stack):
+    # use all fields of a stack (see readClimatologyStack) instead of the climatology cache, without copying them
+    climatologystacks[keyBase] = stack
+    for key in [key for key in climatologycache if key[:-1] == keyBase]:
+        climatology_cache_stats["bytes"] -= climatologycache.pop(key).nbytes
+
+def readClimatologyMonthlyMeans(ncFile,\
+                                varName = "automatic",\
+                                cloneMapFileName  = None,\
+                                LatitudeLongitude = True,\
+                                specificFillValue = None,\
+                                coverValue = None,\
+                                minimumValue = None):
+    # monthly means of the daily fields of a climatology file (useDoy = "daily_seasonal"), covered (coverValue) and clamped (minimumValue) before averaging
+    # - returns a float32 array [13, rows, cols] at the clone resolution: the months January to December of a non-leap year and (index 12) February of a leap year
+    # - the shared stacks (see setClimatologyStack) and the fields that are in the climatology cache are used; the others are read month by month without being cached
+    months = [(2001, month) for month in range(1, 13)] + [(2004, 2)]
+    means = None
+    for i, (year, month) in enumerate(months):
+        startDate = datetime.datetime(year, month, 1)
+        endDate   = datetime.datetime(year + month // 12, month % 12 + 1, 1) - datetime.timedelta(days = 1)
+        with netcdf_lock:
+            f = openDataset(ncFile)
+            varName = resolveNCVariableName(f, ncFile, varName, LatitudeLongitude)
+            indices = getNCDateIndices(f, ncFile, varName, startDate, endDate, "daily_seasonal")
+            window, factor = getNCCropWindow(f, cloneMapFileName)
+            windowKey = None
+            if window != None: windowKey = (window[0].start, window[0].stop, window[1].start, window[1].stop)
+            keyBase = (ncFile, varName, windowKey, coverValue, minimumValue)
+            if keyBase in climatologystacks:
+                slab = climatologystacks[keyBase][indices]
+            elif all(keyBase + (int(idx),) in climatologycache for idx in indices):
+                slab = np.stack([climatologycache[keyBase + (int(idx),)] for idx in indices])
+            else:
+                slab = readNCSlab(f, ncFile, varName, indices, window, specificFillValue, writable = True)
+                if coverValue   != None: slab[np.isnan(slab)] = coverValue
+                if minimumValue != None: np.maximum(slab, np.float32(minimumValue), out = slab)
+        mean = slab.mean(axis = 0, dtype = np.float64).astype(np.float32)
+        del slab
+        if factor > 1: mean = mean.repeat(factor, axis = 0).repeat(factor, axis = 1)
+        if means is None: means = np.empty((len(months),) + mean.shape, dtype = np.float32)
+        means[i] = mean
+    return means
+
+def getClimatologyMonthIndex(year, month):
+    # index (in the array of readClimatologyMonthlyMeans) of the month of a year
+    if month == 2 and calendar.isleap(year): return 12
+    return month - 1
+
+def clearClimatologyCache():
+    climatologycache.clear()
+    climatologystacks.clear()
+    climatology_cache_stats["bytes"] = 0
+
+def getClimatologyCacheStats():
+    return dict(climatology_cache_stats)
+
+def readNCChunkAlignedBlock(f, ncFile, varName, idxSta, idxEnd, window = None):
+    # read the time indexes idxSta to idxEnd (excluded) with one hyperslab read; the read is extended to the chunk boundaries of the time dimension
+    # - the extended part is kept (slabcache) so that the next read (e.g. the next month) does not decompress the same chunks again
+    windowKey = None
+    if window != None: windowKey = (window[0].start, window[0].stop, window[1].start, window[1].stop)
+    key = (ncFile, varName, windowKey)
+    if key in slabcache:
+        blockSta, blockEnd, block = slabcache[key]
+        if blockSta <= idxSta and idxEnd <= blockEnd: return blockSta, blockEnd, block
+    
+    var = f.variables[varName]
+    timeChunk = 1
+    chunking = var.chunking()
+    if isinstance(chunking, list): timeChunk = max(1, int(chunking[0]))
+    alignedSta = (idxSta // timeChunk) * timeChunk
+    alignedEnd = min(len(f.variables['time']), -(-idxEnd // timeChunk) * timeChunk)
+    
+    # size of one field
+    if window == None:
+        fieldSize = var.shape[-2] * var.shape[-1]
+    else:
+        fieldSize = len(range(*window[0].indices(var.shape[-2]))) * len(range(*window[1].indices(var.shape[-1])))
+    if (alignedEnd - alignedSta) * fieldSize * var.dtype.itemsize > slab_cache_max_bytes: alignedSta, alignedEnd = idxSta, idxEnd
+    
+    block = readNCField(f, ncFile, varName, slice(alignedSta, alignedEnd), window)
+    
+    # keep the block only if it contains time steps that have not been requested yet
+    slabcache.pop(key, None)
+    if alignedEnd > idxEnd: slabcache[key] = (alignedSta, alignedEnd, block)
+    
+    return alignedSta, alignedEnd, block
+
 def netcdf2PCRobjCloneBeforeRensCorrection(
                        ncFile,varName,dateInput,\
                        useDoy = None,
@@ -1588,26 +2292,17 @@ def writePCRmapToDir(v,outFileName,outDir):
     logger.debug('Writing a pcraster map to : '+str(fullFileName))
     pcr.report(v,fullFileName)
 
-def readPCRmapClone(v, cloneMapFileName, tmpDir, absolutePath = None, isLddMap = False, cover = None, isNomMap = False):
-    
-    iter_try = 0
-    while iter_try < max_num_of_tries:
-        try:     
-            return singleTryReadPCRmapClone(v, cloneMapFileName, tmpDir, absolutePath, isLddMap, cover, isNomMap)
-            iter_try = max_num_of_tries + 100
-        except:     
-            iter_try = iter_try + 1
-            logger.warning("Re-try to read file/value: " + str(v))
+def readPCRmapClone(v, cloneMapFileName, tmpDir, absolutePath = None, isLddMap = False, cover = None, isNomMap = False, resampleMethod = None):
     
-    if iter_try >= max_num_of_tries:
-        logger.error("CANNOT READ file: " + str(v))
-        return singleTryReadPCRmapClone(v, cloneMapFileName, tmpDir, absolutePath, isLddMap, cover, isNomMap)
+    # read with retries (see RetryPolicy)
+    return retry_policy.call(v, singleTryReadPCRmapClone, v, cloneMapFileName, tmpDir, absolutePath, isLddMap, cover, isNomMap, resampleMethod)
 
     
-def singleTryReadPCRmapClone(v, cloneMapFileName, tmpDir, absolutePath = None, isLddMap = False, cover = None, isNomMap = False):
+def singleTryReadPCRmapClone(v, cloneMapFileName, tmpDir, absolutePath = None, isLddMap = False, cover = None, isNomMap = False, resampleMethod = None):
     # v: inputMapFileName or floating values
     # cloneMapFileName: If the inputMap and cloneMap have different clones,
-    #                   resampling will be done.   
+    #                   resampling will be done (in-process, see readCSFResampled; resampleMethod: see resample_methods).   
+    # - tmpDir is not used anymore (it was used by gdalwarpPCR)
     logger.debug('read file/value: '+str(v))
     
     if v == "None":
@@ -1625,13 +2320,13 @@ def singleTryReadPCRmapClone(v, cloneMapFileName, tmpDir, absolutePath = None, i
         
             logger.debug('read netcdf file: '+str(v))
             
-            try:
+            if not isNCVariableWithTime(v):
                 # read netcdf file without time
                 PCRmap = netcdf2PCRobjCloneWithoutTime(ncFile = v,\
                                                        varName = "automatic",\
                                                        cloneMapFileName = cloneMapFileName)
-            except:
-                # read netcdf file with time
+            else:
+                # read netcdf file with time (the first time step)
                 PCRmap = netcdf2PCRobjClone(ncFile = v,\
                                             varName = "automatic",\
                                             dateInput = None,\
@@ -1643,16 +2338,21 @@ def singleTryReadPCRmapClone(v, cloneMapFileName, tmpDir, absolutePath = None, i
             # pcraster format is assumed 
             
             sameClone = isSameClone(v,cloneMapFileName)
+            window = None
+            if sameClone == False: window = getScalarMapWindow(v, cloneMapFileName)
             if sameClone == True:
                 PCRmap = pcr.readmap(v)
+            elif window != None:
+                # the clone is a window of the (scalar) map, e.g. a regional clone: only the window is read (without resampling)
+                field  = readCSFWindow(v, *window)
+                PCRmap = pcr.numpy2pcr(pcr.Scalar, np.where(np.isnan(field), MV, field), MV)
             else:
-                # resample using GDAL:
-                output = tmpDir+'temp.map'
-                warp = gdalwarpPCR(v,output,cloneMapFileName,tmpDir,isLddMap,isNomMap)
-                # read from temporary file and delete the temporary file:
-                PCRmap = pcr.readmap(output)
-                if os.path.isdir(tmpDir): shutil.rmtree(tmpDir)
-                os.makedirs(tmpDir)
+                # resample in-process (the resampled field is cached on disk, see readCSFResampled)
+                field = readCSFResampled(v, cloneMapFileName, resampleMethod, isLddMap or isNomMap)
+                if isLddMap or isNomMap:
+                    PCRmap = pcr.numpy2pcr(pcr.Nominal, np.where(np.isnan(field), -2147483648, field).astype(np.int32), -2147483648)
+                else:
+                    PCRmap = pcr.numpy2pcr(pcr.Scalar, np.where(np.isnan(field), MV, field), MV)
     else:
         PCRmap = pcr.spatial(pcr.scalar(float(v)))
     
@@ -1676,6 +2376,105 @@ def singleTryReadPCRmapClone(v, cloneMapFileName, tmpDir, absolutePath = None, i
     
     return PCRmap    
 
+def getScalarMapWindow(mapFileName, cloneMapFileName):
+    # the window of the clone in a scalar PCRaster map (see getCloneWindow), or None
+    try:
+        if readCSFHeader(mapFileName)['value_scale'] != 0xEB: return None
+        return getCloneWindow(mapFileName, cloneMapFileName)
+    except (IOError, OSError, struct.error, KeyError):
+        return None
+
+# in-process resampling of PCRaster maps to a clone map (replacing gdalwarpPCR)
+# - nearest: the source cell at the center of the clone cell (the default, as gdalwarp in gdalwarpPCR)
+# - average: the mean of the source cells weighted by their overlap with the clone cell, ignoring missing values (scalar maps only)
+# - mode: the most frequent value of the source cells with their centers in the clone cell (or the nearest cell if there is none), e.g. for ldd and nominal maps;
+#   the smallest value is taken if there are more values with the same frequency
+resample_methods = ["nearest", "average", "mode"]
+# maximum size (bytes) of the source values gathered for a band of clone rows
+resample_band_bytes = 256 * 1024**2
+
+def getResampleAxis(offset, ratio, targetCount, sourceCount, method):
+    # the source cells (index, weight) of the clone cells along one axis: arrays [targetCount, k]; the indexes of the cells that are not used are -1
+    # - offset: the position of the first clone cell (in source cells, from the first source cell); ratio: clone cell size / source cell size
+    sta = np.round(offset + np.arange(targetCount) * ratio, 9)
+    end = np.round(sta + ratio, 9)
+    nearest = np.floor(np.round((sta + end) / 2.0, 9)).astype(np.int64)[:, None]
+    if method == "nearest":
+        index, weight = nearest, np.ones(nearest.shape)
+    elif method == "average":
+        index  = np.floor(sta).astype(np.int64)[:, None] + np.arange(int(math.ceil(ratio)) + 1)[None, :]
+        weight = np.minimum(end[:, None], index + 1.0) - np.maximum(sta[:, None], index)
+    else:
+        # - the cells with their centers in [sta, end)
+        first  = np.ceil(sta - 0.5).astype(np.int64)
+        count  = np.ceil(end - 0.5).astype(np.int64) - first
+        index  = first[:, None] + np.arange(max(1, int(count.max())))[None, :]
+        weight = (np.arange(index.shape[1])[None, :] < count[:, None]).astype(np.float64)
+        index[count == 0, 0], weight[count == 0, 0] = nearest[count == 0, 0], 1.0
+    valid = (weight > 0.0) & (index >= 0) & (index < sourceCount)
+    return np.where(valid, index, -1), np.where(valid, weight, 0.0)
+
+def resampleField(readRows, sourceGeometry, targetGeometry, method = "nearest"):
+    # resample a field to a clone (targetGeometry); returns a float64 array with NaN as missing values
+    # - readRows(rowSta, rowEnd) returns the source rows rowSta to rowEnd (excluded) as a float64 array with NaN as missing values, so that 
+    #   only the source rows needed for a band of clone rows are in memory
+    if method not in resample_methods: raise Exception("Unknown resampling method: " + str(method) + " (see resample_methods).")
+    ratio = targetGeometry.cellsize / sourceGeometry.cellsize
+    rowIndex, rowWeight = getResampleAxis((sourceGeometry.yUL - targetGeometry.yUL) / sourceGeometry.cellsize, ratio, targetGeometry.rows, sourceGeometry.rows, method)
+    colIndex, colWeight = getResampleAxis((targetGeometry.xUL - sourceGeometry.xUL) / sourceGeometry.cellsize, ratio, targetGeometry.cols, sourceGeometry.cols, method)
+    result = np.full((targetGeometry.rows, targetGeometry.cols), np.nan)
+    usedCols = colIndex[colIndex >= 0]
+    if len(usedCols) == 0: return result
+    colSta, colEnd = int(usedCols.min()), int(usedCols.max()) + 1
+    k = rowIndex.shape[1] * colIndex.shape[1]
+    bandRows = max(1, int(resample_band_bytes // (8 * k * targetGeometry.cols)))
+    for bandSta in range(0, targetGeometry.rows, bandRows):
+        bandEnd = min(targetGeometry.rows, bandSta + bandRows)
+        usedRows = rowIndex[bandSta:bandEnd][rowIndex[bandSta:bandEnd] >= 0]
+        if len(usedRows) == 0: continue
+        rowSta, rowEnd = int(usedRows.min()), int(usedRows.max()) + 1
+        source = readRows(rowSta, rowEnd)[:, colSta:colEnd]
+        # - the source values (and weights) of the clone cells: [k, band rows, cols]
+        values  = np.full((k, bandEnd - bandSta, targetGeometry.cols), np.nan)
+        weights = np.zeros(values.shape)
+        n = 0
+        for a in range(rowIndex.shape[1]):
+            rows = rowIndex[bandSta:bandEnd, a]
+            for b in range(colIndex.shape[1]):
+                cols  = colIndex[:, b]
+                valid = (rows >= 0)[:, None] & (cols >= 0)[None, :]
+                values[n]  = np.where(valid, source[np.maximum(rows - rowSta, 0)][:, np.maximum(cols - colSta, 0)], np.nan)
+                weights[n] = np.where(valid & ~np.isnan(values[n]), rowWeight[bandSta:bandEnd, a][:, None] * colWeight[:, b][None, :], 0.0)
+                n += 1
+        if method == "nearest":
+            result[bandSta:bandEnd] = values[0]
+        elif method == "average":
+            total = weights.sum(axis = 0)
+            with np.errstate(invalid = "ignore", divide = "ignore"):
+                result[bandSta:bandEnd] = np.where(total > 0.0, np.nansum(values * weights, axis = 0) / total, np.nan)
+        else:
+            # - the longest run of equal values in the sorted values (missing values are sorted last and are not counted)
+            values[weights == 0.0] = np.nan
+            values.sort(axis = 0)
+            run = np.zeros(values.shape)
+            run[0] = ~np.isnan(values[0])
+            for i in range(1, k): run[i] = np.where(values[i] == values[i - 1], run[i - 1] + 1.0, ~np.isnan(values[i]))
+            best = np.argmax(run, axis = 0)
+            result[bandSta:bandEnd] = np.where(run.max(axis = 0) > 0.0, np.take_along_axis(values, best[None], axis = 0)[0], np.nan)
+    return result
+
+def readCSFResampled(mapFileName, cloneMapFileName, method = None, isNominal = False):
+    # the values of a PCRaster (CSF) map resampled to a clone map (see resampleField), read and resampled in-process (no temporary files and no external processes)
+    # - the result is cached on disk (see getCachedStaticField), keyed by the content of the map, the clone and the method
+    if method == None: method = "nearest"
+    if isNominal and method == "average": raise Exception("The resampling method average cannot be used for ldd and nominal maps.")
+    sourceGeometry = getCloneGeometry(mapFileName)
+    targetGeometry = getCloneGeometry(cloneMapFileName)
+    def calculate():
+        logger.debug('resampling the map ' + str(mapFileName) + ' (' + method + ') to the clone ' + str(tuple(targetGeometry)))
+        return resampleField(lambda rowSta, rowEnd: readCSFWindow(mapFileName, rowSta, rowEnd), sourceGeometry, targetGeometry, method)
+    return getCachedStaticField("resampled", [mapFileName], {"clone": tuple(targetGeometry), "method": method, "nominal": bool(isNominal)}, calculate)
+
 def readPCRmapCloneOLD(v,cloneMapFileName,tmpDir,absolutePath=None,isLddMap=False,cover=None,isNomMap=False):
     # v: inputMapFileName or floating values
     # cloneMapFileName: If the inputMap and cloneMap have different clones,
@@ -1722,28 +2521,11 @@ def readPCRmap(v):
     return PCRmap    
 
 def isSameClone(inputMapFileName,cloneMapFileName):    
-    # reading inputMap:
-    attributeInput = getMapAttributesALL(inputMapFileName)
-    cellsizeInput = attributeInput['cellsize']
-    rowsInput = attributeInput['rows']
-    colsInput = attributeInput['cols']
-    xULInput = attributeInput['xUL']
-    yULInput = attributeInput['yUL']
-    # reading cloneMap:
-    attributeClone = getMapAttributesALL(cloneMapFileName)
-    cellsizeClone = attributeClone['cellsize']
-    rowsClone = attributeClone['rows']
-    colsClone = attributeClone['cols']
-    xULClone = attributeClone['xUL']
-    yULClone = attributeClone['yUL']
+    # reading inputMap and cloneMap attributes (from the clone geometry registry):
+    attributeInput = getCloneGeometry(inputMapFileName)
+    attributeClone = getCloneGeometry(cloneMapFileName)
     # check whether both maps have the same attributes? 
-    sameClone = True
-    if cellsizeClone != cellsizeInput: sameClone = False
-    if rowsClone != rowsInput: sameClone = False
-    if colsClone != colsInput: sameClone = False
-    if xULClone != xULInput: sameClone = False
-    if yULClone != yULInput: sameClone = False
-    return sameClone
+    return attributeInput == attributeClone
 
 def gdalwarpPCR(input,output,cloneOut,tmpDir,isLddMap=False,isNominalMap=False):
     # 19 Mar 2013 created by Edwin H. Sutanudjaja
@@ -1760,7 +2542,7 @@ def gdalwarpPCR(input,output,cloneOut,tmpDir,isLddMap=False,isNominalMap=False):
     cOut,err = subprocess.Popen(co, stdout=subprocess.PIPE,stderr=open(os.devnull),shell=True).communicate()
     # 
     # get the attributes of PCRaster map:
-    cloneAtt = getMapAttributesALL(cloneOut)
+    cloneAtt = getCloneGeometry(cloneOut)
     xmin = cloneAtt['xUL']
     ymin = cloneAtt['yUL'] - cloneAtt['rows']*cloneAtt['cellsize']
     xmax = cloneAtt['xUL'] + cloneAtt['cols']*cloneAtt['cellsize']
@@ -1884,48 +2666,292 @@ def isLastDayOfMonth(date):
     else:
         return False
 
-def getMapAttributesALL(cloneMap,arcDegree=True):
+# clone geometry registry: the header of every clone (or input) map is read only once per process
+clone_geometry_cache = dict()
+clone_geometry_stats = {"hits": 0, "misses": 0, "forks": 0}
+
+class CloneGeometry(collections.namedtuple("CloneGeometry", ["cellsize", "rows", "cols", "xUL", "yUL"])):
+    # immutable clone attributes; the old dictionary-style access, e.g. attribute['cellsize'], is still supported
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, str): return getattr(self, key)
+        return tuple.__getitem__(self, key)
+
+    def keys(self):
+        return self._fields
+
+def readCSFHeader(mapFileName):
+    # read the main and raster headers of a PCRaster (CSF) map file in-process (without calling 'mapattr')
+    with open(mapFileName, "rb") as csf_file:
+        header = csf_file.read(256)
+    if len(header) < 132 or not header.startswith(b"RUU CROSS SYSTEM MAP FORMAT"):
+        raise IOError("The file " + str(mapFileName) + " is not a PCRaster (CSF) map.")
+    # byte order of the file (the value 1 is stored in the file's byte order)
+    endian = "<"
+    if struct.unpack("<I", header[46:50])[0] != 1: endian = ">"
+    value_scale, cell_repr = struct.unpack(endian + "HH", header[64:68])
+    xUL, yUL           = struct.unpack(endian + "dd", header[84:100])
+    rows, cols         = struct.unpack(endian + "II", header[100:108])
+    cellsize_x, cellsize_y, angle = struct.unpack(endian + "ddd", header[108:132])
+    return {'cellsize'   : cellsize_x,\
+            'rows'       : rows,\
+            'cols'       : cols,\
+            'xUL'        : xUL,\
+            'yUL'        : yUL,\
+            'value_scale': value_scale,\
+            'cell_repr'  : cell_repr,\
+            'endian'     : endian}
+
+# numpy types and missing values of the CSF cell representations (the missing value of REAL4 and REAL8 is NaN)
+csf_cell_types = {0x00: ("u1", 255), 0x04: ("i1", -128), 0x11: ("u2", 65535), 0x15: ("i2", -32768), 0x22: ("u4", 4294967295), 0x26: ("i4", -2147483648),\
+                  0x5A: ("f4", None), 0xDB: ("f8", None)}
+
+def readCSFWindow(mapFileName, rowSta = 0, rowEnd = None, colSta = 0, colEnd = None):
+    # read the cells (rowSta to rowEnd and colSta to colEnd, excluded) of a PCRaster (CSF) map in-process; only the rows of the window are read
+    # - returns a float64 array with NaN as missing values
+    header = readCSFHeader(mapFileName)
+    dtype, missingValue = csf_cell_types[header['cell_repr']]
+    dtype = np.dtype(header['endian'] + dtype)
+    if rowEnd == None: rowEnd = header['rows']
+    if colEnd == None: colEnd = header['cols']
+    with open(mapFileName, "rb") as csf_file:
+        csf_file.seek(256 + int(rowSta) * header['cols'] * dtype.itemsize)
+        data = np.frombuffer(csf_file.read((int(rowEnd) - int(rowSta)) * header['cols'] * dtype.itemsize), dtype = dtype)
+    data = data.reshape(int(rowEnd) - int(rowSta), header['cols'])[:, int(colSta):int(colEnd)]
+    field = data.astype(np.float64)
+    if missingValue != None: field[data == missingValue] = np.nan
+    return field
+
+def writeCSFWindow(mapFileName, outputFileName, rowSta, rowEnd, colSta, colEnd):
+    # write the window (rowSta to rowEnd and colSta to colEnd, excluded) of a PCRaster (CSF) map as a new map (e.g. a regional clone map)
+    # - the file is not written again if it has the same content already (so that its fingerprint does not change)
+    header = readCSFHeader(mapFileName)
+    dtype = np.dtype(header['endian'] + csf_cell_types[header['cell_repr']][0])
+    with open(mapFileName, "rb") as csf_file:
+        mainHeader = bytearray(csf_file.read(256))
+        csf_file.seek(256 + int(rowSta) * header['cols'] * dtype.itemsize)
+        data = np.frombuffer(csf_file.read((int(rowEnd) - int(rowSta)) * header['cols'] * dtype.itemsize), dtype = dtype)
+    data = data.reshape(int(rowEnd) - int(rowSta), header['cols'])[:, int(colSta):int(colEnd)]
+    # - the raster header: minimum and maximum values, upper left corner and size (the minimum and maximum are kept for the non-float maps)
+    if header['cell_repr'] in [0x5A, 0xDB] and np.any(~np.isnan(data)):
+        # - the minimum and maximum are stored in 8 byte fields, in the cell representation of the map
+        valueFormat = header['endian'] + ("f" if header['cell_repr'] == 0x5A else "d")
+        valueSize   = struct.calcsize(valueFormat)
+        mainHeader[68:68 + valueSize] = struct.pack(valueFormat, float(np.nanmin(data)))
+        mainHeader[76:76 + valueSize] = struct.pack(valueFormat, float(np.nanmax(data)))
+    mainHeader[84:100]  = struct.pack(header['endian'] + "dd", header['xUL'] + int(colSta) * header['cellsize'], header['yUL'] - int(rowSta) * header['cellsize'])
+    mainHeader[100:108] = struct.pack(header['endian'] + "II", int(rowEnd) - int(rowSta), int(colEnd) - int(colSta))
+    content = bytes(mainHeader) + np.ascontiguousarray(data).tobytes()
+    if os.path.exists(outputFileName):
+        with open(outputFileName, "rb") as csf_file:
+            if csf_file.read() == content: return
+    with open(outputFileName + ".tmp", "wb") as csf_file: csf_file.write(content)
+    os.replace(outputFileName + ".tmp", outputFileName)
+    clone_geometry_cache.pop((os.path.abspath(str(outputFileName)), True), None)
+    clone_geometry_cache.pop((os.path.abspath(str(outputFileName)), False), None)
+
+def getCloneWindow(mapFileName, cloneMap):
+    # the window (rowSta, rowEnd, colSta, colEnd) of a clone map in a map with the same cell size, or None if the clone is not a window of the map (e.g. different cell sizes)
+    attributeMap   = getCloneGeometry(mapFileName)
+    attributeClone = getCloneGeometry(cloneMap)
+    if attributeMap.cellsize != attributeClone.cellsize: return None
+    colSta = (attributeClone.xUL - attributeMap.xUL) / attributeMap.cellsize
+    rowSta = (attributeMap.yUL - attributeClone.yUL) / attributeMap.cellsize
+    if abs(colSta - round(colSta)) > 1e-6 or abs(rowSta - round(rowSta)) > 1e-6: return None
+    colSta, rowSta = int(round(colSta)), int(round(rowSta))
+    if colSta < 0 or rowSta < 0 or colSta + attributeClone.cols > attributeMap.cols or rowSta + attributeClone.rows > attributeMap.rows: return None
+    return rowSta, rowSta + attributeClone.rows, colSta, colSta + attributeClone.cols
+
+def getCloneGeometry(cloneMap, arcDegree = True):
+    # returns the (cached) CloneGeometry object of a clone map 
+    # - an already known CloneGeometry object is returned as it is
+    if isinstance(cloneMap, CloneGeometry): return cloneMap
+    key = (os.path.abspath(str(cloneMap)), arcDegree)
+    if key in clone_geometry_cache:
+        clone_geometry_stats["hits"] += 1
+        return clone_geometry_cache[key]
+    clone_geometry_stats["misses"] += 1
+    try:
+        attributes = readCSFHeader(cloneMap)
+    except (IOError, OSError, struct.error):
+        # not a CSF map (or not readable): use the 'mapattr' command as before
+        clone_geometry_stats["forks"] += 1
+        logger.debug("Using mapattr to get the attributes of " + str(cloneMap))
+        attributes = getMapAttributesUsingMapattr(cloneMap)
+    cellsize = float(attributes['cellsize'])
+    if arcDegree == True: cellsize = round(cellsize * 360000.)/360000.
+    geometry = CloneGeometry(cellsize = float(cellsize),\
+                             rows     = int(attributes['rows']),\
+                             cols     = int(attributes['cols']),\
+                             xUL      = float(attributes['xUL']),\
+                             yUL      = float(attributes['yUL']))
+    clone_geometry_cache[key] = geometry
+    return geometry
+
+def getTileGeometry(cloneMap, rowSta, rowEnd):
+    # the CloneGeometry of a band of rows (rowSta to rowEnd, excluded) of a clone map; it can be used as the clone of the numpy readers (e.g. netcdf2NumpySlabClone), 
+    # which then read the hyperslab of these rows only
+    geometry = getCloneGeometry(cloneMap)
+    return CloneGeometry(cellsize = geometry.cellsize,\
+                         rows     = int(rowEnd) - int(rowSta),\
+                         cols     = geometry.cols,\
+                         xUL      = geometry.xUL,\
+                         yUL      = geometry.yUL - int(rowSta) * geometry.cellsize)
+
+def clearCloneGeometryCache():
+    clone_geometry_cache.clear()
+    for k in clone_geometry_stats: clone_geometry_stats[k] = 0
+
+def getCloneGeometryStats():
+    # hits, misses and the number of 'mapattr' processes spawned so far
+    return dict(clone_geometry_stats)
+
+# on-disk cache of derived static fields (e.g. the gap-filled irrigation efficiency); None means no disk cache  
+static_field_cache_dir = None
+# maximum time (seconds) to wait for another process that is calculating the same static field
+static_field_cache_wait = 3600.
+# age (seconds, of the modification time) after which the lock of a calculation is considered stale (e.g. left by a killed job, see isStaleStaticFieldLock)
+static_field_cache_lock_max_age = 3 * 3600.
+# fingerprint of the source files in the key of a static field (see getFileFingerprint): "mtime" (path, size and modification time) or "hash" (content)
+static_field_key_mode = "mtime"
+# content hashes of the files (see getFileFingerprint), keyed by path, size and modification time, so that a file is hashed at most once per process
+file_hash_cache = {}
+
+def claimStaticFieldLock(lockFile):
+    # create the lock file (only if it does not exist) with the pid and host of this process; returns whether the lock is claimed
+    try:
+        fd = os.open(lockFile, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except OSError:
+        return False
+    with os.fdopen(fd, "w") as f: f.write("%i %s\n" % (os.getpid(), socket.gethostname()))
+    return True
+
+def isStaleStaticFieldLock(lockFile):
+    # a lock is stale if its process is dead (on this host) or if it is older than static_field_cache_lock_max_age
+    try:
+        age = time.time() - os.stat(lockFile).st_mtime
+        with open(lockFile) as f: owner = f.read().split()
+    except OSError:
+        return False
+    if age > static_field_cache_lock_max_age: return True
+    if len(owner) == 2 and owner[1] == socket.gethostname():
+        try:
+            os.kill(int(owner[0]), 0)
+        except ProcessLookupError:
+            return True
+        except (OSError, ValueError):
+            pass
+    return False
+
+def removeStaticFieldLock(lockFile, reason):
+    try:
+        os.remove(lockFile)
+        logger.warning("The lock " + str(lockFile) + " is removed (" + reason + ").")
+    except OSError:
+        pass
+
+def getStaticFieldKey(name, sourceFiles, parameters, mode = None):
+    # sha1 of the name, the fingerprints of the source files (see static_field_key_mode) and the parameters 
+    if mode == None: mode = static_field_key_mode
+    key = hashlib.sha1(str(name).encode())
+    for sourceFile in sourceFiles:
+        if mode == "mtime": key.update(os.path.abspath(sourceFile).encode())
+        key.update(str(getFileFingerprint(sourceFile, mode)).encode())
+    key.update(repr(sorted(parameters.items())).encode())
+    return key.hexdigest()
+
+def getFileFingerprint(fileName, mode = "mtime"):
+    # fingerprint of a file: its size and modification time ("mtime") or the sha1 of its content ("hash"); None if the file does not exist
+    if not os.path.exists(fileName): return None
+    stat = os.stat(fileName)
+    if mode == "hash":
+        cacheKey = (os.path.abspath(fileName), stat.st_size, stat.st_mtime_ns)
+        if cacheKey not in file_hash_cache:
+            key = hashlib.sha1()
+            with open(fileName, "rb") as f:
+                for block in iter(lambda: f.read(16 * 1024**2), b""): key.update(block)
+            file_hash_cache[cacheKey] = key.hexdigest()
+        return file_hash_cache[cacheKey]
+    return "%i:%i" % (stat.st_size, stat.st_mtime_ns)
+
+def getCachedStaticField(name, sourceFiles, parameters, calculate, cacheDir = None):
+    # returns the numpy field calculated by calculate(); the field is stored (as a .npy file keyed by the fingerprints of the source files and the parameters, see getStaticFieldKey)  
+    # in cacheDir so that it is calculated only once for all runs using the same cacheDir (e.g. the concurrent scenario runs)
+    if cacheDir == None: cacheDir = static_field_cache_dir
+    if cacheDir == None: return calculate()
+    
+    key = getStaticFieldKey(name, sourceFiles, parameters)
+    cacheFile = os.path.join(cacheDir, "%s_%s.npy" % (name, key))
+    lockFile  = cacheFile + ".lock"
+    
+    # wait if another process is calculating the same field
+    # - a stale lock (e.g. of a killed job) is removed, and so is a lock that is still there after static_field_cache_wait (it is not left for the next run)
+    waited = 0.0
+    while os.path.exists(lockFile) and not os.path.exists(cacheFile):
+        if isStaleStaticFieldLock(lockFile):
+            removeStaticFieldLock(lockFile, "stale")
+            break
+        if waited >= static_field_cache_wait:
+            removeStaticFieldLock(lockFile, "waited " + str(waited) + " s")
+            break
+        time.sleep(5.0)
+        waited = waited + 5.0
+    
+    if os.path.exists(cacheFile):
+        try:
+            field = np.load(cacheFile)
+            logger.info("Using the cached static field " + str(cacheFile))
+            return field
+        except:
+            logger.warning("The cached static field " + str(cacheFile) + " cannot be read. It will be recalculated.")
+    
+    # claim the calculation (if no other process has done it)
+    locked = False
+    try:
+        os.makedirs(cacheDir, exist_ok = True)
+        locked = claimStaticFieldLock(lockFile)
+    except OSError:
+        pass
+    
+    field = calculate()
+    
+    # write to a temporary file first and rename it (atomic), so that other processes never read an incomplete file
+    try:
+        tmpFile = "%s.%i.tmp.npy" % (cacheFile[:-len(".npy")], os.getpid())
+        np.save(tmpFile, field)
+        os.replace(tmpFile, cacheFile)
+        logger.info("The static field is cached in " + str(cacheFile))
+    except:
+        logger.warning("The static field cannot be cached in " + str(cacheFile))
+    if locked:
+        try:
+            os.remove(lockFile)
+        except:
+            pass
+    
+    return field
+
+def getMapAttributesUsingMapattr(cloneMap):
     cOut,err = subprocess.Popen(str('mapattr -p %s ' %(cloneMap)), stdout=subprocess.PIPE,stderr=open(os.devnull),shell=True).communicate()
 
-    if err !=None or cOut == []:
+    if err !=None or cOut == [] or len(cOut.split()) < 20:
         print("Something wrong with mattattr in virtualOS, maybe clone Map does not exist ? ")
         sys.exit()
-    cellsize = float(cOut.split()[7])
-    if arcDegree == True: cellsize = round(cellsize * 360000.)/360000.
-    mapAttr = {'cellsize': float(cellsize)        ,\
+    mapAttr = {'cellsize': float(cOut.split()[7]) ,\
                'rows'    : float(cOut.split()[3]) ,\
                'cols'    : float(cOut.split()[5]) ,\
                'xUL'     : float(cOut.split()[17]),\
                'yUL'     : float(cOut.split()[19])}
     co = None; cOut = None; err = None
     del co; del cOut; del err
-    n = gc.collect() ; del gc.garbage[:] ; n = None ; del n
     return mapAttr 
 
+def getMapAttributesALL(cloneMap,arcDegree=True):
+    return getCloneGeometry(cloneMap, arcDegree)
+
 def getMapAttributes(cloneMap,attribute,arcDegree=True):
-    cOut,err = subprocess.Popen(str('mapattr -p %s ' %(cloneMap)), stdout=subprocess.PIPE,stderr=open(os.devnull),shell=True).communicate()
-    #print cOut
-    if err !=None or cOut == []:
-        print("Something wrong with mattattr in virtualOS, maybe clone Map does not exist ? ")
-        sys.exit()
-    #print cOut.split()
-    co = None; err = None
-    del co; del err
-    n = gc.collect() ; del gc.garbage[:] ; n = None ; del n
-    if attribute == 'cellsize':
-        cellsize = float(cOut.split()[7])
-        if arcDegree == True: cellsize = round(cellsize * 360000.)/360000.
-        return cellsize  
-    if attribute == 'rows':
-        return int(cOut.split()[3])
-        #return float(cOut.split()[3])
-    if attribute == 'cols':
-        return int(cOut.split()[5])
-        #return float(cOut.split()[5])
-    if attribute == 'xUL':
-        return float(cOut.split()[17])
-    if attribute == 'yUL':
-        return float(cOut.split()[19])
+    return getCloneGeometry(cloneMap, arcDegree)[attribute]
     
 def getMapTotal(mapFile):
     ''' outputs the sum of all values in a map file '''
@@ -2067,6 +3093,43 @@ def regridMapFile2FinerGrid (rescaleFac,coarse):
     return pcr.numpy2pcr(pcr.Scalar, regridData2FinerGrid(rescaleFac,pcr.pcr2numpy(coarse,MV),MV),MV)
     
 def regridData2FinerGrid(rescaleFac,coarse,MV):
+    # block-replicate: every coarse cell is copied to rescaleFac x rescaleFac fine cells (masked cells get the value MV)
+    if rescaleFac ==1:
+        return coarse
+    coarse = np.ma.filled(coarse, MV)
+    nr,nc = np.shape(coarse)
+    # one copy only: the broadcasted (nr, fac, nc, fac) view is reshaped to the fine grid
+    fine = np.broadcast_to(coarse.astype(np.float64)[:, None, :, None], (nr, rescaleFac, nc, rescaleFac))
+    return fine.reshape(nr*rescaleFac, nc*rescaleFac)
+
+def regridToCoarse(fine,fac,mode,missValue):
+    # block-reduce: every fac x fac block of fine cells is aggregated (average, median, sum, min or max) to a coarse cell 
+    # - cells with missValue (or NaN) are ignored; blocks without any valid value get the value MV
+    # - trailing rows/columns that do not fill a complete block are ignored
+    nr,nc = np.shape(fine)
+    nr = nr//fac; nc = nc//fac
+    blocks = np.ma.filled(fine, missValue)[0:nr*fac, 0:nc*fac].astype(np.float64).reshape(nr, fac, nc, fac)
+    blocks = np.where(np.isclose(blocks, missValue), np.nan, blocks)
+    valid  = np.any(~np.isnan(blocks), axis = (1, 3))
+    # all-NaN blocks give RuntimeWarnings; these blocks are set to MV below
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category = RuntimeWarning)
+        if mode == 'average':
+            coarse = np.nanmean(blocks, axis = (1, 3))
+        elif mode == 'median': 
+            coarse = np.nanmedian(blocks.transpose(0, 2, 1, 3).reshape(nr, nc, fac*fac), axis = 2)
+        elif mode == 'sum':
+            coarse = np.nansum(blocks, axis = (1, 3))
+        elif mode =='min':
+            coarse = np.nanmin(blocks, axis = (1, 3))
+        elif mode == 'max':
+            coarse = np.nanmax(blocks, axis = (1, 3))
+        else:
+            coarse = np.zeros((nr, nc)) + MV
+    coarse[~valid] = MV
+    return coarse    
+        
+def regridData2FinerGridOLD(rescaleFac,coarse,MV):
     if rescaleFac ==1:
         return coarse
     nr,nc = np.shape(coarse)
@@ -2088,9 +3151,9 @@ def regridData2FinerGrid(rescaleFac,coarse,MV):
     n = gc.collect() ; del gc.garbage[:] ; n = None ; del n
     return fine
 
-def regridToCoarse(fine,fac,mode,missValue):
+def regridToCoarseOLD(fine,fac,mode,missValue):
     nr,nc = np.shape(fine)
-    coarse = np.zeros(nr/fac * nc / fac).reshape(nr/fac,nc/fac) + MV
+    coarse = np.zeros((nr//fac) * (nc//fac)).reshape(nr//fac,nc//fac) + MV
     nr,nc = np.shape(coarse)
     for r in range(0,nr):
         for c in range(0,nc):
@@ -2767,17 +3830,29 @@ def waterAbstractionAndAllocationOLD(water_demand_volume,available_water_volume,
 
 def findLastYearInNCFile(ncFile):
 
-    # open a netcdf file:
-    if ncFile in list(filecache.keys()):
-        f = filecache[ncFile]
-    else:
-        f = nc.Dataset(ncFile)
-        filecache[ncFile] = f
+    # open a netcdf file and get the last datetime (from the time index cache):
+    with netcdf_lock:
+        f = openDataset(ncFile)
+        last_datetime_year = getNCTimeIndex(ncFile, f).last_year
 
-    # last datetime
-    last_datetime_year = findLastYearInNCTime(f.variables['time']) 
-    
     return last_datetime_year
+
+def findLastValidDateInNCFile(ncFile, varNames):
+    # the last date (of the time axis) for which all given variables have data (not only missing values), e.g. to resume a run whose output file may have a partly written last time step
+    # - returns None if there is no such date
+    # - the file is opened and closed here (not kept in filecache), as it may be opened for writing afterwards
+    with netcdf_lock:
+        f = nc.Dataset(ncFile)
+        try:
+            times = f.variables['time']
+            values = np.ma.masked_invalid(np.ma.asarray(times[:]))
+            for idx in range(len(values) - 1, -1, -1):
+                if values.mask is not np.ma.nomask and values.mask[idx]: continue
+                if all(np.ma.count(np.ma.masked_values(np.ma.asarray(f.variables[varName][idx]), MV)) > 0 for varName in varNames):
+                    return nc.num2date(float(values[idx]), times.units, getattr(times, "calendar", "standard"))
+            return None
+        finally:
+            f.close()
     
 def findLastYearInNCTime(ncTimeVariable):
 